@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+GitHub Release Manager - 性能基准测试
+启动一个模拟 GitHub API、codeload 源代码包和资源下载的本地 HTTP 服务器，
+生成指定数量和大小的仓库、版本与资源，在子进程中运行 update，
+以 JSON 输出耗时、吞吐量、API 调用次数、峰值内存和线程数，便于比较不同版本。
+使用 --startup 时改为测量本地命令（help、list 等）的启动耗时和导入的模块。
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import socket
+import hashlib
+import argparse
+import statistics
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+BLOCK_SIZE = 64 * 1024  # 生成文件内容时的块大小
+NETWORK_MODULES = ("requests", "urllib3", "asyncio", "aiohttp")  # 本地命令不应导入的模块
+# grm 构建的 GraphQL 查询中每个仓库的字段：别名、owner、name、取多少个版本和资源文件
+GRAPHQL_REPOSITORY = re.compile(
+    r'(\w+): repository\(owner: ("(?:[^"\\]|\\.)*"), name: ("(?:[^"\\]|\\.)*")\) \{ '
+    r'releases\(first: (\d+)[^)]*\) \{.*?releaseAssets\(first: (\d+)\)')
+
+def parse_size(value):
+    """解析带单位的大小，如 512K、10M、1G"""
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+class FakeGitHub:
+    """模拟的 GitHub 服务器数据和统计
+
+    每个仓库有 releases 个版本，每个版本有 assets 个资源文件。文件内容由文件名决定，
+    按块生成，不占用与文件大小相当的内存；支持 Range 请求。
+    """
+
+    def __init__(self, repos, releases, assets, asset_size, archive_size, latency=0.0, failure_rate=0.0, seed=0):
+        self.repos = [("bench", f"repo{i}") for i in range(repos)]
+        self.releases = releases
+        self.assets = assets
+        self.asset_size = asset_size
+        self.archive_size = archive_size
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"api_calls": 0, "graphql_calls": 0, "not_modified": 0, "codeload_requests": 0,
+                      "asset_requests": 0, "bytes_served": 0, "injected_failures": 0}
+        self.base_url = None
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def should_fail(self):
+        with self.lock:
+            failed = self.failure_rate > 0 and self.random.random() < self.failure_rate
+            if failed:
+                self.stats["injected_failures"] += 1
+            return failed
+
+    def release_list(self, owner, repo):
+        """返回仓库的版本列表（从新到旧），与 REST 接口结构相同"""
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        result = []
+        for i in range(self.releases, 0, -1):
+            tag = f"v1.{i}.0"
+            published = (start + timedelta(days=7 * i)).strftime("%Y-%m-%dT%H:%M:%SZ")
+            result.append({
+                "tag_name": tag,
+                "name": tag,
+                "published_at": published,
+                "body": "benchmark release",
+                "assets": [{
+                    "name": f"{repo}-{tag}-{n}.bin",
+                    "size": self.asset_size,
+                    "updated_at": published,
+                    "browser_download_url": f"{self.base_url}/dl/{owner}/{repo}/{tag}/{repo}-{tag}-{n}.bin"
+                } for n in range(self.assets)],
+                "zipball_url": f"{self.base_url}/repos/{owner}/{repo}/zipball/{tag}",
+                "tarball_url": f"{self.base_url}/repos/{owner}/{repo}/tarball/{tag}"
+            })
+        return result
+
+    def graphql_repository(self, owner, repo, releases, assets):
+        """返回 GraphQL 查询中一个仓库的结果，与 GitHub GraphQL 接口结构相同"""
+        return {"releases": {"nodes": [{
+            "tagName": release["tag_name"],
+            "publishedAt": release["published_at"],
+            "isDraft": False,
+            "releaseAssets": {
+                "pageInfo": {"hasNextPage": len(release["assets"]) > assets},
+                "nodes": [{
+                    "name": asset["name"],
+                    "size": asset["size"],
+                    "downloadUrl": asset["browser_download_url"],
+                    "updatedAt": asset["updated_at"]
+                } for asset in release["assets"][:assets]]
+            }
+        } for release in self.release_list(owner, repo)[:releases]]}}
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None  # FakeGitHub 实例，由 start_server 设置
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, headers=None):
+        body = json.dumps(data).encode()
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.fake.count("not_modified")
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("X-RateLimit-Limit", "5000")
+        self.send_header("X-RateLimit-Remaining", "4999")
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_status(self, code):
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_content(self, name, size):
+        """发送由文件名决定的内容，支持 Range；注入故障时只发送一半后断开连接"""
+        block = (hashlib.sha256(name.encode()).digest() * (BLOCK_SIZE // 32))[:BLOCK_SIZE]
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            first, _, last = range_header[6:].partition("-")
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        length = end - start + 1
+        truncate = length > 1 and self.fake.should_fail()
+
+        self.send_response(status)
+        self.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+
+        remaining = length // 2 if truncate else length
+        offset = start
+        while remaining > 0:
+            chunk = block[offset % BLOCK_SIZE:][:remaining]
+            self.wfile.write(chunk)
+            offset += len(chunk)
+            remaining -= len(chunk)
+        self.fake.count("bytes_served", (length // 2) if truncate else length)
+        if truncate:
+            self.wfile.flush()
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+
+    def do_POST(self):
+        """GraphQL 接口：回答 grm 构建的带别名的批量查询，未知仓库返回 null 和错误信息"""
+        fake = self.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlparse(self.path).path != "/graphql":
+            return self.send_error_status(404)
+        fake.count("graphql_calls")
+        if fake.should_fail():
+            return self.send_error_status(502)
+        try:
+            query = json.loads(body)["query"]
+        except (ValueError, KeyError, TypeError):
+            return self.send_error_status(400)
+        data, errors = {}, []
+        for alias, owner, repo, releases, assets in GRAPHQL_REPOSITORY.findall(query):
+            owner, repo = json.loads(owner), json.loads(repo)
+            if (owner, repo) not in fake.repos:
+                data[alias] = None
+                errors.append({"path": [alias],
+                               "message": f"Could not resolve to a Repository with the name '{owner}/{repo}'."})
+                continue
+            data[alias] = fake.graphql_repository(owner, repo, int(releases), int(assets))
+        payload = {"data": data}
+        if errors:
+            payload["errors"] = errors
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-RateLimit-Limit", "5000")
+        self.send_header("X-RateLimit-Remaining", "4999")
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        fake = self.fake
+        if fake.latency:
+            time.sleep(fake.latency)
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+
+        if parts[0] == "repos" and len(parts) >= 4:
+            owner, repo, kind = parts[1], parts[2], parts[3]
+            if (owner, repo) not in fake.repos:
+                return self.send_error_status(404)
+            if kind in ("zipball", "tarball"):
+                # 与 GitHub 一样重定向到 codeload
+                fake.count("api_calls")
+                archive = "zip" if kind == "zipball" else "tar.gz"
+                self.send_response(302)
+                self.send_header("Location", f"{fake.base_url}/codeload/{owner}/{repo}/{archive}/{parts[4]}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            fake.count("api_calls")
+            if fake.should_fail():
+                return self.send_error_status(502)
+            releases = fake.release_list(owner, repo)
+            if len(parts) >= 5 and parts[4] == "latest":
+                return self.send_json(releases[0])
+            query = parse_qs(url.query)
+            per_page = int(query.get("per_page", ["30"])[0])
+            page = int(query.get("page", ["1"])[0])
+            headers = {}
+            if page * per_page < len(releases):
+                headers["Link"] = (f'<{fake.base_url}/repos/{owner}/{repo}/releases?'
+                                   f'per_page={per_page}&page={page + 1}>; rel="next"')
+            return self.send_json(releases[(page - 1) * per_page:page * per_page], headers)
+
+        if parts[0] == "codeload" and len(parts) == 5:
+            fake.count("codeload_requests")
+            return self.send_content(self.path, fake.archive_size)
+
+        if parts[0] == "dl" and len(parts) == 5:
+            fake.count("asset_requests")
+            return self.send_content(parts[4], fake.asset_size)
+
+        self.send_error_status(404)
+
+def start_server(fake):
+    """在后台线程中启动模拟服务器，返回服务器对象"""
+    handler = type("Handler", (FakeGitHubHandler,), {"fake": fake})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    fake.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def read_proc_status(pid):
+    """读取 /proc/<pid>/status 中的线程数和常驻内存（KB），非 Linux 系统返回 None"""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["Threads"]), int(fields["VmRSS"].split()[0])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def run_update(grm_main, workdir, extra_args):
+    """在子进程中运行一次 update，返回耗时、峰值线程数和峰值内存"""
+    command = [sys.executable, str(grm_main), "update"] + extra_args
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    peak_threads, peak_rss = 0, 0
+
+    # 后台读取日志，避免管道写满阻塞子进程
+    log_lines = []
+    reader = threading.Thread(target=lambda: log_lines.extend(process.stderr), daemon=True)
+    reader.start()
+    while process.poll() is None:
+        status = read_proc_status(process.pid)
+        if status:
+            peak_threads = max(peak_threads, status[0])
+            peak_rss = max(peak_rss, status[1])
+        time.sleep(0.02)
+    wall_time = time.perf_counter() - started
+    reader.join()
+
+    if not peak_rss:
+        # 没有 /proc 时退回 getrusage：所有已结束子进程中的最大值，Linux 上单位为 KB，macOS 上为字节
+        try:
+            import resource
+            peak_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            if sys.platform == "darwin":
+                peak_rss //= 1024
+        except ImportError:
+            pass
+
+    errors = sum(1 for line in log_lines if b" - ERROR - " in line)
+    return {
+        "exit_code": process.returncode,
+        "wall_time": round(wall_time, 3),
+        "peak_threads": peak_threads or None,
+        "peak_rss_kb": peak_rss or None,
+        "error_lines": errors
+    }
+
+def startup_commands(keep):
+    """启动测量使用的本地命令，都不需要访问网络"""
+    return [
+        ["help"],
+        ["list"],
+        ["default-versions", str(keep)],
+        ["set-versions", "https://github.com/bench/repo0", str(keep)]
+    ]
+
+def run_startup(grm_main, workdir, command, runs):
+    """运行 runs 次本地命令测量启动耗时，再用 -X importtime 运行一次统计导入耗时和导入的网络模块"""
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, str(grm_main)] + command, cwd=workdir,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - started)
+
+    process = subprocess.run([sys.executable, "-X", "importtime", str(grm_main)] + command, cwd=workdir,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace")
+    import_us = 0
+    imported = set()
+    for line in process.stderr.splitlines():
+        # 格式: "import time: 自身耗时 | 累计耗时 | 模块名"（微秒，子模块名带缩进）
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        import_us += int(fields[0])
+        name = fields[2].strip()
+        if name in NETWORK_MODULES:
+            imported.add(name)
+
+    return {
+        "command": " ".join(command),
+        "exit_code": process.returncode,
+        "runs": runs,
+        "median_ms": round(statistics.median(times) * 1000, 1),
+        "min_ms": round(min(times) * 1000, 1),
+        "import_ms": round(import_us / 1000, 1),
+        "network_modules": sorted(imported)
+    }
+
+def run_startup_benchmark(args):
+    """测量本地命令的启动耗时，本地命令导入网络模块或超过 --max-startup-ms 时记录为违规"""
+    grm_main = Path(args.grm).resolve()
+    runs = args.runs or 10
+    results = []
+    with tempfile.TemporaryDirectory(prefix="grm-bench-") as workdir:
+        config = {
+            "repositories": [{"owner": "bench", "repo": f"repo{i}", "max_versions": args.keep}
+                             for i in range(args.repos)],
+            "base_dir": str(Path(workdir) / "downloads"),
+            "default_max_versions": args.keep,
+            "proxy_prefix": ""
+        }
+        with open(Path(workdir) / "config.json", "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False, indent=4)
+        # 先运行一次 list，创建状态库，之后测量的都是常规启动
+        subprocess.run([sys.executable, str(grm_main), "list"], cwd=workdir,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for command in startup_commands(args.keep):
+            results.append(run_startup(grm_main, workdir, command, runs))
+
+    violations = []
+    for result in results:
+        if result["network_modules"]:
+            violations.append(f"{result['command']}: 导入了 {', '.join(result['network_modules'])}")
+        if args.max_startup_ms and result["median_ms"] > args.max_startup_ms:
+            violations.append(f"{result['command']}: 启动耗时 {result['median_ms']} ms 超过 {args.max_startup_ms} ms")
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "grm": str(grm_main),
+        "revision": git_revision(grm_main.parent),
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "parameters": {"repos": args.repos, "runs": runs, "max_startup_ms": args.max_startup_ms},
+        "startup": results,
+        "violations": violations
+    }
+
+def count_complete_releases(base_dir):
+    """统计已生成 files_info.txt 的版本目录数"""
+    return sum(1 for _ in Path(base_dir).glob("*/*/*/files_info.txt"))
+
+def git_revision(path):
+    """返回被测代码所在仓库的提交号，不是 git 仓库时返回 None"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=path,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(args):
+    fake = FakeGitHub(args.repos, args.releases, args.assets, args.asset_size, args.archive_size,
+                      args.latency / 1000, args.failure_rate, args.seed)
+    server = start_server(fake)
+    grm_main = Path(args.grm).resolve()
+
+    results = []
+    try:
+        for run in range(args.runs or 1):
+            with tempfile.TemporaryDirectory(prefix="grm-bench-") as workdir:
+                config = {
+                    "repositories": [{"owner": owner, "repo": repo, "max_versions": args.keep}
+                                     for owner, repo in fake.repos],
+                    "base_dir": str(Path(workdir) / "downloads"),
+                    "default_max_versions": args.keep,
+                    "proxy_prefix": "",
+                    "api_url": fake.base_url
+                }
+                if args.discovery == "graphql":
+                    config["github_token"] = "benchmark"  # GraphQL 查询需要 Token，模拟服务器不做校验
+                for item in args.set or []:
+                    key, _, value = item.partition("=")
+                    try:
+                        config[key] = json.loads(value)
+                    except ValueError:
+                        config[key] = value
+                with open(Path(workdir) / "config.json", "w", encoding="utf-8") as f:
+                    json.dump(config, f, ensure_ascii=False, indent=4)
+
+                extra_args = ["--engine", args.engine] if args.engine else []
+                if args.discovery == "graphql":
+                    extra_args.append("--graphql")
+                # 第一次为全新下载，--rerun 时再运行一次，测量没有新版本时的增量检查
+                phases = ["cold", "warm"] if args.rerun else ["cold"]
+                for phase in phases:
+                    before = dict(fake.stats)
+                    result = run_update(grm_main, workdir, extra_args)
+                    served = {key: fake.stats[key] - before[key] for key in fake.stats}
+                    result.update({
+                        "run": run + 1,
+                        "phase": phase,
+                        "api_calls": served["api_calls"],
+                        "graphql_calls": served["graphql_calls"],
+                        "not_modified": served["not_modified"],
+                        "downloads": served["codeload_requests"] + served["asset_requests"],
+                        "bytes_downloaded": served["bytes_served"],
+                        "throughput_mb_s": round(served["bytes_served"] / result["wall_time"] / 1024 ** 2, 2),
+                        "injected_failures": served["injected_failures"],
+                        "complete_releases": count_complete_releases(config["base_dir"])
+                    })
+                    results.append(result)
+    finally:
+        server.shutdown()
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "grm": str(grm_main),
+        "revision": git_revision(grm_main.parent),
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "parameters": {
+            "repos": args.repos,
+            "releases": args.releases,
+            "keep": args.keep,
+            "assets": args.assets,
+            "asset_size": args.asset_size,
+            "archive_size": args.archive_size,
+            "latency_ms": args.latency,
+            "failure_rate": args.failure_rate,
+            "engine": args.engine or "thread",
+            "discovery": args.discovery,
+            "config": args.set or []
+        },
+        "expected_releases": args.repos * min(args.keep, args.releases),
+        "results": results
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='GitHub Release Manager 性能基准测试')
+    parser.add_argument('--repos', type=int, default=10, help='模拟的仓库数（默认 10）')
+    parser.add_argument('--releases', type=int, default=5, help='每个仓库的版本数（默认 5）')
+    parser.add_argument('--keep', type=int, default=3, help='每个仓库保留的版本数（默认 3）')
+    parser.add_argument('--assets', type=int, default=4, help='每个版本的资源文件数（默认 4）')
+    parser.add_argument('--asset-size', type=parse_size, default=parse_size("1M"), help='资源文件大小，如 512K、10M（默认 1M）')
+    parser.add_argument('--archive-size', type=parse_size, default=parse_size("256K"), help='源代码包大小（默认 256K）')
+    parser.add_argument('--latency', type=float, default=0, help='每个请求的延迟，毫秒（默认 0）')
+    parser.add_argument('--failure-rate', type=float, default=0, help='注入故障的概率：API 返回 502，下载中途断开（默认 0）')
+    parser.add_argument('--seed', type=int, default=0, help='故障注入的随机种子')
+    parser.add_argument('--engine', choices=['thread', 'async'], help='更新引擎（默认使用配置中的设置）')
+    parser.add_argument('--discovery', choices=['rest', 'graphql'], default='rest',
+                        help='获取版本列表的方式，graphql 时使用 update --graphql（默认 rest）')
+    parser.add_argument('--runs', type=int, help='重复运行次数，每次使用新的下载目录（默认 1，--startup 时默认 10）')
+    parser.add_argument('--rerun', action='store_true', help='每次下载完成后再运行一次 update，测量增量检查')
+    parser.add_argument('--set', action='append', metavar='KEY=VALUE', help='额外的配置项，值按 JSON 解析，如 --set workers=16')
+    parser.add_argument('--grm', default=str(Path(__file__).resolve().parent / 'grm' / 'main.py'),
+                        help='被测的 grm/main.py 路径，可指向其他版本的代码（默认当前仓库）')
+    parser.add_argument('--startup', action='store_true', help='测量本地命令的启动耗时和导入的模块，不启动模拟服务器')
+    parser.add_argument('--max-startup-ms', type=float, help='--startup 时允许的最大启动耗时中位数（毫秒），超过时以状态码 1 退出')
+    parser.add_argument('-o', '--output', help='结果 JSON 文件路径（默认输出到标准输出）')
+
+    args = parser.parse_args()
+    report = run_startup_benchmark(args) if args.startup else run_benchmark(args)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+        print(f"结果已写入: {args.output}")
+    else:
+        print(output)
+    if report.get("violations"):
+        for violation in report["violations"]:
+            print(f"启动回归: {violation}", file=sys.stderr)
+        sys.exit(1)
@@ -1,9 +1,18 @@
 import os
+import json
 import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import argparse
 
+CACHE_FILE = ".files_info.cache.json"  # 目录哈希缓存文件名，格式与 grm 一致
+MANIFEST_FILE = "files_info.json"  # 机器可读清单，格式与 grm 一致
+DELTA_SUFFIX = ".grmdelta"  # grm 增量存储的文件（按还原后的文件记录）
+DELTA_MAGIC = b"GRMDELTA1\n"
+HASH_ALGORITHMS = ["md5", "sha1", "sha256", "sha512"]
+CHUNK_SIZE = 1024 * 1024  # 每次读取的块大小，单个文件占用的内存与文件大小无关
+
 def format_size(size):
     """格式化文件大小"""
     for unit in ['B', 'KB', 'MB', 'GB']:
@@ -12,83 +21,245 @@ def format_size(size):
         size /= 1024
     return f"{size:.2f} TB"
 
-def calculate_file_hashes(file_path):
-    """计算文件的多种哈希值"""
+def calculate_file_hashes(file_path, algorithms=HASH_ALGORITHMS):
+    """分块读取文件，一次遍历计算多种哈希值"""
     hashes = {}
     try:
+        hashers = [hashlib.new(name) for name in algorithms]
         with open(file_path, 'rb') as f:
-            data = f.read()
-            hashes['md5'] = hashlib.md5(data).hexdigest()
-            hashes['sha1'] = hashlib.sha1(data).hexdigest()
-            hashes['sha256'] = hashlib.sha256(data).hexdigest()
-            hashes['sha512'] = hashlib.sha512(data).hexdigest()
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                for hasher in hashers:
+                    hasher.update(chunk)
+        for name, hasher in zip(algorithms, hashers):
+            hashes[name] = hasher.hexdigest()
     except Exception as e:
         print(f"计算文件哈希值时出错 {file_path}: {e}")
+        return {}
     return hashes
 
-def generate_file_info(directory):
-    """生成目录下所有文件的信息记录"""
-    directory = Path(directory)
-    if not directory.exists():
-        print(f"目录不存在: {directory}")
-        return
-    
+def write_text_atomic(path, text):
+    """先写入临时文件再替换，读取方不会看到写了一半的文件"""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def is_ignored(name):
+    """信息文件、哈希缓存（含写入中的临时文件）和未完成的下载不计入记录，与 grm 的 is_file_info_ignored 一致"""
+    return (name in ("files_info.txt", MANIFEST_FILE, CACHE_FILE,
+                     "files_info.txt.tmp", MANIFEST_FILE + ".tmp", CACHE_FILE + ".tmp")
+            or name.endswith((".part", ".segments", ".resume", ".link", DELTA_SUFFIX + ".tmp", ".restore")))
+
+def load_cache(directory):
+    """读取目录的哈希缓存 {相对路径: {"key": [大小, 修改时间(ns), inode], "hashes": {...}}}"""
+    try:
+        with open(directory / CACHE_FILE, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def load_manifest(directory):
+    """读取目录的清单，返回 {相对路径: 记录}"""
+    try:
+        with open(directory / MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            files = json.load(f).get("files")
+        return files if isinstance(files, dict) else {}
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+def read_delta_header(path):
+    """读取 grm 增量存储文件的头部，格式不正确时返回 None"""
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+                return None
+            return json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+
+def cache_key(stat, header=None):
+    """缓存键：大小、修改时间和 inode，增量存储的文件使用还原后的大小"""
+    return [header["size"] if header else stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+def write_file_info(directory, entries, hashes, algorithms=HASH_ALGORITHMS, deltas=None):
+    """根据文件列表和哈希值写入目录的 files_info.txt、清单和哈希缓存
+
+    entries 为该目录下（含子目录）的 (路径, stat) 列表，hashes 为 {路径: 哈希值字典}。
+    deltas 为 {路径: 增量存储文件头部}，这些文件的 stat 为增量文件的 stat。
+    清单中已有的 expected_size 和 url（由 grm 下载时写入）保持不变。
+    与已有缓存相比没有任何变化时不重写，返回是否写入。
+    """
+    deltas = deltas or {}
+    new_cache = {}
     info = []
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file == "files_info.txt":  # 跳过信息文件本身
-                continue
-            file_path = os.path.join(root, file)
-            relative_path = os.path.relpath(file_path, directory)
-            file_size = os.path.getsize(file_path)
-            file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-            hashes = calculate_file_hashes(file_path)
-            
-            info.append({
-                "文件名": relative_path,
-                "大小": format_size(file_size),
-                "修改时间": file_time.strftime("%Y-%m-%d %H:%M:%S"),
-                "哈希值": hashes
-            })
-    
-    # 将信息写入文件
+    old_manifest = load_manifest(directory)
+    manifest = {}
+    for path, stat in entries:
+        if path not in hashes:
+            continue
+        header = deltas.get(path)
+        size = header["size"] if header else stat.st_size
+        relative_path = os.path.relpath(path, directory)
+        new_cache[relative_path] = {"key": cache_key(stat, header), "hashes": hashes[path]}
+        file_time = datetime.fromtimestamp(stat.st_mtime)
+        old = old_manifest.get(relative_path, {})
+        manifest[relative_path] = {
+            "size": size,
+            "expected_size": old.get("expected_size"),
+            "modified": file_time.isoformat(timespec="seconds"),
+            "hashes": hashes[path],
+            "url": old.get("url")
+        }
+        storage = None
+        if header:
+            storage = manifest[relative_path]["storage"] = {
+                "method": header["method"], "stored_size": stat.st_size,
+                "base": f"{header['base_tag']}/{header['base_name']}" if header.get("base_tag") else None
+            }
+
+        info.append({
+            "文件名": relative_path,
+            "大小": format_size(size),
+            "修改时间": file_time.strftime("%Y-%m-%d %H:%M:%S"),
+            "哈希值": hashes[path],
+            "存储": storage
+        })
+
     info_file = directory / "files_info.txt"
-    with open(info_file, 'w', encoding='utf-8') as f:
-        f.write("文件信息记录\n")
-        f.write("=" * 50 + "\n\n")
-        for item in info:
-            f.write(f"文件名: {item['文件名']}\n")
-            f.write(f"大小: {item['大小']}\n")
-            f.write(f"修改时间: {item['修改时间']}\n")
-            f.write("哈希值:\n")
-            for hash_type, hash_value in item['哈希值'].items():
-                f.write(f"  {hash_type}: {hash_value}\n")
-            f.write("-" * 50 + "\n")
-    
+    if new_cache == load_cache(directory) and info_file.exists() and manifest == old_manifest:
+        print(f"文件没有变化，保留原有记录: {info_file}")
+        return False
+
+    # 将信息写入文件，每个文件都先写临时文件再替换
+    lines = ["文件信息记录", "=" * 50, ""]
+    for item in info:
+        lines.append(f"文件名: {item['文件名']}")
+        lines.append(f"大小: {item['大小']}")
+        lines.append(f"修改时间: {item['修改时间']}")
+        if item["存储"]:
+            lines.append(f"存储: 增量 ({item['存储']['method']})，实际占用 {format_size(item['存储']['stored_size'])}")
+        lines.append("哈希值:")
+        for hash_type, hash_value in item['哈希值'].items():
+            lines.append(f"  {hash_type}: {hash_value}")
+        lines.append("-" * 50)
+    write_text_atomic(info_file, "\n".join(lines) + "\n")
+    write_text_atomic(directory / MANIFEST_FILE, json.dumps(
+        {"format": 1, "generated_at": datetime.now().isoformat(timespec="seconds"), "files": manifest},
+        ensure_ascii=False, indent=1))
+    write_text_atomic(directory / CACHE_FILE, json.dumps(new_cache, ensure_ascii=False))
+
     print(f"已生成文件信息记录: {info_file}")
+    return True
 
-def process_directory(directory, recursive=False):
-    """处理目录，可选择是否递归处理子目录"""
+def process_directory(directory, recursive=False, jobs=None, algorithms=HASH_ALGORITHMS):
+    """处理目录，可选择是否递归处理子目录
+
+    只遍历一次目录树，每个文件最多计算一次哈希（递归时父目录和子目录共用结果）。
+    缓存未命中的文件交给 jobs 个线程并行计算，hashlib 在计算大块数据时会释放 GIL，
+    因此可以利用多个 CPU 核心；每个线程一次只读取一块数据，内存占用与文件大小无关。
+    """
     directory = Path(directory)
     if not directory.exists():
         print(f"目录不存在: {directory}")
         return
-    
-    # 处理当前目录
-    print(f"\n处理目录: {directory}")
-    generate_file_info(directory)
-    
-    # 如果启用递归，处理所有子目录
-    if recursive:
-        for item in directory.iterdir():
-            if item.is_dir():
-                process_directory(item, recursive=True)
+
+    # 遍历一次目录树，把每个文件分配给所有需要处理的上级目录
+    entries = {directory: []}
+    deltas = {}
+    for root, dirs, files in os.walk(directory):
+        root = Path(root)
+        # 跳过 grm 的内部目录（.blobs、.staging、.trash、.delta-cache 等）
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        if recursive:
+            for name in dirs:
+                entries[root / name] = []
+        for name in files:
+            if is_ignored(name):  # 跳过信息文件、缓存和未完成的文件
+                continue
+            path = root / name
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:  # 遍历期间被 grm 移动或删除
+                continue
+            if name.endswith(DELTA_SUFFIX):
+                # grm 增量存储的文件按还原后的文件记录（同时存在完整文件时以完整文件为准）
+                header = read_delta_header(path)
+                path = root / name[:-len(DELTA_SUFFIX)]
+                if header is None or path.exists():
+                    continue
+                deltas[path] = header
+            entry = (path, stat)
+            parent = root
+            while True:
+                if parent in entries:
+                    entries[parent].append(entry)
+                if parent == directory:
+                    break
+                parent = parent.parent
+
+    # 各目录缓存中大小、修改时间和 inode 一致的文件直接使用缓存的哈希值
+    hashes = {}
+    stats = {path: stat for path, stat in entries[directory]}
+    for target in entries:
+        for relative_path, item in load_cache(target).items():
+            path = target / relative_path
+            stat = stats.get(path)
+            if (path not in hashes and stat is not None and item.get("key") == cache_key(stat, deltas.get(path))
+                    and all(name in item.get("hashes", {}) for name in algorithms)):
+                hashes[path] = {name: item["hashes"][name] for name in algorithms}
+    cached_bytes = sum(stats[path].st_size for path in hashes)
+    cached_count = len(hashes)
+
+    # 增量存储的文件无法直接读取，使用清单中 sha256 与增量文件头部一致的记录
+    for path, header in deltas.items():
+        if path in hashes:
+            continue
+        for target in entries:
+            if target == path.parent or target in path.parents:
+                item = load_manifest(target).get(os.path.relpath(path, target), {})
+                if (item.get("hashes", {}).get("sha256") == header.get("sha256")
+                        and all(name in item["hashes"] for name in algorithms)):
+                    hashes[path] = {name: item["hashes"][name] for name in algorithms}
+                    break
+        else:
+            print(f"没有可用的哈希值记录，跳过增量存储的文件（可用 grm restore 还原）: {path}")
+
+    # 其余文件并行计算，所选算法共用一次读取；读取失败的文件不写入记录
+    pending = [path for path in stats if path not in hashes and path not in deltas]
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as executor:
+        for path, result in zip(pending, executor.map(lambda p: calculate_file_hashes(p, algorithms), pending)):
+            if result:
+                hashes[path] = result
+            else:
+                print(f"无法计算哈希值，跳过该文件: {path}")
+
+    print(f"使用缓存 {cached_count} 个文件 ({format_size(cached_bytes)})，"
+          f"重新计算 {len(pending)} 个文件 ({format_size(sum(stats[p].st_size for p in pending))})")
+
+    for target, target_entries in entries.items():
+        print(f"\n处理目录: {target}")
+        write_file_info(target, target_entries, hashes, algorithms, deltas)
+
+def generate_file_info(directory, jobs=None, algorithms=HASH_ALGORITHMS):
+    """生成目录下所有文件的信息记录"""
+    process_directory(directory, recursive=False, jobs=jobs, algorithms=algorithms)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='生成文件信息记录工具')
     parser.add_argument('directory', help='要处理的目录路径')
     parser.add_argument('-r', '--recursive', action='store_true', help='递归处理所有子目录')
-    
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='并行计算哈希的线程数（默认为 CPU 核心数）')
+    parser.add_argument('-a', '--algorithms', default=",".join(HASH_ALGORITHMS),
+                        help='要计算的哈希算法，逗号分隔（默认 md5,sha1,sha256,sha512）')
+
     args = parser.parse_args()
-    
-    process_directory(args.directory, args.recursive) 
\ No newline at end of file
+
+    algorithms = [name.strip() for name in args.algorithms.split(",") if name.strip()]
+    # shake_* 的 hexdigest() 需要指定长度，不能用于记录
+    unsupported = [name for name in algorithms
+                   if name not in hashlib.algorithms_available or name.startswith("shake_")]
+    if unsupported or not algorithms:
+        parser.error(f"不支持的哈希算法: {', '.join(unsupported) or args.algorithms}")
+
+    process_directory(args.directory, args.recursive, args.jobs, algorithms)
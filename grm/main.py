@@ -1,18 +1,21 @@
 import os
 import json
-import requests
+import codecs
 import time
 import shutil
 from pathlib import Path
 import logging
-from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 import sys
 import re
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from urllib.parse import urlparse
+from urllib.parse import urlparse, quote, unquote
 import hashlib
+import fnmatch
+import sqlite3
+import threading
+import heapq
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 def print_banner():
     banner = """
@@ -37,29 +40,1748 @@ def print_banner():
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+DEFAULT_HASH_ALGORITHMS = ["md5", "sha1", "sha256", "sha512"]
+HASH_CHUNK_SIZE = 1024 * 1024  # 计算哈希时每次读取的块大小
+API_RETRY_STATUSES = (500, 502, 503, 504)  # API 请求自动重试的状态码
+ASYNC_WRITE_BUFFER = 256 * 1024  # 异步引擎每个下载攒够多少数据后交给线程池写入
+FILE_INFO_CACHE = ".files_info.cache.json"  # 目录哈希缓存文件名
+FILE_MANIFEST = "files_info.json"  # 机器可读的文件清单（与 files_info.txt 内容对应）
+VERIFY_ALGORITHMS = ("sha256", "sha512", "sha1", "md5")  # 校验时按此顺序选用清单中记录的算法
+DOWNLOAD_TIMEOUT = (30, 300)  # 下载的连接和读取超时（秒），卡住的连接超时后换用其他下载前缀
+DELTA_SUFFIX = ".grmdelta"  # 增量存储的文件名后缀（见 DeltaStore）
+
+def is_file_info_ignored(name):
+    """判断文件是否不计入文件信息记录（信息文件本身、哈希缓存、写入中的临时文件和未完成的下载或转换）
+
+    与 generate_file_info.py 的 is_ignored 保持一致。
+    """
+    return (name in ("files_info.txt", FILE_MANIFEST, FILE_INFO_CACHE,
+                     "files_info.txt.tmp", FILE_MANIFEST + ".tmp", FILE_INFO_CACHE + ".tmp")
+            or name.endswith((".part", ".segments", ".resume", ".link", DELTA_SUFFIX + ".tmp", ".restore")))
+
+class ResponseCache:
+    """基于 ETag/Last-Modified 的 HTTP 响应缓存，持久化保存在配置文件旁边"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._entries = self._load()
+
+    def _load(self):
+        """加载缓存文件，文件不存在或损坏时返回空缓存"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            return entries if isinstance(entries, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"HTTP 缓存文件无法读取，已忽略: {self.path}: {e}")
+            return {}
+
+    def conditional_headers(self, url):
+        """返回该地址的条件请求头 (If-None-Match / If-Modified-Since)"""
+        with self._lock:
+            entry = self._entries.get(url)
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def get(self, url):
+        """返回缓存的响应内容，不存在时返回 None"""
+        with self._lock:
+            entry = self._entries.get(url)
+        return entry["body"] if entry else None
+
+    def store(self, url, headers, body):
+        """保存响应内容及其校验头，没有 ETag/Last-Modified 的响应不缓存"""
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+        with self._lock:
+            self._entries[url] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "body": body
+            }
+            self._dirty = True
+
+    def save(self):
+        """将缓存写回磁盘（先写临时文件再替换，避免写坏缓存）"""
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self._entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except OSError as e:
+                logger.error(f"保存 HTTP 缓存失败 {self.path}: {e}")
+
+class Asset:
+    """发布版本中的一个资源文件，只保留下载需要的字段（接口返回的 uploader 等字段不保存）"""
+
+    __slots__ = ("name", "size", "url", "updated_at", "digest")
+
+    def __init__(self, name, size, url, updated_at=None, digest=None):
+        self.name = name
+        self.size = size
+        self.url = url
+        self.updated_at = updated_at
+        self.digest = digest
+
+    @classmethod
+    def from_json(cls, data):
+        """从 REST 接口返回的资源字典（或 to_json 的结果）创建"""
+        return cls(data["name"], data.get("size"), data["browser_download_url"],
+                   data.get("updated_at"), data.get("digest"))
+
+    def to_json(self):
+        """转换为字段名与 REST 接口相同的精简字典，用于保存到响应缓存"""
+        data = {"name": self.name, "size": self.size, "browser_download_url": self.url}
+        if self.updated_at:
+            data["updated_at"] = self.updated_at
+        if self.digest:
+            data["digest"] = self.digest
+        return data
+
+    def __repr__(self):
+        return f"Asset({self.name!r}, {self.size!r})"
+
+class Release:
+    """一个发布版本：标签、发布时间、资源文件和源代码包地址
+
+    接口返回的正文 (body)、作者、reactions 等字段在解析时即丢弃，跟踪大量仓库时
+    所有仓库的版本列表都只占用很少的内存。
+    """
+
+    __slots__ = ("tag", "published_at", "assets", "zipball_url", "tarball_url")
+
+    def __init__(self, tag, published_at=None, assets=(), zipball_url=None, tarball_url=None):
+        self.tag = tag
+        self.published_at = published_at
+        self.assets = tuple(assets)
+        self.zipball_url = zipball_url
+        self.tarball_url = tarball_url
+
+    @classmethod
+    def from_json(cls, data):
+        """从 REST 接口返回的版本字典（或 to_json 的结果）创建"""
+        return cls(data["tag_name"], data.get("published_at"),
+                   [Asset.from_json(asset) for asset in data.get("assets") or ()],
+                   data.get("zipball_url"), data.get("tarball_url"))
+
+    def to_json(self):
+        """转换为字段名与 REST 接口相同的精简字典，用于保存到响应缓存"""
+        data = {"tag_name": self.tag, "published_at": self.published_at,
+                "assets": [asset.to_json() for asset in self.assets]}
+        if self.zipball_url:
+            data["zipball_url"] = self.zipball_url
+        if self.tarball_url:
+            data["tarball_url"] = self.tarball_url
+        return data
+
+    def __repr__(self):
+        return f"Release({self.tag!r}, {len(self.assets)} assets)"
+
+class ReleaseListParser:
+    """增量解析 /releases（版本数组）或 /releases/latest（单个版本）接口的响应
+
+    响应按块传入 feed，每凑齐一个版本对象就用 JSONDecoder.raw_decode 解析并立即转换为
+    Release，已解析的文本随即丢弃。内存中只保留尚未解析完的一个版本的文本，不会同时
+    持有整页响应及其原始字典。响应不完整或格式错误时 close 抛出 ValueError。
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._state = "start"  # start -> items（数组）或 object（单个版本）-> done
+        self._retry_at = 0  # 对象不完整时，缓冲区增长到此长度后再尝试，避免大对象被反复解析
+        self.releases = []
+
+    def feed(self, data):
+        """传入一块响应内容 (bytes)"""
+        self._buffer += self._text.decode(data)
+        self._parse(final=False)
+
+    def close(self):
+        """响应结束，返回解析出的版本列表"""
+        self._buffer += self._text.decode(b"", final=True)
+        self._parse(final=True)
+        if self._state != "done":
+            raise ValueError("版本列表响应不完整")
+        return self.releases
+
+    def _parse(self, final):
+        buffer = self._buffer
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            char = buffer[pos]
+            if self._state == "done":
+                raise ValueError(f"版本列表响应结束后有多余内容: {buffer[pos:pos + 20]!r}")
+            if self._state == "start":
+                if char == "[":
+                    self._state = "items"
+                    pos += 1
+                    continue
+                if char != "{":
+                    raise ValueError(f"无法解析的版本列表响应: {buffer[pos:pos + 20]!r}")
+                self._state = "object"
+            elif char == "]":
+                self._state = "done"
+                pos += 1
+                continue
+            elif char == ",":
+                pos += 1
+                continue
+
+            if not final and len(buffer) - pos < self._retry_at:
+                break
+            try:
+                data, pos_end = self._decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                self._retry_at = 2 * (len(buffer) - pos)
+                break
+            try:
+                release = Release.from_json(data)
+            except (KeyError, TypeError, AttributeError) as e:
+                raise ValueError(f"版本列表中有无法识别的元素: {e!r}") from e
+            self._retry_at = 0
+            self.releases.append(release)
+            pos = pos_end
+            if self._state == "object":
+                self._state = "done"
+        self._buffer = buffer[pos:]
+
+class TokenBucket:
+    """令牌桶限速器，rate 为每秒允许的字节数"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = rate  # 最多积累 1 秒的突发流量
+        self._tokens = rate
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        """取出 amount 个令牌，返回令牌不足时需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            return -self._tokens / self.rate if self._tokens < 0 else 0
+
+    def consume(self, amount):
+        """取出 amount 个令牌，不足时休眠等待"""
+        wait = self.reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+class RunMetrics:
+    """一次运行的统计数据：各仓库各阶段的耗时、字节数、重试次数、跳过和下载的文件数，
+    以及各下载主机（含代理）的流量、耗时和错误数。所有方法都是线程安全的。
+
+    阶段耗时按仓库累加，同一仓库的多个版本并行下载时总和可能大于实际经过的时间。
+    """
+
+    REPO_COUNTERS = ("bytes", "retries", "assets_downloaded", "assets_failed", "assets_skipped",
+                     "assets_linked", "assets_excluded", "assets_delta", "releases_downloaded",
+                     "releases_incomplete", "releases_removed", "delta_saved_bytes")
+
+    def __init__(self, engine="thread"):
+        self.engine = engine
+        self.started_at = time.time()
+        self.finished_at = None
+        self._start = time.monotonic()
+        self._lock = threading.Lock()
+        self._repos = {}
+        self._hosts = {}
+        self._api = {"calls": 0, "not_modified": 0, "rate_limited": 0, "errors": 0}
+
+    def _repo(self, owner, repo):
+        key = f"{owner}/{repo}"
+        stats = self._repos.get(key)
+        if stats is None:
+            stats = self._repos[key] = {"phases": {}, **{name: 0 for name in self.REPO_COUNTERS}}
+        return stats
+
+    def _host(self, host):
+        stats = self._hosts.get(host)
+        if stats is None:
+            stats = self._hosts[host] = {"bytes": 0, "seconds": 0.0, "requests": 0, "errors": 0}
+        return stats
+
+    def count(self, owner, repo, name, amount=1):
+        """累加仓库的计数器"""
+        if amount:
+            with self._lock:
+                self._repo(owner, repo)[name] += amount
+
+    def add_phase(self, owner, repo, phase, seconds):
+        """累加仓库某阶段的耗时，owner 为 None 时记为全局阶段（如 GraphQL 批量查询）"""
+        with self._lock:
+            phases = self._repo(owner, repo)["phases"] if owner else self._repo("*", "*")["phases"]
+            phases[phase] = phases.get(phase, 0.0) + seconds
+
+    def phase(self, owner, repo, phase):
+        """记录一个阶段耗时的上下文管理器"""
+        return _PhaseTimer(self, owner, repo, phase)
+
+    def transfer(self, host, amount, meta=None):
+        """记录从 host 收到的字节数，meta 为该文件的下载信息字典"""
+        with self._lock:
+            self._host(host)["bytes"] += amount
+            if meta is not None:
+                meta["bytes"] = meta.get("bytes", 0) + amount
+
+    def request(self, host, seconds, ok=True):
+        """记录一次下载请求（含重试）的耗时和结果"""
+        with self._lock:
+            stats = self._host(host)
+            stats["requests"] += 1
+            stats["seconds"] += seconds
+            if not ok:
+                stats["errors"] += 1
+
+    def api_call(self, status=None, rate_limited=False):
+        """记录一次 API 请求，status 为 None 表示请求出错"""
+        with self._lock:
+            self._api["calls"] += 1
+            if status == 304:
+                self._api["not_modified"] += 1
+            if rate_limited:
+                self._api["rate_limited"] += 1
+            if status is None or status >= 400:
+                self._api["errors"] += 1
+
+    def record_downloads(self, owner, repo, downloads, results):
+        """根据 download_asset 回传的 meta 汇总一个版本的下载结果"""
+        for args, ok in zip(downloads, results):
+            meta = args[5] if len(args) > 5 and args[5] is not None else {}
+            self.count(owner, repo, "bytes", meta.get("bytes", 0))
+            self.count(owner, repo, "retries", meta.get("retries", 0))
+            self.count(owner, repo, "assets_downloaded" if ok else "assets_failed")
+
+    def finish(self):
+        self.finished_at = time.time()
+        self.wall_time = time.monotonic() - self._start
+
+    def report(self, api_budget=None, mirrors=None, storage=None):
+        """生成 JSON 运行报告，storage 为各仓库增量存储的累计统计（StateIndex.delta_savings）"""
+        if self.finished_at is None:
+            self.finish()
+        with self._lock:
+            repositories = {}
+            for key, stats in sorted(self._repos.items()):
+                item = dict(stats, phases={k: round(v, 3) for k, v in stats["phases"].items()})
+                download_time = stats["phases"].get("download", 0)
+                item["throughput"] = round(stats["bytes"] / download_time) if download_time else 0
+                repositories[key] = item
+            hosts = {host: dict(stats, seconds=round(stats["seconds"], 3),
+                                throughput=round(stats["bytes"] / stats["seconds"]) if stats["seconds"] else 0)
+                     for host, stats in sorted(self._hosts.items())}
+            totals = {name: sum(stats[name] for stats in self._repos.values()) for name in self.REPO_COUNTERS}
+            api = dict(self._api)
+        totals["throughput"] = round(totals["bytes"] / self.wall_time) if self.wall_time else 0
+        if api_budget is not None:
+            api["budget"] = api_budget
+        report = {
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+            "finished_at": datetime.fromtimestamp(self.finished_at).isoformat(timespec="seconds"),
+            "wall_time": round(self.wall_time, 3),
+            "engine": self.engine,
+            "totals": totals,
+            "api": api,
+            "hosts": hosts,
+            "repositories": repositories
+        }
+        if mirrors is not None:
+            report["mirrors"] = mirrors
+        if storage is not None:
+            report["storage"] = storage
+        return report
+
+    def prometheus(self, report):
+        """把运行报告转换为 Prometheus 文本格式（供 node_exporter textfile collector 读取）"""
+        def label(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        lines = []
+
+        def metric(name, help_text, samples, kind="gauge"):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                text = ",".join(f'{k}="{label(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{text}}} {value}" if text else f"{name} {value}")
+
+        repositories = report["repositories"]
+        metric("grm_run_timestamp_seconds", "Unix time the last run finished", [({}, round(self.finished_at))])
+        metric("grm_run_duration_seconds", "Wall time of the last run", [({}, report["wall_time"])])
+        metric("grm_run_bytes", "Bytes downloaded in the last run", [({}, report["totals"]["bytes"])])
+        metric("grm_repo_phase_seconds", "Cumulative seconds per repository and phase",
+               [({"repo": key, "phase": phase}, seconds)
+                for key, stats in repositories.items() for phase, seconds in stats["phases"].items()])
+        metric("grm_repo_bytes", "Bytes downloaded per repository", [({"repo": key}, stats["bytes"])
+                                                                     for key, stats in repositories.items()])
+        metric("grm_repo_retries", "Download retries per repository", [({"repo": key}, stats["retries"])
+                                                                       for key, stats in repositories.items()])
+        metric("grm_repo_assets", "Assets per repository by outcome",
+               [({"repo": key, "status": name[len("assets_"):]}, stats[name])
+                for key, stats in repositories.items() for name in self.REPO_COUNTERS if name.startswith("assets_")])
+        metric("grm_host_bytes", "Bytes downloaded per host", [({"host": host}, stats["bytes"])
+                                                               for host, stats in report["hosts"].items()])
+        metric("grm_host_requests", "Download requests per host", [({"host": host}, stats["requests"])
+                                                                   for host, stats in report["hosts"].items()])
+        metric("grm_host_errors", "Failed download requests per host", [({"host": host}, stats["errors"])
+                                                                        for host, stats in report["hosts"].items()])
+        metric("grm_host_throughput_bytes_per_second", "Average download throughput per host",
+               [({"host": host}, stats["throughput"]) for host, stats in report["hosts"].items()])
+        api = report["api"]
+        metric("grm_api_requests", "GitHub API requests in the last run",
+               [({"result": "total"}, api["calls"]), ({"result": "not_modified"}, api["not_modified"]),
+                ({"result": "rate_limited"}, api["rate_limited"]), ({"result": "error"}, api["errors"])])
+        metric("grm_api_budget_remaining", "Remaining GitHub API budget per token",
+               [({"token": item["token"], "resource": item["resource"]}, item["remaining"])
+                for item in api.get("budget", []) if item["remaining"] is not None])
+        mirrors = report.get("mirrors", [])
+        metric("grm_mirror_throughput_bytes_per_second", "Smoothed download throughput per prefix",
+               [({"prefix": item["prefix"]}, item["throughput"]) for item in mirrors])
+        metric("grm_mirror_error_rate", "Smoothed download error rate per prefix",
+               [({"prefix": item["prefix"]}, item["error_rate"]) for item in mirrors])
+        metric("grm_mirror_paused", "Whether the prefix is paused after failures",
+               [({"prefix": item["prefix"]}, int(item["paused_until"] is not None)) for item in mirrors])
+        metric("grm_repo_delta_saved_bytes", "Disk space saved by delta storage per repository",
+               [({"repo": key}, item["saved_bytes"]) for key, item in report.get("storage", {}).items()])
+        return "\n".join(lines) + "\n"
+
+class _PhaseTimer:
+    """RunMetrics.phase 返回的计时器"""
+
+    __slots__ = ("metrics", "owner", "repo", "name", "start")
+
+    def __init__(self, metrics, owner, repo, name):
+        self.metrics = metrics
+        self.owner = owner
+        self.repo = repo
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add_phase(self.owner, self.repo, self.name, time.monotonic() - self.start)
+        return False
+
+class RateLimitExceeded(Exception):
+    """所有 Token 的 API 额度都已用完，reset_at 为最早恢复额度的时间戳"""
+
+    def __init__(self, reset_at):
+        super().__init__(f"API 额度已用完，{datetime.fromtimestamp(reset_at):%H:%M:%S} 后恢复")
+        self.reset_at = reset_at
+
+class _RateLimitState:
+    """单个 Token 在一类额度（core、graphql 等）下的状态"""
+
+    __slots__ = ("token", "resource", "limit", "remaining", "reset", "next_at", "used", "free")
+
+    def __init__(self, token, resource):
+        self.token = token
+        self.resource = resource
+        self.limit = None
+        self.remaining = None  # None 表示尚未从响应头得知
+        self.reset = 0.0
+        self.next_at = 0.0
+        self.used = 0  # 本次运行消耗额度的请求数
+        self.free = 0  # 返回 304、不消耗额度的请求数
+
+class ApiTokenPool:
+    """GitHub API Token 池
+
+    根据响应头 X-RateLimit-Limit/Remaining/Reset 和 Retry-After 跟踪每个 Token 的剩余额度。
+    每次请求选择剩余额度最多的 Token；剩余额度低于 slowdown 比例时，把剩余次数平均分布到
+    重置前的时间内；所有 Token 都用完时抛出 RateLimitExceeded，由调用方推迟到重置之后。
+    """
+
+    def __init__(self, tokens, slowdown=0.1):
+        self.tokens = list(tokens) or [None]  # None 表示匿名访问
+        self.slowdown = slowdown
+        self._states = {}
+        self._turn = 0
+        self._lock = threading.Lock()
+
+    def _state(self, token, resource):
+        state = self._states.get((token, resource))
+        if state is None:
+            state = self._states[(token, resource)] = _RateLimitState(token, resource)
+        return state
+
+    def acquire(self, resource="core"):
+        """选择一个 Token 并预占一次额度，返回 (token, 需要等待的秒数)"""
+        now = time.time()
+        with self._lock:
+            # 从上次之后的 Token 开始轮换，额度相同时平均分配请求
+            self._turn = (self._turn + 1) % len(self.tokens)
+            states = [self._state(token, resource)
+                      for token in self.tokens[self._turn:] + self.tokens[:self._turn]]
+            for state in states:
+                if state.remaining is not None and state.reset <= now:
+                    state.remaining = None  # 已过重置时间，额度恢复
+            available = [state for state in states if state.remaining is None or state.remaining > 0]
+            if not available:
+                raise RateLimitExceeded(min(state.reset for state in states))
+
+            state = max(available, key=lambda s: float("inf") if s.remaining is None else s.remaining)
+            if state.remaining is None:
+                return state.token, 0
+            state.remaining -= 1
+            if not state.limit or state.remaining >= state.limit * self.slowdown:
+                return state.token, 0
+            # 额度不足时按 "距重置的时间 / 剩余次数" 的间隔依次放行
+            start = max(now, state.next_at)
+            state.next_at = start + max(state.reset - now, 0) / (state.remaining + 1)
+            return state.token, start - now
+
+    def update(self, token, resource, headers, status):
+        """根据响应头更新 Token 的额度，返回该响应是否为速率限制（需要换 Token 重试）"""
+        now = time.time()
+        with self._lock:
+            state = self._state(token, resource)
+            if status == 304:
+                state.free += 1
+            else:
+                state.used += 1
+            try:
+                if "X-RateLimit-Limit" in headers:
+                    state.limit = int(headers["X-RateLimit-Limit"])
+                if "X-RateLimit-Remaining" in headers:
+                    state.remaining = int(headers["X-RateLimit-Remaining"])
+                if "X-RateLimit-Reset" in headers:
+                    state.reset = float(headers["X-RateLimit-Reset"])
+            except ValueError:
+                pass
+
+            retry_after = headers.get("Retry-After")
+            if status not in (403, 429) or (retry_after is None and state.remaining != 0):
+                return False
+            # 主速率限制等到 X-RateLimit-Reset，次级速率限制按 Retry-After 等待
+            if retry_after is not None and retry_after.isdigit():
+                state.reset = max(state.reset, now + int(retry_after))
+            elif state.reset <= now:
+                state.reset = now + 60
+            state.remaining = 0
+            return True
+
+    def report(self):
+        """返回每个 Token 各类额度的使用情况，Token 只保留末 4 位"""
+        with self._lock:
+            return [{
+                "token": f"...{state.token[-4:]}" if state.token else "匿名",
+                "resource": state.resource,
+                "used": state.used,
+                "not_modified": state.free,
+                "remaining": state.remaining,
+                "limit": state.limit,
+                "reset": datetime.fromtimestamp(state.reset).isoformat(timespec="seconds") if state.reset else None
+            } for state in self._states.values() if state.used or state.free]
+
+    def log_report(self):
+        """在日志中输出本次运行消耗的 API 额度"""
+        for item in self.report():
+            remaining = "未知" if item["remaining"] is None else f"{item['remaining']}/{item['limit']}"
+            logger.info(f"API 额度 ({item['resource']}, Token {item['token']}): 本次消耗 {item['used']} 次，"
+                        f"304 未计 {item['not_modified']} 次，剩余 {remaining}")
+
+class _MirrorState:
+    """单个下载前缀（镜像或代理，空字符串表示直连）的测量结果"""
+
+    __slots__ = ("prefix", "throughput", "error_rate", "measured", "failures", "down_until",
+                 "active", "last_used", "requests", "errors", "bytes")
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.throughput = 0.0  # 吞吐量的指数滑动平均（字节/秒）
+        self.error_rate = 0.0  # 错误率的指数滑动平均
+        self.measured = False
+        self.failures = 0  # 连续失败次数
+        self.down_until = 0.0
+        self.active = 0  # 正在使用该前缀的下载数
+        self.last_used = 0.0
+        self.requests = 0  # 本次运行的请求数、失败数和字节数
+        self.errors = 0
+        self.bytes = 0
+
+class MirrorPool:
+    """下载镜像/代理前缀池
+
+    按指数滑动平均记录每个前缀的吞吐量和错误率，每次下载选择得分（吞吐量 × (1 - 错误率)）
+    最高的可用前缀；尚未测量的前缀优先各试一次，每 explore_every 次选择中有一次交给最久
+    未使用的前缀，使测量结果跟上网络变化。失败的前缀按连续失败次数指数增长地暂停使用，
+    期间的下载自动切换到其他前缀。
+    """
+
+    def __init__(self, prefixes, cooldown=30, max_cooldown=900, smoothing=0.3, explore_every=20):
+        self.prefixes = list(dict.fromkeys(prefixes)) or [""]
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.smoothing = smoothing
+        self.explore_every = explore_every
+        self._states = {prefix: _MirrorState(prefix) for prefix in self.prefixes}
+        self._choices = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def label(prefix):
+        """日志和报告中显示的前缀名称"""
+        return prefix or "直连"
+
+    @staticmethod
+    def _rank(state):
+        """排序键：未测量且空闲的前缀优先，其次按得分，得分相同时选择正在使用的下载较少的"""
+        return (not state.measured and not state.active, state.throughput * (1 - state.error_rate), -state.active)
+
+    def _healthy(self, now):
+        return [state for state in self._states.values() if state.down_until <= now]
+
+    def acquire(self, exclude=(), prefer=None):
+        """选择一个前缀用于下载，exclude 为本次下载已失败的前缀，prefer 为竞速胜出的前缀"""
+        now = time.time()
+        with self._lock:
+            healthy = self._healthy(now)
+            candidates = [state for state in healthy if state.prefix not in exclude] or healthy
+            if not candidates:
+                # 全部暂停时使用最早恢复的前缀
+                candidates = [min(self._states.values(), key=lambda s: s.down_until)]
+            state = self._states.get(prefer)
+            if state not in candidates:
+                self._choices += 1
+                if len(candidates) > 1 and self._choices % self.explore_every == 0:
+                    state = min(candidates, key=lambda s: s.last_used)
+                else:
+                    state = max(candidates, key=self._rank)
+            state.active += 1
+            state.last_used = now
+            return state.prefix
+
+    def candidates(self, count):
+        """返回当前可用的前 count 个前缀（用于竞速）"""
+        with self._lock:
+            return [state.prefix for state in sorted(self._healthy(time.time()), key=self._rank, reverse=True)[:count]]
+
+    def release(self, prefix):
+        """结束一次通过 acquire 选择前缀的下载（无论成功、失败还是出现其他异常都必须调用）"""
+        with self._lock:
+            state = self._states.get(prefix)
+            if state is not None:
+                state.active = max(state.active - 1, 0)
+
+    def record(self, prefix, nbytes, seconds, ok):
+        """记录一次请求的结果（占用的下载数由 release 减少）"""
+        now = time.time()
+        with self._lock:
+            state = self._states.get(prefix)
+            if state is None:  # 配置已重新加载，前缀不再使用
+                return
+            alpha = self.smoothing if state.measured else 1.0
+            state.error_rate += alpha * ((0.0 if ok else 1.0) - state.error_rate)
+            state.measured = True
+            state.requests += 1
+            state.bytes += nbytes
+            if ok:
+                state.failures = 0
+                if nbytes and seconds > 0:
+                    alpha = self.smoothing if state.throughput else 1.0
+                    state.throughput += alpha * (nbytes / seconds - state.throughput)
+                return
+            state.errors += 1
+            state.failures += 1
+            paused = state.down_until > now
+            pause = min(self.cooldown * 2 ** (state.failures - 1), self.max_cooldown)
+            state.down_until = now + pause
+        if len(self._states) > 1 and not paused:
+            logger.warning(f"下载前缀 {self.label(prefix)} 暂停使用 {pause:.0f} 秒（连续失败 {state.failures} 次）")
+
+    def snapshot(self):
+        """返回需要保存到状态库的测量结果 [(prefix, throughput, error_rate, down_until)]"""
+        with self._lock:
+            return [(state.prefix, state.throughput, state.error_rate, state.down_until)
+                    for state in self._states.values() if state.measured]
+
+    def restore(self, rows):
+        """从状态库恢复上次运行的测量结果（本次运行已测量的前缀不覆盖）"""
+        with self._lock:
+            for prefix, throughput, error_rate, down_until in rows:
+                state = self._states.get(prefix)
+                if state is not None and not state.measured:
+                    state.throughput = throughput
+                    state.error_rate = error_rate
+                    state.down_until = down_until
+                    state.measured = True
+
+    def report(self):
+        """返回每个前缀的测量结果和本次运行的使用情况"""
+        now = time.time()
+        with self._lock:
+            return [{
+                "prefix": self.label(state.prefix),
+                "throughput": round(state.throughput),
+                "error_rate": round(state.error_rate, 3),
+                "requests": state.requests,
+                "errors": state.errors,
+                "bytes": state.bytes,
+                "paused_until": (datetime.fromtimestamp(state.down_until).isoformat(timespec="seconds")
+                                 if state.down_until > now else None)
+            } for state in self._states.values()]
+
+class _Task:
+    """调度器中的单个任务"""
+
+    __slots__ = ("level", "fn", "args", "kwargs", "done", "result", "rate_limited")
+
+    def __init__(self, level, fn, args, kwargs):
+        self.level = level
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.done = False
+        self.result = None
+        self.rate_limited = None
+
+class DownloadScheduler:
+    """全局任务调度器
+
+    所有仓库、版本、资源和分段下载任务共用一个工作队列和固定数量的工作线程。
+    任务按层级 (level) 提交：仓库为 0，版本为 1，资源为 2，分段为 3，
+    工作线程优先执行层级更深的任务，先完成已开始的版本再开始新的仓库。
+    run_all 等待子任务期间，调用线程会帮忙执行层级不低于子任务的任务，
+    因此嵌套等待不会占满工作线程导致死锁。
+
+    另外提供按主机的并发限制 (host_slot) 和可选的全局带宽上限 (throttle)。
+    """
+
+    def __init__(self, workers=8, host_limits=None, default_host_limit=4, bandwidth_limit=0):
+        self.workers = workers
+        self.host_limits = host_limits or {}
+        self.default_host_limit = default_host_limit
+        self.bucket = TokenBucket(bandwidth_limit) if bandwidth_limit else None
+        self._queue = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._semaphores = {}
+        self._semaphores_lock = threading.Lock()
+
+    def _ensure_workers(self):
+        """首次提交任务时启动工作线程"""
+        if self._threads:
+            return
+        for idx in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"grm-worker-{idx}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _pop(self, min_level):
+        """取出层级最深且不低于 min_level 的任务，需持有 _cond"""
+        if self._queue and self._queue[0][0] <= -min_level:
+            return heapq.heappop(self._queue)[2]
+        return None
+
+    def _run(self, task):
+        """执行任务并通知等待者，异常只记录日志，结果为 None
+
+        RateLimitExceeded 不记录日志，由 run_all 重新抛给提交任务的调用方，以便推迟整个仓库。
+        """
+        try:
+            task.result = task.fn(*task.args, **task.kwargs)
+        except RateLimitExceeded as e:
+            task.rate_limited = e
+        except Exception:
+            logger.exception(f"任务执行出错: {getattr(task.fn, '__name__', task.fn)}")
+        with self._cond:
+            task.done = True
+            self._cond.notify_all()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                task = self._pop(0)
+                while task is None:
+                    self._cond.wait()
+                    task = self._pop(0)
+            self._run(task)
+
+    def run_all(self, level, calls):
+        """提交一批 (fn, args, kwargs) 任务并等待全部完成，按提交顺序返回结果
+
+        有任务因 API 额度用完抛出 RateLimitExceeded 时，等全部任务完成后重新抛出。
+        """
+        tasks = [_Task(level, fn, args, kwargs) for fn, args, kwargs in calls]
+        if not tasks:
+            return []
+        self._ensure_workers()
+        with self._cond:
+            for task in tasks:
+                heapq.heappush(self._queue, (-level, self._seq, task))
+                self._seq += 1
+            self._cond.notify_all()
+        
+        while True:
+            with self._cond:
+                while True:
+                    if all(task.done for task in tasks):
+                        for task in tasks:
+                            if task.rate_limited is not None:
+                                raise task.rate_limited
+                        return [task.result for task in tasks]
+                    task = self._pop(level)
+                    if task is not None:
+                        break
+                    self._cond.wait()
+            self._run(task)
+
+    def host_slot(self, url):
+        """返回限制该主机并发连接数的信号量，用于 with 语句"""
+        host = urlparse(url).netloc
+        with self._semaphores_lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.Semaphore(self.host_limits.get(host, self.default_host_limit))
+                self._semaphores[host] = semaphore
+        return semaphore
+
+    def set_limits(self, host_limits, default_host_limit, bandwidth_limit):
+        """修改主机并发和带宽限制（重新加载配置时使用），正在进行的请求不受影响"""
+        with self._semaphores_lock:
+            if host_limits != self.host_limits or default_host_limit != self.default_host_limit:
+                self.host_limits = host_limits
+                self.default_host_limit = default_host_limit
+                self._semaphores = {}
+        if (self.bucket.rate if self.bucket else 0) != bandwidth_limit:
+            self.bucket = TokenBucket(bandwidth_limit) if bandwidth_limit else None
+
+    def throttle(self, amount):
+        """按全局带宽上限消耗 amount 字节的配额"""
+        if self.bucket:
+            self.bucket.consume(amount)
+
+class StateIndex:
+    """SQLite 状态库，记录已下载的仓库版本和资源文件
+
+    版本只有在所有文件下载完成后才在一个事务中写入，list、保留版本和跳过判断
+    都读取状态库而不再遍历下载目录。reindex 命令可以从磁盘重建状态库。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS releases (
+            owner TEXT NOT NULL,
+            repo TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            published_at TEXT,
+            path TEXT NOT NULL,
+            total_size INTEGER NOT NULL DEFAULT 0,
+            downloaded_at TEXT NOT NULL,
+            PRIMARY KEY (owner, repo, tag)
+        );
+        CREATE TABLE IF NOT EXISTS assets (
+            owner TEXT NOT NULL,
+            repo TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            name TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            sha256 TEXT,
+            digests TEXT NOT NULL DEFAULT '{}',
+            url TEXT,
+            etag TEXT,
+            downloaded_at TEXT NOT NULL,
+            updated_at TEXT,
+            PRIMARY KEY (owner, repo, tag, name),
+            FOREIGN KEY (owner, repo, tag) REFERENCES releases (owner, repo, tag) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS assets_sha256 ON assets (sha256);
+        CREATE INDEX IF NOT EXISTS assets_url ON assets (url);
+        CREATE TABLE IF NOT EXISTS skipped_assets (
+            owner TEXT NOT NULL,
+            repo TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            name TEXT NOT NULL,
+            url TEXT,
+            size INTEGER,
+            source TEXT,
+            reason TEXT NOT NULL,
+            PRIMARY KEY (owner, repo, tag, name),
+            FOREIGN KEY (owner, repo, tag) REFERENCES releases (owner, repo, tag) ON DELETE CASCADE
+        );
+        CREATE TABLE IF NOT EXISTS schedule (
+            owner TEXT NOT NULL,
+            repo TEXT NOT NULL,
+            next_check REAL NOT NULL,
+            interval REAL NOT NULL,
+            PRIMARY KEY (owner, repo)
+        );
+        CREATE TABLE IF NOT EXISTS mirrors (
+            prefix TEXT PRIMARY KEY,
+            throughput REAL NOT NULL,
+            error_rate REAL NOT NULL,
+            down_until REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS latest (
+            owner TEXT NOT NULL,
+            repo TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            PRIMARY KEY (owner, repo)
+        );
+        CREATE TABLE IF NOT EXISTS delta_files (
+            owner TEXT NOT NULL,
+            repo TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            name TEXT NOT NULL,
+            method TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            stored_size INTEGER NOT NULL,
+            base_tag TEXT,
+            base_name TEXT,
+            PRIMARY KEY (owner, repo, tag, name)
+        );
+        CREATE INDEX IF NOT EXISTS delta_files_base ON delta_files (owner, repo, base_tag);
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.created = not self.path.exists()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._migrate()
+        self._conn.executescript(self.SCHEMA)
+
+    def _migrate(self):
+        """为旧版本创建的状态库补充新增的列"""
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(assets)")}
+        if columns and "updated_at" not in columns:
+            self._conn.execute("ALTER TABLE assets ADD COLUMN updated_at TEXT")
+            self._conn.commit()
+
+    def record_release(self, owner, repo, tag, published_at, path, files, skipped=()):
+        """在一个事务中写入版本及其全部文件
+
+        files 为字典列表，包含 name、size、digests，以及可选的 url、etag、updated_at。
+        skipped 为按资源选择规则跳过的文件，包含 name、url、size、source、reason。
+        """
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO releases VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (owner, repo, tag, published_at, str(path), sum(f["size"] for f in files), now)
+            )
+            self._conn.execute("DELETE FROM assets WHERE owner = ? AND repo = ? AND tag = ?", (owner, repo, tag))
+            self._conn.executemany(
+                "INSERT INTO assets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(owner, repo, tag, f["name"], f["size"], f["digests"].get("sha256"),
+                  json.dumps(f["digests"]), f.get("url"), f.get("etag"), now, f.get("updated_at"))
+                 for f in files]
+            )
+            self._conn.execute("DELETE FROM skipped_assets WHERE owner = ? AND repo = ? AND tag = ?",
+                               (owner, repo, tag))
+            self._conn.executemany(
+                "INSERT INTO skipped_assets VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(owner, repo, tag, f["name"], f.get("url"), f.get("size"), f.get("source"), f["reason"])
+                 for f in skipped]
+            )
+
+    def remove_release(self, owner, repo, tag):
+        """删除版本记录（资源记录级联删除）"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM releases WHERE owner = ? AND repo = ? AND tag = ?", (owner, repo, tag))
+            self._conn.execute("DELETE FROM delta_files WHERE owner = ? AND repo = ? AND tag = ?", (owner, repo, tag))
+
+    def release_tags(self, owner, repo):
+        """返回仓库已下载的版本标签集合"""
+        with self._lock:
+            rows = self._conn.execute("SELECT tag FROM releases WHERE owner = ? AND repo = ?", (owner, repo))
+            return {row["tag"] for row in rows}
+
+    def releases(self, owner, repo):
+        """返回仓库已下载的版本，按发布时间从新到旧排列"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT * FROM releases WHERE owner = ? AND repo = ? "
+                "ORDER BY COALESCE(published_at, downloaded_at) DESC", (owner, repo)
+            ).fetchall()
+
+    def set_latest(self, owner, repo, tag):
+        """记录仓库的最新版本（GitHub 返回的版本列表中第一个已下载的版本）"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO latest VALUES (?, ?, ?)", (owner, repo, tag))
+    
+    def latest_release(self, owner, repo):
+        """返回仓库的最新版本记录，没有记录或记录的版本已删除时按发布时间取最新，没有版本时返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT r.* FROM latest l JOIN releases r ON r.owner = l.owner AND r.repo = l.repo AND r.tag = l.tag "
+                "WHERE l.owner = ? AND l.repo = ?", (owner, repo)
+            ).fetchone()
+        if row is None:
+            releases = self.releases(owner, repo)
+            row = releases[0] if releases else None
+        return row
+    
+    def assets(self, owner, repo, tag):
+        """返回版本的所有文件记录"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT * FROM assets WHERE owner = ? AND repo = ? AND tag = ? ORDER BY name",
+                (owner, repo, tag)
+            ).fetchall()
+
+    def skipped_assets(self, owner, repo, tag=None):
+        """返回按资源选择规则跳过的文件记录，tag 为 None 时返回仓库所有版本的记录"""
+        query = "SELECT * FROM skipped_assets WHERE owner = ? AND repo = ?"
+        params = (owner, repo)
+        if tag is not None:
+            query += " AND tag = ?"
+            params += (tag,)
+        with self._lock:
+            return self._conn.execute(query + " ORDER BY tag, name", params).fetchall()
+
+    def schedules(self):
+        """返回 watch 模式下每个仓库的下次检查时间 {(owner, repo): next_check}"""
+        with self._lock:
+            rows = self._conn.execute("SELECT owner, repo, next_check FROM schedule")
+            return {(row["owner"], row["repo"]): row["next_check"] for row in rows}
+
+    def set_schedule(self, owner, repo, next_check, interval):
+        """记录仓库的下次检查时间和检查间隔"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO schedule VALUES (?, ?, ?, ?)",
+                               (owner, repo, next_check, interval))
+
+    def mirror_stats(self):
+        """返回保存的下载前缀测量结果 [(prefix, throughput, error_rate, down_until)]"""
+        with self._lock:
+            rows = self._conn.execute("SELECT prefix, throughput, error_rate, down_until FROM mirrors")
+            return [tuple(row) for row in rows]
+
+    def save_mirror_stats(self, rows):
+        """保存下载前缀的测量结果"""
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO mirrors VALUES (?, ?, ?, ?)", rows)
+
+    def release_sha256s(self, owner, repo, tag):
+        """返回版本中所有文件的 sha256 集合"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT sha256 FROM assets WHERE owner = ? AND repo = ? AND tag = ? AND sha256 IS NOT NULL",
+                (owner, repo, tag))
+            return {row["sha256"] for row in rows}
+
+    def sha256_refcount(self, sha256):
+        """返回引用该内容的文件记录数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM assets WHERE sha256 = ?", (sha256,)).fetchone()[0]
+
+    def digests_for_sha256(self, sha256):
+        """返回任一内容相同的文件记录的哈希值字典，没有记录时返回 None"""
+        with self._lock:
+            row = self._conn.execute("SELECT digests FROM assets WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone()
+        return json.loads(row["digests"]) if row else None
+
+    def update_asset(self, owner, repo, tag, name, size, digests):
+        """更新文件的大小和哈希值（verify 修复损坏的文件后使用）"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE assets SET size = ?, sha256 = ?, digests = ? WHERE owner = ? AND repo = ? AND tag = ? AND name = ?",
+                (size, digests.get("sha256"), json.dumps(digests), owner, repo, tag, name))
+            self._conn.execute(
+                "UPDATE releases SET total_size = (SELECT COALESCE(SUM(size), 0) FROM assets "
+                "WHERE owner = ? AND repo = ? AND tag = ?) WHERE owner = ? AND repo = ? AND tag = ?",
+                (owner, repo, tag, owner, repo, tag))
+
+    def sha256_for_asset(self, url, size, updated_at):
+        """按下载地址、大小和更新时间查找已下载过的相同资源的 sha256"""
+        if not updated_at:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256 FROM assets WHERE url = ? AND size = ? AND updated_at = ? AND sha256 IS NOT NULL LIMIT 1",
+                (url, size, updated_at)).fetchone()
+        return row["sha256"] if row else None
+
+    def record_delta(self, owner, repo, tag, name, method, size, stored_size, base_tag=None, base_name=None):
+        """记录文件的存储方式，method 为 full 表示已尝试转换但节省太少，保持完整保存"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO delta_files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (owner, repo, tag, name, method, size, stored_size, base_tag, base_name))
+
+    def remove_delta(self, owner, repo, tag, name):
+        """删除文件的存储方式记录（文件已还原为完整文件）"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM delta_files WHERE owner = ? AND repo = ? AND tag = ? AND name = ?",
+                               (owner, repo, tag, name))
+
+    def deltas(self, owner, repo):
+        """返回仓库所有文件的存储方式记录"""
+        with self._lock:
+            return self._conn.execute("SELECT * FROM delta_files WHERE owner = ? AND repo = ?",
+                                      (owner, repo)).fetchall()
+
+    def delta_dependents(self, owner, repo, base_tag):
+        """返回以 base_tag 版本中的文件为基准的增量存储文件，含所在版本的目录 (path)"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT d.*, r.path FROM delta_files d JOIN releases r "
+                "ON r.owner = d.owner AND r.repo = d.repo AND r.tag = d.tag "
+                "WHERE d.owner = ? AND d.repo = ? AND d.base_tag = ? AND d.method != 'full'",
+                (owner, repo, base_tag)).fetchall()
+
+    def delta_savings(self):
+        """返回各仓库增量存储的统计 {"owner/repo": {"files", "size", "stored_size", "saved_bytes"}}"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT owner, repo, COUNT(*) AS files, SUM(size) AS size, SUM(stored_size) AS stored_size "
+                "FROM delta_files WHERE method != 'full' GROUP BY owner, repo ORDER BY owner, repo").fetchall()
+        return {f"{row['owner']}/{row['repo']}": {"files": row["files"], "size": row["size"],
+                                                  "stored_size": row["stored_size"],
+                                                  "saved_bytes": row["size"] - row["stored_size"]}
+                for row in rows}
+
+    def clear(self):
+        """清空所有记录（重建前使用）"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM delta_files")
+            self._conn.execute("DELETE FROM skipped_assets")
+            self._conn.execute("DELETE FROM assets")
+            self._conn.execute("DELETE FROM releases")
+
+class DeltaStore:
+    """较旧版本的增量存储（delta_storage）
+
+    每个仓库最新版本的文件完整保存；较旧的保留版本中的文件保存为相对于相邻较新版本中
+    对应文件（文件名中的版本号不参与比较）的二进制差异，形成反向增量链：新版本到来时
+    只需转换上一个最新版本，删除最旧的版本也不影响其他版本。差异优先使用 bsdiff4
+    （已安装时），否则使用内置的分块差异算法并用 lzma 压缩；找不到对应文件时，可压缩的
+    文件改为 xz 压缩保存。节省不到 1 - max_ratio 的文件保持原样。
+
+    增量文件为 <文件名>.grmdelta，开头是魔数和一行 JSON 头部（方法、原始大小、sha256、
+    所在版本和基准版本的文件名），不依赖状态库即可还原。还原的完整文件按 sha256 缓存在
+    cache_dir 中供 serve 和 verify 使用，总大小超过 cache_limit 时删除最久未使用的文件。
+    """
+
+    MAGIC = b"GRMDELTA1\n"
+    PROBE = 64  # 匹配的最小长度
+    STRIDE = 256  # 索引锚点的平均间隔，未匹配的目标数据也按此步长跳过
+    INDEX_LIMIT = 1 << 20  # 基准文件索引的最大项数，文件很大时按 2 的幂加大步长，只保留部分锚点
+    WINDOW = 1 << 20  # 匹配中断后就近重新同步的搜索范围
+    MIN_SIZE = 64 * 1024  # 小于此大小的文件不转换
+    # bsdiff4 需要把两个文件读入内存，后缀数组还要占用数倍于文件的内存，超过此大小时使用内置算法
+    BSDIFF_LIMIT = 64 * 1024 * 1024
+
+    def __init__(self, cache_dir, cache_limit=1024 ** 3, max_ratio=0.8):
+        self.cache_dir = Path(cache_dir)
+        self.cache_limit = cache_limit
+        self.max_ratio = max_ratio
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    @staticmethod
+    def stored_path(path):
+        """返回文件对应的增量文件路径"""
+        return Path(str(path) + DELTA_SUFFIX)
+
+    @classmethod
+    def read_header(cls, delta_path):
+        """读取增量文件的 JSON 头部，格式不正确时抛出 ValueError"""
+        with open(delta_path, 'rb') as f:
+            return cls._read_header(f)
+
+    @classmethod
+    def _read_header(cls, f):
+        if f.read(len(cls.MAGIC)) != cls.MAGIC:
+            raise ValueError(f"不是增量存储文件: {f.name}")
+        return json.loads(f.readline())
+
+    @staticmethod
+    def base_path(delta_path, header):
+        """返回增量文件的基准文件路径（基准本身也可能是增量存储），没有基准时返回 None"""
+        if not header.get("base_tag"):
+            return None
+        depth = len(Path(header["tag"]).parts) + len(Path(header["name"]).parts)
+        return Path(delta_path).parents[depth - 1] / header["base_tag"] / header["base_name"]
+
+    def depends_on(self, path, target):
+        """判断 path 的内容是否（间接）以 target 为基准，用于避免形成循环的基准链"""
+        path, target = Path(path), Path(target)
+        seen = set()
+        while path not in seen:
+            if path == target:
+                return True
+            seen.add(path)
+            if path.exists():
+                return False
+            delta_path = self.stored_path(path)
+            try:
+                path = self.base_path(delta_path, self.read_header(delta_path))
+            except (OSError, ValueError):
+                return False
+            if path is None:
+                return False
+        return True
+
+    @staticmethod
+    def method():
+        """当前环境使用的差异算法"""
+        try:
+            import bsdiff4  # noqa: F401
+            return "bsdiff4"
+        except ImportError:
+            return "block"
+
+    def encode(self, path, tag, name, sha256, base_file=None, base_tag=None, base_name=None):
+        """把 path 转为增量存储，成功时删除原文件并返回头部（含 stored_size），不值得转换时返回 None
+
+        写入的增量文件先完整还原一遍并核对 sha256，确认无误后才删除原文件。
+        """
+        path = Path(path)
+        size = path.stat().st_size
+        if size < self.MIN_SIZE:
+            return None
+        limit = int(size * self.max_ratio)
+        delta_path = self.stored_path(path)
+        tmp_path = delta_path.with_name(delta_path.name + ".tmp")
+        
+        attempts = []
+        if base_file is not None:
+            base = self.full_path(base_file)
+            method = self.method()
+            if method == "bsdiff4" and max(size, base.stat().st_size) > self.BSDIFF_LIMIT:
+                method = "block"
+            attempts.append((method, base))
+        attempts.append(("xz", None))
+        for method, base in attempts:
+            header = {"method": method, "size": size, "sha256": sha256, "tag": tag, "name": name,
+                      "base_tag": base_tag if base else None, "base_name": base_name if base else None}
+            with open(tmp_path, 'wb') as out:
+                out.write(self.MAGIC)
+                out.write(json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n")
+                if method == "xz":
+                    ok = self._encode_xz(path, out, limit)
+                elif method == "bsdiff4":
+                    ok = self._encode_bsdiff(base, path, out, limit)
+                else:
+                    ok = self._encode_block(base, path, out, limit)
+                stored_size = out.tell()
+            if ok and stored_size <= limit:
+                break
+        else:
+            tmp_path.unlink()
+            return None
+        
+        # 确认增量文件可以还原出原文件后才替换
+        try:
+            self._decode_file(tmp_path, _HashingSink(size, sha256))
+        except Exception:
+            tmp_path.unlink()
+            raise
+        os.replace(tmp_path, delta_path)
+        path.unlink()
+        header["stored_size"] = stored_size
+        return header
+
+    def _encode_xz(self, path, out, limit):
+        """没有基准文件时整体压缩，先压缩开头 1 MB 估计压缩率，明显压缩不了时直接放弃"""
+        import lzma
+        
+        with open(path, 'rb') as f:
+            sample = f.read(HASH_CHUNK_SIZE)
+            if len(lzma.compress(sample, preset=1)) > len(sample) * self.max_ratio:
+                return False
+            f.seek(0)
+            compressor = lzma.LZMACompressor(preset=6)
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                out.write(compressor.compress(chunk))
+                if out.tell() > limit:
+                    return False
+            out.write(compressor.flush())
+        return True
+
+    def _encode_bsdiff(self, base_path, path, out, limit):
+        import bsdiff4
+        
+        with open(base_path, 'rb') as f:
+            base = f.read()
+        with open(path, 'rb') as f:
+            target = f.read()
+        patch = bsdiff4.diff(base, target)
+        if len(patch) > limit:
+            return False
+        out.write(patch)
+        return True
+
+    def _encode_block(self, base_path, path, out, limit):
+        """内置的分块差异算法，结果为 lzma 压缩的指令流
+
+        索引建立在由内容决定的锚点上：选一个在基准文件中平均约每 STRIDE 字节出现一次的
+        字节值，以它出现的位置开始的 PROBE 字节为键，因此插入、删除或移动了任意长度的
+        内容后，目标文件中相同内容的锚点仍能命中索引。目标文件按 stride 步进而不是逐字节
+        检查：先比较基准文件中同一相对位置的内容（原位修改），再查这一步长内的锚点，
+        匹配中断后在间隔按指数增长的位置用 bytes.find 在附近 WINDOW 范围内重新同步；
+        找到匹配后先向前补齐，再尽量向后延伸。比较和查找都在 C 中完成，
+        Python 循环的次数约为文件大小 / STRIDE。指令为复制基准文件的一段 (b"C" 偏移 长度)
+        或写入新数据 (b"L" 长度 数据)。两个文件通过 mmap 读取，内存占用与文件大小无关。
+        新数据明显过多时提前放弃。
+        """
+        import lzma
+        import mmap
+        import struct
+        
+        probe, window = self.PROBE, self.WINDOW
+        with open(base_path, 'rb') as bf, open(path, 'rb') as tf:
+            if os.fstat(bf.fileno()).st_size < probe:
+                return False
+            with mmap.mmap(bf.fileno(), 0, access=mmap.ACCESS_READ) as base, \
+                    mmap.mmap(tf.fileno(), 0, access=mmap.ACCESS_READ) as target:
+                m, n = len(base), len(target)
+                # 抽样检查：两个文件几乎没有相同内容时不必计算
+                samples = [target[pos:pos + probe] for pos in range(0, n - probe, max((n - probe) // 16, 1))][:16]
+                if sum(1 for sample in samples if base.find(sample) != -1) < len(samples) // 4:
+                    return False
+                
+                stride = self.STRIDE
+                while m // stride > self.INDEX_LIMIT:
+                    stride *= 2
+                # 文件较大时只保留键的哈希值低位为 0 的锚点，两个文件按相同规则取舍；
+                # 同一字节连续出现时锚点之间至少相隔 PROBE 字节
+                mask = stride // self.STRIDE - 1
+                marker = _anchor_byte(b"".join(base[pos:pos + 65536] for pos in range(0, m, max(m // 8, 1))),
+                                      self.STRIDE)
+                index = {}
+                anchor = base.find(marker)
+                while anchor != -1 and anchor + probe <= m:
+                    key = hash(base[anchor:anchor + probe])
+                    if not key & mask:
+                        index.setdefault(key, anchor)
+                    anchor = base.find(marker, anchor + probe)
+                
+                compressor = lzma.LZMACompressor(preset=6)
+                literal_limit = n * self.max_ratio
+                literal = 0
+                
+                def emit(data):
+                    out.write(compressor.compress(data))
+                
+                def emit_literal(start, end):
+                    for pos in range(start, end, HASH_CHUNK_SIZE):
+                        chunk = target[pos:min(pos + HASH_CHUNK_SIZE, end)]
+                        emit(b"L" + struct.pack("<Q", len(chunk)) + chunk)
+                
+                i = pending = expected = misses = scanned = 0
+                while i + probe <= n:
+                    chunk = target[i:i + probe]
+                    offset = None
+                    shifted = expected + i - pending  # 原位修改时基准文件中的对应位置
+                    if base[shifted:shifted + probe] == chunk:
+                        offset = shifted
+                    else:
+                        end = min(i + stride, n - probe + 1)
+                        anchor = target.find(marker, i, end)
+                        while anchor != -1:
+                            key = hash(target[anchor:anchor + probe])
+                            if not key & mask:
+                                candidate = index.get(key)
+                                if (candidate is not None
+                                        and base[candidate:candidate + probe] == target[anchor:anchor + probe]):
+                                    i, offset = anchor, candidate
+                                    break
+                            anchor = target.find(marker, anchor + probe, end)
+                        if offset is None and misses & (misses - 1) == 0 and expected + probe <= m:
+                            # 删除了一段：在基准文件中向后找当前内容；插入了一段：在目标文件中向后找预期内容
+                            found = base.find(chunk, expected, expected + window)
+                            if found != -1:
+                                offset = found
+                            else:
+                                found = target.find(base[expected:expected + probe], pending, i + window)
+                                if found != -1:
+                                    i, offset = found, expected
+                        misses += 1
+                    if offset is None:
+                        i += stride
+                        scanned += stride
+                        if scanned >= 1 << 20:
+                            # 每处理 1 MB 未匹配的数据检查一次，按比例估计新数据会超过上限时放弃
+                            scanned = 0
+                            if literal + i - pending > max(literal_limit * i / n, 4 * 1024 * 1024):
+                                return False
+                        continue
+                    
+                    back = _match_length_back(base, offset, target, i, i - pending)
+                    i, offset = i - back, offset - back
+                    length = _match_length(base, offset, target, i, probe + back)
+                    if pending < i:
+                        literal += i - pending
+                        if literal > literal_limit:
+                            return False
+                        emit_literal(pending, i)
+                    emit(b"C" + struct.pack("<QQ", offset, length))
+                    i += length
+                    pending, expected, misses = i, offset + length, 0
+                if pending < n:
+                    literal += n - pending
+                    if literal > literal_limit:
+                        return False
+                    emit_literal(pending, n)
+                out.write(compressor.flush())
+        return True
+
+    def _decode_file(self, delta_path, sink):
+        """把增量文件还原后的内容依次写入 sink（需要 write 方法），基准文件按需先还原
+
+        增量文件损坏时抛出 ValueError。
+        """
+        import lzma
+        import struct
+        
+        try:
+            header = self._decode_stream(delta_path, sink)
+        except (lzma.LZMAError, struct.error, EOFError) as e:
+            raise ValueError(f"增量文件已损坏: {delta_path}: {e}") from e
+        if hasattr(sink, "check"):
+            sink.check(delta_path)
+        return header
+
+    def _decode_stream(self, delta_path, sink):
+        import lzma
+        import struct
+        
+        with open(delta_path, 'rb') as f:
+            header = self._read_header(f)
+            method = header["method"]
+            if method == "xz":
+                with lzma.open(f, 'rb') as stream:
+                    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b""):
+                        sink.write(chunk)
+            elif method == "bsdiff4":
+                import bsdiff4
+                
+                with open(self.full_path(self.base_path(delta_path, header)), 'rb') as base:
+                    sink.write(bsdiff4.patch(base.read(), f.read()))
+            elif method == "block":
+                with open(self.full_path(self.base_path(delta_path, header)), 'rb') as base, \
+                        lzma.open(f, 'rb') as stream:
+                    while True:
+                        op = stream.read(1)
+                        if not op:
+                            break
+                        if op == b"C":
+                            offset, length = struct.unpack("<QQ", stream.read(16))
+                            base.seek(offset)
+                            while length:
+                                chunk = base.read(min(length, HASH_CHUNK_SIZE))
+                                if not chunk:
+                                    raise ValueError(f"基准文件长度不足: {delta_path}")
+                                sink.write(chunk)
+                                length -= len(chunk)
+                        elif op == b"L":
+                            (length,) = struct.unpack("<Q", stream.read(8))
+                            sink.write(stream.read(length))
+                        else:
+                            raise ValueError(f"增量文件已损坏: {delta_path}")
+            else:
+                raise ValueError(f"不支持的增量存储方法 {method}: {delta_path}")
+        return header
+
+    def _lock_for(self, key):
+        with self._locks_lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def restore(self, path):
+        """把增量存储的文件还原为完整文件并删除增量文件，返回头部"""
+        path = Path(path)
+        delta_path = self.stored_path(path)
+        header = self.read_header(delta_path)
+        tmp_path = path.with_name(path.name + ".restore")
+        with open(tmp_path, 'wb') as f:
+            sink = _HashingSink(header["size"], header["sha256"], f)
+            try:
+                self._decode_file(delta_path, sink)
+            except Exception:
+                f.close()
+                tmp_path.unlink()
+                raise
+        os.replace(tmp_path, path)
+        delta_path.unlink()
+        return header
+
+    def digests(self, path, algorithms):
+        """从增量文件还原内容（不写入磁盘）并计算哈希值，用于 verify 检查增量文件本身是否完好"""
+        delta_path = self.stored_path(path)
+        header = self.read_header(delta_path)
+        sink = _HashingSink(header["size"], header["sha256"], algorithms=algorithms)
+        self._decode_file(delta_path, sink)
+        return {name: sink.hexdigests()[name] for name in algorithms}
+
+    def full_path(self, path):
+        """返回文件完整内容的路径：文件完整保存时为其本身，增量存储时还原到缓存目录
+
+        文件和增量文件都不存在时抛出 FileNotFoundError，还原结果与记录的 sha256 不符时抛出 ValueError。
+        """
+        path = Path(path)
+        if path.exists():
+            return path
+        delta_path = self.stored_path(path)
+        header = self.read_header(delta_path)
+        sha256 = header["sha256"]
+        cached = self.cache_dir / sha256[:2] / sha256
+        with self._lock_for(sha256):
+            if cached.exists():
+                os.utime(cached)
+                return cached
+            os.makedirs(cached.parent, exist_ok=True)
+            tmp_path = cached.with_name(cached.name + ".tmp")
+            with open(tmp_path, 'wb') as f:
+                try:
+                    self._decode_file(delta_path, _HashingSink(header["size"], sha256, f))
+                except Exception:
+                    f.close()
+                    tmp_path.unlink()
+                    raise
+            os.replace(tmp_path, cached)
+        self._evict(keep=cached)
+        return cached
+
+    def _evict(self, keep=None):
+        """缓存超过上限时删除最久未使用的文件"""
+        entries = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = Path(root) / name
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.cache_limit:
+                break
+            if path == keep:
+                continue
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
+
+class _HashingSink:
+    """还原增量文件时的输出：计算 sha256（及 algorithms 中的其他哈希值）和长度，可选写入文件，结束时核对"""
+
+    def __init__(self, size, sha256, f=None, algorithms=()):
+        self.size = size
+        self.sha256 = sha256
+        self.f = f
+        self.hashers = {name: hashlib.new(name) for name in ("sha256", *algorithms)}
+        self.written = 0
+
+    def write(self, data):
+        for hasher in self.hashers.values():
+            hasher.update(data)
+        self.written += len(data)
+        if self.f is not None:
+            self.f.write(data)
+
+    def hexdigests(self):
+        return {name: hasher.hexdigest() for name, hasher in self.hashers.items()}
+
+    def check(self, delta_path):
+        if self.written != self.size or (self.sha256 and self.hashers["sha256"].hexdigest() != self.sha256):
+            raise ValueError(f"增量文件还原后与记录不符: {delta_path}")
+
 class GithubReleaseUpdater:
     def __init__(self, config_path="config.json"):
         """初始化 GitHub Release 更新器"""
         self.config_path = config_path
         self.config = self._load_config()
         self.upgrade_config()  # 升级配置文件格式
-        self.base_dir = Path(self.config.get("base_dir", "downloads"))
-        self.default_max_versions = self.config.get("default_max_versions", 3)  # 默认版本数量
-        self.proxy_prefix = self.config.get("proxy_prefix", "")
+        self.token_pool = None
+        self.mirror_pool = None
+        self._trash_lock = threading.Lock()
+        self._trash_thread = None
+        self._delta_lock = threading.Lock()  # 强制更新并行替换多个版本时，逐个还原依赖它们的增量文件
+        self._apply_config()
+        self.metrics = RunMetrics()  # 运行统计，每次 update 重新开始
         self.max_retries = 3  # 最大重试次数
         self.retry_delay = 5  # 重试延迟（秒）
         
-        # 配置 requests 会话
-        self.session = requests.Session()
-        retry_strategy = Retry(
-            total=self.max_retries,
-            backoff_factor=1,
-            status_forcelist=[500, 502, 503, 504],
+        # API 响应缓存、状态库和 requests 会话都在首次使用时创建（见同名属性），
+        # 只修改配置的命令不读取缓存、不打开状态库，也不导入 requests
+        self._lazy_lock = threading.RLock()
+        self._response_cache = None
+        self._state = None
+        self._session = None
+        self._download_session = None
+        
+        # 全局调度器：统一的工作线程数、按主机的并发限制和带宽上限
+        self.scheduler = DownloadScheduler(
+            workers=self.config.get("workers", 8),
+            host_limits=self.config.get("host_limits", {}),
+            default_host_limit=self.config.get("per_host_limit", 4),
+            bandwidth_limit=self.config.get("bandwidth_limit", 0)
         )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
+    
+    @property
+    def response_cache(self):
+        """API 响应缓存，保存在配置文件所在目录"""
+        with self._lazy_lock:
+            if self._response_cache is None:
+                self._response_cache = ResponseCache(Path(self.config_path).parent / "http_cache.json")
+            return self._response_cache
+    
+    @property
+    def state(self):
+        """状态库，首次打开时恢复下载前缀的统计；新建时从已有的下载目录导入记录"""
+        with self._lazy_lock:
+            if self._state is None:
+                self._state = StateIndex(self.config.get("state_db", Path(self.config_path).parent / "state.db"))
+                self.mirror_pool.restore(self._state.mirror_stats())
+                if self._state.created:
+                    self.reindex()
+            return self._state
+    
+    @property
+    def session(self):
+        """API 请求使用的 requests 会话，5xx 时在连接层重试"""
+        with self._lazy_lock:
+            if self._session is None:
+                self._session = self._create_session(self.max_retries)
+            return self._session
+    
+    @property
+    def download_session(self):
+        """下载使用的会话，出错时不在连接层重试和退避，由 download_asset 立即换用其他下载前缀"""
+        with self._lazy_lock:
+            if self._download_session is None:
+                self._download_session = self._create_session(0)
+            return self._download_session
+    
+    def _create_session(self, max_retries):
+        """创建 requests 会话，连接池大小与工作线程数匹配（主线程也会执行任务）"""
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
         
+        if max_retries:
+            max_retries = Retry(
+                total=max_retries,
+                backoff_factor=1,
+                status_forcelist=API_RETRY_STATUSES,
+            )
+        adapter = HTTPAdapter(
+            max_retries=max_retries,
+            pool_connections=max(len(self.scheduler.host_limits), 10),
+            pool_maxsize=self.scheduler.workers + 1
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+    
+    def _apply_config(self):
+        """根据 self.config 设置运行参数，初始化和重新加载配置时调用"""
+        self.base_dir = Path(self.config.get("base_dir", "downloads"))
+        self.default_max_versions = self.config.get("default_max_versions", 3)  # 默认版本数量
+        self.proxy_prefix = self.config.get("proxy_prefix", "")
+        # 下载前缀池：proxy_prefixes 为多个镜像/代理前缀（空字符串表示直连），未设置时只使用 proxy_prefix
+        prefixes = self.config.get("proxy_prefixes") or [self.proxy_prefix]
+        if self.mirror_pool is None or self.mirror_pool.prefixes != list(dict.fromkeys(prefixes)):
+            self.mirror_pool = MirrorPool(prefixes)
+        self.mirror_pool.cooldown = self.config.get("mirror_cooldown", 30)
+        self.mirror_race_threshold = self.config.get("mirror_race_threshold", 64 * 1024 * 1024)
+        self.mirror_race_bytes = self.config.get("mirror_race_bytes", 64 * 1024)
+        self.api_url = self.config.get("api_url", "https://api.github.com").rstrip("/")
+        self.graphql_url = self.config.get("graphql_url", f"{self.api_url}/graphql")
+        self.github_tokens = self._load_github_tokens()
+        self.github_token = self.github_tokens[0] if self.github_tokens else ""
+        # API 额度跟踪：多个 Token 轮换使用，额度不足时放慢，用完时推迟仓库直到重置
+        # Token 未变化时保留已跟踪的额度
+        if self.token_pool is None or self.token_pool.tokens != (self.github_tokens or [None]):
+            self.token_pool = ApiTokenPool(self.github_tokens)
+        self.token_pool.slowdown = self.config.get("rate_limit_slowdown", 0.1)
+        self.rate_limit_max_wait = self.config.get("rate_limit_max_wait", 3600)
+        self.discovery = self.config.get("discovery", "rest")  # rest 或 graphql
+        self.graphql_batch_size = self.config.get("graphql_batch_size", 50)
+        self.hash_algorithms = self._load_hash_algorithms()
+        self.dedup = self.config.get("dedup", False)  # 是否启用按 sha256 去重的内容存储
+        self.dedup_link = self.config.get("dedup_link", "hardlink")  # hardlink 或 reflink
+        self.blob_dir = self.base_dir / ".blobs"
+        # 增量存储：较旧的保留版本保存为相对于较新版本的差异，已有的增量文件不论是否启用都能读取
+        self.delta_storage = self.config.get("delta_storage", False)
+        self.delta_store = DeltaStore(self.base_dir / ".delta-cache",
+                                      self.config.get("delta_cache_limit", 1024 ** 3),
+                                      self.config.get("delta_max_ratio", 0.8))
+        self._index_repositories()
+    
+    def _index_repositories(self):
+        """按 (owner, repo) 建立仓库配置的索引，查找仓库设置时不必遍历仓库列表"""
+        self._repo_index = {}
+        for repo_info in self.config["repositories"]:
+            self._repo_index.setdefault((repo_info["owner"], repo_info["repo"]), repo_info)
+    
+    def find_repository(self, owner, repo):
+        """返回仓库的配置，不存在时返回 None"""
+        return self._repo_index.get((owner, repo))
+    
+    def reload_config(self):
+        """重新读取配置文件，仓库列表、版本数、代理、Token、资源规则、并发和带宽限制立即生效
+
+        工作线程数、状态库路径和连接池大小需要重启后生效。
+        """
+        self.config = self._load_config()
+        self.upgrade_config()
+        self._apply_config()
+        if self._state is not None:
+            self.mirror_pool.restore(self._state.mirror_stats())
+        self.scheduler.set_limits(self.config.get("host_limits", {}), self.config.get("per_host_limit", 4),
+                                  self.config.get("bandwidth_limit", 0))
+        logger.info(f"已重新加载配置: {self.config_path}")
+    
+    def _load_github_tokens(self):
+        """读取 GitHub Token 列表：配置中的 github_tokens/github_token，或环境变量 GITHUB_TOKENS（逗号分隔）/GITHUB_TOKEN"""
+        tokens = list(self.config.get("github_tokens", []))
+        if self.config.get("github_token"):
+            tokens.append(self.config["github_token"])
+        if not tokens:
+            tokens = os.environ.get("GITHUB_TOKENS", "").split(",") + [os.environ.get("GITHUB_TOKEN", "")]
+        return list(dict.fromkeys(token.strip() for token in tokens if token and token.strip()))
+    
+    def _load_hash_algorithms(self):
+        """读取要计算的哈希算法列表，忽略当前环境不支持的算法（shake_* 需要指定长度，也不支持）"""
+        algorithms = []
+        for name in self.config.get("hash_algorithms", DEFAULT_HASH_ALGORITHMS):
+            if name in hashlib.algorithms_available and not name.startswith("shake_"):
+                algorithms.append(name)
+            else:
+                logger.warning(f"不支持的哈希算法，已忽略: {name}")
+        return algorithms
+    
     def _load_config(self):
         """加载配置文件"""
         try:
@@ -77,11 +1799,17 @@ class GithubReleaseUpdater:
             return default_config
     
     def _save_config(self, config=None):
-        """保存配置到文件"""
+        """保存配置到文件（先写临时文件再替换，中断时不会留下写了一半的配置），内容不变时不写入"""
         if config is None:
             config = self.config
-        with open(self.config_path, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=4, ensure_ascii=False)
+        text = json.dumps(config, indent=4, ensure_ascii=False)
+        try:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                if f.read() == text:
+                    return  # 内容没有变化时不重写
+        except (OSError, ValueError):
+            pass
+        _write_text_atomic(self.config_path, text)
     
     def upgrade_config(self):
         """升级配置文件格式"""
@@ -91,7 +1819,7 @@ class GithubReleaseUpdater:
         if "max_versions" in self.config and "default_max_versions" not in self.config:
             self.config["default_max_versions"] = self.config.pop("max_versions")
             changed = True
-            
+
         # 确保每个仓库配置都有max_versions字段
         for repo in self.config["repositories"]:
             if "max_versions" not in repo:
@@ -102,154 +1830,1154 @@ class GithubReleaseUpdater:
         if changed:
             self._save_config()
             logger.info("配置文件已升级到新格式")
-            
+
     def add_repository(self, owner, repo, max_versions=None):
-        """添加新的仓库到配置"""
-        if max_versions is None:
-            max_versions = self.default_max_versions
-            
-        repo_info = {
-            "owner": owner, 
-            "repo": repo,
-            "max_versions": max_versions
-        }
-        
-        existing_repos = [r for r in self.config["repositories"] 
-                          if r["owner"] == owner and r["repo"] == repo]
-        
-        if not existing_repos:
-            self.config["repositories"].append(repo_info)
-            self._save_config()
-            logger.info(f"已添加仓库: {owner}/{repo}, 保留版本数: {max_versions}")
-        else:
-            # 如果仓库已存在但缺少max_versions字段，则更新它
-            if "max_versions" not in existing_repos[0]:
-                existing_repos[0]["max_versions"] = max_versions
-                self._save_config()
+        """添加新的仓库到配置"""
+        return self.add_repositories([(owner, repo, max_versions)])
+    
+    def add_repositories(self, repositories):
+        """批量添加仓库，repositories 为 (owner, repo, max_versions) 列表
+
+        通过内存中的索引判断仓库是否已存在，全部处理完后只写一次配置文件。
+        返回新添加的仓库数量。
+        """
+        added = changed = 0
+        for owner, repo, max_versions in repositories:
+            if max_versions is None:
+                max_versions = self.default_max_versions
+
+            existing = self.find_repository(owner, repo)
+            if existing is None:
+                repo_info = {
+                    "owner": owner,
+                    "repo": repo,
+                    "max_versions": max_versions
+                }
+                self.config["repositories"].append(repo_info)
+                self._repo_index[(owner, repo)] = repo_info
+                added += 1
+                logger.info(f"已添加仓库: {owner}/{repo}, 保留版本数: {max_versions}")
+            elif "max_versions" not in existing:
+                # 如果仓库已存在但缺少max_versions字段，则更新它
+                existing["max_versions"] = max_versions
+                changed += 1
                 logger.info(f"已更新仓库: {owner}/{repo}, 保留版本数: {max_versions}")
             else:
                 logger.info(f"仓库已存在: {owner}/{repo}")
+        
+        if added or changed:
+            self._save_config()
+        if len(repositories) > 1:
+            logger.info(f"共处理 {len(repositories)} 个仓库: 新添加 {added} 个，"
+                        f"更新 {changed} 个，已存在 {len(repositories) - added - changed} 个")
+        return added
+    
+    def import_repositories(self, path, max_versions=None):
+        """从文本文件批量导入仓库
+
+        文件中每行可以包含一个 GitHub 仓库 URL，后面可跟该仓库的保留版本数；
+        以 # 开头的行和不含仓库 URL 的行被忽略。
+        """
+        repositories = []
+        seen = set()
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if not fields or fields[0].startswith("#"):
+                    continue
+                owner, repo = self.parse_github_url(fields[0])
+                if not owner or not repo or (owner, repo) in seen:
+                    continue
+                seen.add((owner, repo))
+                versions = max_versions
+                if len(fields) > 1 and fields[1].isdigit() and int(fields[1]) >= 1:
+                    versions = int(fields[1])
+                repositories.append((owner, repo, versions))
+        
+        if not repositories:
+            logger.info(f"文件中没有找到 GitHub 仓库 URL: {path}")
+            return 0
+        return self.add_repositories(repositories)
     
     def remove_repository(self, owner, repo):
         """从配置中移除仓库"""
-        repo_info = {"owner": owner, "repo": repo}
-        if repo_info in self.config["repositories"]:
-            self.config["repositories"].remove(repo_info)
+        if self._repo_index.pop((owner, repo), None) is not None:
+            self.config["repositories"] = [r for r in self.config["repositories"]
+                                           if (r["owner"], r["repo"]) != (owner, repo)]
             self._save_config()
             logger.info(f"已移除仓库: {owner}/{repo}")
         else:
             logger.info(f"仓库不存在: {owner}/{repo}")
     
-    def set_proxy_prefix(self, prefix):
-        """设置代理前缀"""
-        self.config["proxy_prefix"] = prefix
-        self.proxy_prefix = prefix
+    def set_proxy_prefix(self, *prefixes):
+        """设置代理前缀，给出多个前缀时作为下载前缀池（空字符串表示直连）"""
+        if len(prefixes) > 1:
+            self.config["proxy_prefixes"] = list(prefixes)
+        else:
+            self.config.pop("proxy_prefixes", None)
+        self.config["proxy_prefix"] = prefixes[0]
+        self.proxy_prefix = prefixes[0]
         self._save_config()
-        logger.info(f"已设置代理前缀: {prefix}")
+        logger.info(f"已设置代理前缀: {', '.join(MirrorPool.label(prefix) for prefix in prefixes)}")
+    
+    def _api_get(self, url, headers=None):
+        """通过 Token 池发送一次 API GET 请求
+
+        触发速率限制（403/429）的 Token 会被标记到重置时间，并换用其他 Token 重试；
+        所有 Token 都用完时抛出 RateLimitExceeded。响应以流式方式返回，由调用方读取或关闭。
+        """
+        import requests
+        
+        while True:
+            token, delay = self.token_pool.acquire()
+            if delay > 0:
+                time.sleep(delay)
+            request_headers = dict(headers or {})
+            if token:
+                request_headers["Authorization"] = f"token {token}"
+            try:
+                response = self.session.get(url, headers=request_headers, stream=True)
+            except requests.RequestException:
+                self.metrics.api_call()
+                raise
+            rate_limited = self.token_pool.update(token, "core", response.headers, response.status_code)
+            self.metrics.api_call(response.status_code, rate_limited)
+            if not rate_limited:
+                return response
+            response.close()
+            logger.warning(f"触发 API 速率限制 (HTTP {response.status_code})，换用其他 Token 重试: {url}")
     
-    def get_releases(self, owner, repo):
-        """获取仓库的发布版本信息"""
-        url = f"https://api.github.com/repos/{owner}/{repo}/releases"
+    def _fetch_releases(self, url):
+        """带条件请求缓存地获取一页发布版本（/releases 或 /releases/latest）
+
+        返回 (releases, next_url, not_modified)，releases 为 Release 列表，next_url 取自
+        响应的 Link: rel="next"。响应边下载边解析，缓存中只保存精简后的版本。
+        服务器返回 304 时直接复用缓存内容，且不消耗 API 速率限制。
+        """
+        with self.scheduler.host_slot(url):
+            response = self._api_get(url, self.response_cache.conditional_headers(url))
+            if response.status_code == 304:
+                response.close()
+                cached = self.response_cache.get(url)
+                if cached is not None:
+                    return releases_from_cache(cached), cached["next"], True
+                # 缓存丢失时去掉条件头重新请求
+                response = self._api_get(url)
+            with response:
+                response.raise_for_status()
+                parser = ReleaseListParser()
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    parser.feed(chunk)
+                releases = parser.close()
+        next_url = response.links.get("next", {}).get("url")
+        self.response_cache.store(url, response.headers,
+                                  {"releases": [release.to_json() for release in releases], "next": next_url})
+        return releases, next_url, False
+    
+    def iter_releases(self, owner, repo, per_page=30, status=None):
+        """惰性分页获取仓库的发布版本，只有继续迭代时才请求下一页
+
+        status 字典用于回传是否所有已请求的页面都未变化 (not_modified)。
+        """
+        url = f"{self.api_url}/repos/{owner}/{repo}/releases?per_page={per_page}"
+        while url:
+            releases, url, not_modified = self._fetch_releases(url)
+            if status is not None and not not_modified:
+                status["not_modified"] = False
+            yield from releases
+    
+    def get_releases(self, owner, repo, limit=None):
+        """获取仓库最新的 limit 个发布版本
+
+        返回 (releases, not_modified)。每页大小按 limit 设置，凑够 limit 个版本后
+        不再请求后续页面；limit 为 1 时优先使用 /releases/latest 接口
+        （该接口不包含预发布版本，仓库没有正式版本时回退到列表接口）。
+        """
+        import requests
+        
+        status = {"not_modified": True}
         try:
-            response = self.session.get(url)
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
+            if limit == 1:
+                url = f"{self.api_url}/repos/{owner}/{repo}/releases/latest"
+                try:
+                    releases, _, not_modified = self._fetch_releases(url)
+                    return releases, not_modified
+                except requests.HTTPError as e:
+                    if e.response is None or e.response.status_code != 404:
+                        raise
+            per_page = min(limit, 100) if limit else 30
+            releases = list(islice(self.iter_releases(owner, repo, per_page, status), limit))
+            if status["not_modified"] and releases:
+                logger.info(f"{owner}/{repo} 的发布版本未变化 (304)")
+            return releases, status["not_modified"]
+        except (requests.RequestException, ValueError) as e:
             logger.error(f"获取 {owner}/{repo} 的发布版本失败: {e}")
-            return []
+            return [], False
     
-    def download_asset(self, url, save_path):
-        """下载资源文件"""
-        # 处理代理前缀
-        if self.proxy_prefix:
-            parsed_url = urlparse(url)
-            if parsed_url.netloc == "api.github.com":
-                # 对于 GitHub API 的请求，不使用代理
-                download_url = url
-            else:
-                # 对于其他下载链接，使用代理
-                download_url = f"{self.proxy_prefix}{url}"
-        else:
-            download_url = url
-            
-        retry_count = 0
+    def _build_releases_query(self, repos):
+        """为一批仓库构建带别名的 GraphQL 查询，每个仓库取最新的 max_versions 个版本"""
+        fields = []
+        for idx, (owner, repo, max_versions) in enumerate(repos):
+            fields.append(
+                f"r{idx}: repository(owner: {json.dumps(owner)}, name: {json.dumps(repo)}) {{ "
+                f"releases(first: {min(max_versions, 100)}, orderBy: {{field: CREATED_AT, direction: DESC}}) {{ "
+                "nodes { tagName publishedAt isDraft "
+                "releaseAssets(first: 100) { pageInfo { hasNextPage } nodes { name size downloadUrl updatedAt } } "
+                "} } }"
+            )
+        return "query {\n  " + "\n  ".join(fields) + "\n}"
+    
+    def _graphql_release(self, owner, repo, node):
+        """将 GraphQL 返回的版本节点转换为 Release"""
+        tag = node["tagName"]
+        quoted_tag = quote(tag)
+        return Release(
+            tag,
+            node.get("publishedAt"),
+            [Asset(asset["name"], asset["size"], asset["downloadUrl"], asset.get("updatedAt"))
+             for asset in node["releaseAssets"]["nodes"]],
+            f"{self.api_url}/repos/{owner}/{repo}/zipball/{quoted_tag}",
+            f"{self.api_url}/repos/{owner}/{repo}/tarball/{quoted_tag}"
+        )
+    
+    def discover_releases_graphql(self, repos):
+        """通过 GraphQL 批量获取多个仓库的发布版本
+
+        repos 为 (owner, repo, max_versions) 列表，按 graphql_batch_size 分批，
+        每批只发送一次请求。返回 {(owner, repo): releases}，请求失败的批次、
+        GraphQL 没有返回数据的仓库，以及有版本的资源文件超过 100 个（一次查询
+        取不完）的仓库不包含在结果中，由调用方回退到 REST 接口。
+        """
+        import requests
         
-        while retry_count < self.max_retries:
+        results = {}
+        for start in range(0, len(repos), self.graphql_batch_size):
+            batch = repos[start:start + self.graphql_batch_size]
+            query = self._build_releases_query(batch)
             try:
-                response = self.session.get(download_url, stream=True)
+                token, delay = self.token_pool.acquire("graphql")
+                if delay > 0:
+                    time.sleep(delay)
+                with self.scheduler.host_slot(self.graphql_url):
+                    try:
+                        response = self.session.post(self.graphql_url, json={"query": query},
+                                                     headers={"Authorization": f"bearer {token}"})
+                    except requests.RequestException:
+                        self.metrics.api_call()
+                        raise
+                rate_limited = self.token_pool.update(token, "graphql", response.headers, response.status_code)
+                self.metrics.api_call(response.status_code, rate_limited)
+                if rate_limited:
+                    logger.warning("GraphQL 触发速率限制，该批仓库改用 REST 接口")
+                    continue
                 response.raise_for_status()
+                payload = response.json()
+            except RateLimitExceeded as e:
+                logger.warning(f"GraphQL {e}，剩余仓库改用 REST 接口")
+                break
+            except (requests.RequestException, ValueError) as e:
+                logger.error(f"GraphQL 批量获取发布版本失败: {e}")
+                continue
+
+            for error in payload.get("errors") or []:
+                logger.warning(f"GraphQL 错误: {error.get('message')}")
+            data = payload.get("data") or {}
+            for idx, (owner, repo, _) in enumerate(batch):
+                node = data.get(f"r{idx}")
+                if node is None:
+                    logger.warning(f"GraphQL 未返回 {owner}/{repo} 的数据，改用 REST 接口")
+                    continue
+                nodes = [release for release in node["releases"]["nodes"] if not release.get("isDraft")]
+                if any(release["releaseAssets"].get("pageInfo", {}).get("hasNextPage") for release in nodes):
+                    logger.info(f"{owner}/{repo} 有版本的资源文件超过 100 个，改用 REST 接口")
+                    continue
+                results[(owner, repo)] = [self._graphql_release(owner, repo, release) for release in nodes]
+        return results
+    
+    def load_segment_state(self, part_path, size):
+        """读取分段下载进度 (<文件名>.part.segments)，不存在或与文件大小不符时返回 None"""
+        state_path = part_path.with_name(part_path.name + ".segments")
+        if not (state_path.exists() and part_path.exists()):
+            return None
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return state if state.get("size") == size else None
+    
+    def create_segment_state(self, part_path, size, segments):
+        """预分配 .part 文件并把文件划分为 segments 段，每段记录 [起始, 结束, 已下载字节数]"""
+        segment_size = -(-size // segments)
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+        return {
+            "size": size,
+            "ranges": [[start, min(start + segment_size, size) - 1, 0]
+                       for start in range(0, size, segment_size)]
+        }
+    
+    def _download_segmented(self, download_url, part_path, size, segments, meta=None):
+        """将文件分成 segments 段，用多个连接并行下载并写入预分配文件的对应位置
+
+        各段进度保存在 <文件名>.part.segments 中，中断后可以续传。服务器不支持
+        Range 请求时返回 False，由调用方改为单连接下载。
+        """
+        import requests
+        
+        host = urlparse(download_url).netloc
+        state_path = part_path.with_name(part_path.name + ".segments")
+        state = self.load_segment_state(part_path, size)
+        if state is None:
+            # 探测服务器是否支持 Range 请求
+            with self.scheduler.host_slot(download_url):
+                response = self.download_session.get(download_url, headers={"Range": "bytes=0-0"}, stream=True,
+                                                     timeout=DOWNLOAD_TIMEOUT)
+                response.close()
+            response.raise_for_status()
+            if response.status_code != 206:
+                return False
+            state = self.create_segment_state(part_path, size, segments)
+        
+        lock = threading.Lock()
+        
+        def save_state():
+            with lock:
+                with open(state_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f)
+        
+        def fetch(segment):
+            start, end, done = segment
+            if start + done > end:
+                return
+            try:
+                with self.scheduler.host_slot(download_url):
+                    response = self.download_session.get(download_url, stream=True, timeout=DOWNLOAD_TIMEOUT,
+                                                         headers={"Range": f"bytes={start + done}-{end}"})
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        response.close()
+                        raise requests.RequestException("服务器未返回分段内容")
+                    with open(part_path, 'r+b') as f:
+                        f.seek(start + done)
+                        for chunk in response.iter_content(chunk_size=65536):
+                            if chunk:
+                                chunk = chunk[:end + 1 - start - segment[2]]
+                                f.write(chunk)
+                                with lock:
+                                    segment[2] += len(chunk)
+                                self.metrics.transfer(host, len(chunk), meta)
+                                self.scheduler.throttle(len(chunk))
+            except requests.RequestException as e:
+                logger.warning(f"分段 {start}-{end} 下载失败: {download_url}: {e}")
+        
+        save_state()
+        try:
+            self.scheduler.run_all(3, [(fetch, (segment,), {}) for segment in state["ranges"]])
+        finally:
+            save_state()
+        
+        missing = sum(end - start + 1 - done for start, end, done in state["ranges"])
+        if missing:
+            raise requests.RequestException(f"分段下载不完整，还差 {missing} 字节")
+        state_path.unlink()
+        return True
+    
+    def resolve_download_url(self, url, prefix=None):
+        """处理代理前缀，返回实际请求的下载地址（prefix 为 None 时使用 proxy_prefix）"""
+        prefix = self.proxy_prefix if prefix is None else prefix
+        if prefix and self.uses_mirror(url):
+            # 对于下载链接，使用代理
+            return f"{prefix}{url}"
+        return url
+    
+    def uses_mirror(self, url):
+        """对于 GitHub API 的请求（如源代码包），不使用代理"""
+        return urlparse(url).netloc != urlparse(self.api_url).netloc
+    
+    def _download_get(self, url, headers=None):
+        """发送下载请求并返回流式响应
+
+        GitHub API 上的地址（zipball/tarball 源代码包）与 _api_get 一样通过 Token 池发送：
+        带上 Token，记录额度并计入 API 请求数，触发速率限制时换用其他 Token 重试，
+        所有 Token 都用完时抛出 RateLimitExceeded，由调用方推迟整个仓库。
+        源代码包会重定向到 codeload，额度信息取自重定向前的 API 响应，
+        跨主机重定向时 requests 不会转发 Authorization 头。
+        """
+        import requests
+        
+        if self.uses_mirror(url):
+            return self.download_session.get(url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+        while True:
+            token, delay = self.token_pool.acquire()
+            if delay > 0:
+                time.sleep(delay)
+            request_headers = dict(headers or {})
+            if token:
+                request_headers["Authorization"] = f"token {token}"
+            try:
+                response = self.download_session.get(url, stream=True, headers=request_headers,
+                                                     timeout=DOWNLOAD_TIMEOUT)
+            except requests.RequestException:
+                self.metrics.api_call()
+                raise
+            api_response = response.history[0] if response.history else response
+            rate_limited = self.token_pool.update(token, "core", api_response.headers, api_response.status_code)
+            self.metrics.api_call(api_response.status_code, rate_limited)
+            if not rate_limited:
+                return response
+            response.close()
+            logger.warning(f"触发 API 速率限制 (HTTP {api_response.status_code})，换用其他 Token 重试: {url}")
+    
+    def load_resume_state(self, url, part_path, updated_at=None):
+        """核对上次运行留下的 .part 文件是否仍对应同一个远程文件，返回续传校验信息
+
+        <文件名>.part.resume 中记录开始下载时的地址、资源的 updated_at，以及响应的主机和 ETag。
+        没有记录、地址或 updated_at 与当前不一致，或者既没有 updated_at 也没有 ETag
+        （无法判断源代码包是否已变化）时，丢弃 .part 文件和分段进度，从头下载。
+        """
+        resume_path = part_path.with_name(part_path.name + ".resume")
+        if not part_path.exists():
+            resume_path.unlink(missing_ok=True)
+            return {}
+        try:
+            with open(resume_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        if (isinstance(state, dict) and state.get("url") == url and state.get("updated_at") == updated_at
+                and (updated_at or state.get("etag"))):
+            return state
+        logger.info(f"无法确认远程文件未变化，丢弃未完成的下载: {part_path}")
+        for path in (part_path, part_path.with_name(part_path.name + ".segments"), resume_path):
+            path.unlink(missing_ok=True)
+        return {}
+    
+    def save_resume_state(self, url, part_path, updated_at, host, etag):
+        """开始写入新的 .part 文件时记录续传校验信息，返回记录的内容"""
+        state = {"url": url, "updated_at": updated_at, "host": host, "etag": etag}
+        _write_text_atomic(part_path.with_name(part_path.name + ".resume"), json.dumps(state))
+        return state
+    
+    @staticmethod
+    def resume_headers(offset, state, host):
+        """续传请求头：同一主机返回过强 ETag 时带上 If-Range，文件已变化时服务器返回完整内容"""
+        if not offset:
+            return {}
+        headers = {"Range": f"bytes={offset}-"}
+        etag = state.get("etag")
+        if etag and not etag.startswith("W/") and state.get("host") == host:
+            headers["If-Range"] = etag
+        return headers
+    
+    def _finish_attempt(self, host, prefix, meta, start_bytes, attempt_start, ok):
+        """记录一次下载尝试的耗时和结果（按主机和下载前缀统计）"""
+        seconds = time.monotonic() - attempt_start
+        self.metrics.request(host, seconds, ok)
+        if prefix is not None:
+            self.mirror_pool.record(prefix, meta.get("bytes", 0) - start_bytes, seconds, ok)
+    
+    def _race_mirrors(self, url):
+        """并行请求各候选前缀的前 mirror_race_bytes 字节，返回最先完成的前缀
+
+        各请求作为分段层级的任务交给全局调度器，并受 per_host_limit 限制。有前缀胜出后，
+        落后的请求在读取下一块时放弃，不计入测量；完成或失败的请求计入前缀池的测量。
+        没有可竞速的候选或全部失败时返回 None。
+        """
+        import requests
+        
+        candidates = self.mirror_pool.candidates(self.config.get("mirror_race_candidates", 3))
+        if len(candidates) < 2:
+            return None
+        winner = []
+        lock = threading.Lock()
+        
+        def probe(prefix):
+            probe_url = self.resolve_download_url(url, prefix)
+            received = 0
+            with self.scheduler.host_slot(probe_url):
+                if winner:
+                    return
+                start = time.monotonic()
+                try:
+                    headers = {"Range": f"bytes=0-{self.mirror_race_bytes - 1}"}
+                    with self.download_session.get(probe_url, stream=True, headers=headers, timeout=30) as response:
+                        response.raise_for_status()
+                        for chunk in response.iter_content(chunk_size=16384):
+                            if winner:
+                                return
+                            received += len(chunk)
+                            if received >= self.mirror_race_bytes:
+                                break
+                except requests.RequestException:
+                    self.mirror_pool.record(prefix, received, time.monotonic() - start, False)
+                    return
+            self.mirror_pool.record(prefix, received, time.monotonic() - start, True)
+            with lock:
+                if not winner:
+                    winner.append(prefix)
+        
+        self.scheduler.run_all(3, [(probe, (prefix,), {}) for prefix in candidates])
+        if not winner:
+            return None
+        logger.info(f"竞速选择下载前缀 {MirrorPool.label(winner[0])}: {url}")
+        return winner[0]
+    
+    def _hash_prefix(self, path, length, hashers):
+        """用文件开头 length 字节更新各个哈希对象（续传时使用）"""
+        if not length:
+            return
+        with open(path, 'rb') as f:
+            while length > 0:
+                chunk = f.read(min(HASH_CHUNK_SIZE, length))
+                if not chunk:
+                    break
+                length -= len(chunk)
+                for hasher in hashers:
+                    hasher.update(chunk)
+    
+    def get_repository_setting(self, owner, repo, key, default=None):
+        """读取仓库级配置，仓库未设置时使用全局配置"""
+        repo_config = self.find_repository(owner, repo) or {}
+        return repo_config.get(key, self.config.get(key, default))
+    
+    def download_asset(self, url, save_path, digests=None, expected_size=None, segments=1, meta=None):
+        """下载资源文件
+
+        下载的同时增量计算 hash_algorithms 中的各个哈希值，成功后写入 digests 字典，
+        生成文件信息时无需再读取文件。数据先写入 <文件名>.part，重试或下次运行时
+        通过 Range 请求续传；大小与 expected_size 一致后才重命名为目标文件。
+        segments 大于 1 且已知文件大小时，使用多个连接分段并行下载。
+        meta 字典传入资源的 updated_at，并用于回传响应的 ETag、收到的字节数 (bytes) 和
+        重试次数 (retries)。上次运行留下的 .part 文件只在确认远程文件未变化时续传
+        （见 load_resume_state）。
+        配置了多个下载前缀时，每次尝试选择当前最快的可用前缀，失败后换用其他前缀从
+        .part 处继续；大文件开始前先让候选前缀竞速下载开头的一小段。
+        """
+        import requests
+        
+        meta = {} if meta is None else meta
+        save_path = Path(save_path)
+        part_path = save_path.with_name(save_path.name + ".part")
+        resume_path = part_path.with_name(part_path.name + ".resume")
+        os.makedirs(save_path.parent, exist_ok=True)
+        retry_count = 0
+        resume = self.load_resume_state(url, part_path, meta.get("updated_at"))
+        
+        # 每个前缀至少尝试一次，同一前缀的重试之间等待 retry_delay
+        pool = self.mirror_pool if self.uses_mirror(url) else None
+        attempts = self.max_retries + (len(pool.prefixes) - 1 if pool else 0)
+        failed = set()
+        prefix = None
+        if pool and expected_size and expected_size >= self.mirror_race_threshold and not part_path.exists():
+            prefix = self._race_mirrors(url)
+        
+        while retry_count < attempts:
+            if pool:
+                prefix = pool.acquire(exclude=failed, prefer=None if retry_count else prefix)
+            if retry_count and (pool is None or prefix in failed):
+                time.sleep(self.retry_delay)
+            download_url = self.resolve_download_url(url, prefix)
+            host = urlparse(download_url).netloc
+            start_bytes = meta.get("bytes", 0)
+            attempt_start = time.monotonic()
+            try:
+                # 分段下载：没有单连接下载留下的 .part 文件时才使用
+                segment_state = part_path.with_name(part_path.name + ".segments")
+                if segments > 1 and expected_size and (segment_state.exists() or not part_path.exists()):
+                    if not part_path.exists():
+                        resume = self.save_resume_state(url, part_path, meta.get("updated_at"), host, None)
+                    if self._download_segmented(download_url, part_path, expected_size, segments, meta):
+                        os.replace(part_path, save_path)
+                        resume_path.unlink(missing_ok=True)
+                        self._finish_attempt(host, prefix, meta, start_bytes, attempt_start, True)
+                        if digests is not None:
+                            digests.update(self.calculate_file_hashes(save_path))
+                        logger.info(f"分段下载完成: {save_path}")
+                        return True
+                    logger.info(f"服务器不支持分段下载，改用单连接下载: {url}")
+                    segments = 1
+                
+                # 从 .part 文件中已有的字节处继续下载（包括上次运行留下的部分）
+                offset = part_path.stat().st_size if part_path.exists() else 0
+                if expected_size is not None and offset > expected_size:
+                    offset = 0
                 
-                os.makedirs(os.path.dirname(save_path), exist_ok=True)
+                hashers = [hashlib.new(name) for name in self.hash_algorithms]
+                if expected_size is None or offset < expected_size:
+                    with self.scheduler.host_slot(download_url):
+                        response = self._download_get(download_url, self.resume_headers(offset, resume, host))
+                        if offset and response.status_code == 416:
+                            # 服务器不接受该范围（文件可能已变化），从头下载
+                            response.close()
+                            offset = 0
+                            response = self._download_get(download_url)
+                        response.raise_for_status()
+                        meta["etag"] = response.headers.get("ETag")
+                        if offset and response.status_code != 206:
+                            logger.info(f"服务器不支持断点续传或文件已变化，重新下载: {url}")
+                            offset = 0
+                        elif offset:
+                            logger.info(f"从 {self.format_size(offset)} 处继续下载: {url}")
+                        if not offset:
+                            resume = self.save_resume_state(url, part_path, meta.get("updated_at"), host,
+                                                            meta["etag"])
+                        
+                        # 续传时先用已下载的部分初始化哈希计算
+                        self._hash_prefix(part_path, offset, hashers)
+                        with open(part_path, 'r+b' if offset else 'wb') as f:
+                            f.seek(offset)
+                            f.truncate()
+                            for chunk in response.iter_content(chunk_size=65536):
+                                if chunk:
+                                    f.write(chunk)
+                                    for hasher in hashers:
+                                        hasher.update(chunk)
+                                    self.metrics.transfer(host, len(chunk), meta)
+                                    self.scheduler.throttle(len(chunk))
+                else:
+                    self._hash_prefix(part_path, offset, hashers)
                 
-                with open(save_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
+                # 校验文件大小后再原子地移动到目标位置
+                size = part_path.stat().st_size
+                if expected_size is not None and size != expected_size:
+                    if size > expected_size:
+                        part_path.unlink()
+                        resume_path.unlink(missing_ok=True)
+                        resume = {}
+                    raise requests.RequestException(
+                        f"文件大小不符: 期望 {expected_size} 字节，实际 {size} 字节")
+                os.replace(part_path, save_path)
+                resume_path.unlink(missing_ok=True)
+                self._finish_attempt(host, prefix, meta, start_bytes, attempt_start, True)
                 
+                if digests is not None:
+                    digests.update((name, hasher.hexdigest())
+                                   for name, hasher in zip(self.hash_algorithms, hashers))
                 logger.info(f"下载完成: {save_path}")
                 return True
             except requests.RequestException as e:
+                self._finish_attempt(host, prefix, meta, start_bytes, attempt_start, False)
+                failed.add(prefix)
                 retry_count += 1
-                if retry_count < self.max_retries:
-                    logger.warning(f"下载失败，{retry_count}/{self.max_retries} 次重试: {url}")
-                    time.sleep(self.retry_delay)
+                meta["retries"] = retry_count
+                if retry_count < attempts:
+                    via = f"（{MirrorPool.label(prefix)}）" if pool and len(pool.prefixes) > 1 else ""
+                    logger.warning(f"下载失败{via}，{retry_count}/{attempts} 次重试: {url}")
                 else:
                     logger.error(f"下载失败 {url}: {e}")
                     return False
+            finally:
+                # 写入失败（如磁盘已满）等其他异常也要释放前缀的占用，否则长期运行的 watch 会误判前缀繁忙
+                if pool:
+                    pool.release(prefix)
     
-    def process_release(self, owner, repo, release, force=False):
-        """处理单个发布版本"""
-        version = release["tag_name"]
+    def verify_release_digests(self, owner, repo, release, staging_dir, hashes):
+        """用 GitHub 提供的 sha256 摘要校验暂存目录中的文件
+
+        hashes 为 {文件名: 哈希值字典}，没有摘要或没有计算 sha256 的文件不校验。
+        校验失败的文件被删除，下次更新时重新下载。
+        """
+        ok = True
+        for asset in release.assets:
+            digest = asset.digest or ""
+            actual = hashes.get(asset.name, {}).get("sha256")
+            if not digest.startswith("sha256:") or not actual or actual == digest[len("sha256:"):]:
+                continue
+            logger.error(f"文件校验失败，将在下次更新时重新下载: {owner}/{repo}/{release.tag}/{asset.name}")
+            (staging_dir / asset.name).unlink(missing_ok=True)
+            ok = False
+        if not ok:
+            self.metrics.count(owner, repo, "releases_incomplete")
+        return ok
+    
+    def is_release_complete(self, release_dir):
+        """判断版本目录是否已完整下载（已生成文件信息且没有未完成的 .part 文件）"""
+        release_dir = Path(release_dir)
+        if not (release_dir / "files_info.txt").exists():
+            return False
+        return not any(release_dir.glob("*.part"))
+    
+    def blob_path(self, sha256):
+        """返回内容存储中 sha256 对应的文件路径"""
+        return self.blob_dir / sha256[:2] / sha256
+    
+    def _link_blob(self, blob, dest):
+        """将内容存储中的文件链接到 dest（reflink 模式下优先使用写时复制克隆）"""
+        tmp = dest.with_name(dest.name + ".link")
+        if tmp.exists():
+            tmp.unlink()
+        if self.dedup_link == "reflink":
+            try:
+                import fcntl
+                with open(blob, 'rb') as src, open(tmp, 'wb') as dst:
+                    fcntl.ioctl(dst.fileno(), 0x40049409, src.fileno())  # FICLONE
+                os.replace(tmp, dest)
+                return
+            except (ImportError, OSError):
+                if tmp.exists():
+                    tmp.unlink()
+        os.link(blob, tmp)
+        os.replace(tmp, dest)
+    
+    def store_blob(self, path, sha256):
+        """将文件放入内容存储，已有相同内容时把 path 替换为指向已有内容的链接"""
+        blob = self.blob_path(sha256)
+        try:
+            if blob.exists():
+                self._link_blob(blob, path)
+            else:
+                os.makedirs(blob.parent, exist_ok=True)
+                if self.dedup_link == "reflink":
+                    self._link_blob(path, blob)
+                else:
+                    try:
+                        os.link(path, blob)
+                    except FileExistsError:
+                        # 其他线程刚放入了相同内容
+                        self._link_blob(blob, path)
+        except OSError as e:
+            logger.warning(f"无法放入内容存储，保留独立文件 {path}: {e}")
+    
+    def link_existing_blob(self, name, url, size, digest, updated_at, dest):
+        """资源已在内容存储中时直接链接到 dest，返回其哈希值字典；否则返回 None
+
+        优先使用版本 JSON 中的 digest (sha256:...)，没有时按下载地址、大小和更新时间
+        在状态库中查找。
+        """
+        sha256 = None
+        if digest and digest.startswith("sha256:"):
+            sha256 = digest[len("sha256:"):]
+        elif size is not None:
+            sha256 = self.state.sha256_for_asset(url, size, updated_at)
+        if not sha256:
+            return None
+        blob = self.blob_path(sha256)
+        if not blob.exists() or (size is not None and blob.stat().st_size != size):
+            return None
+        
+        digests = self.state.digests_for_sha256(sha256) or {}
+        if any(algorithm not in digests for algorithm in self.hash_algorithms):
+            digests = self.calculate_file_hashes(blob)
+        try:
+            self._link_blob(blob, dest)
+        except OSError as e:
+            logger.warning(f"无法链接内容存储中的文件 {dest}: {e}")
+            return None
+        logger.info(f"内容已存在，跳过下载: {dest}")
+        return {algorithm: digests[algorithm] for algorithm in self.hash_algorithms}
+    
+    def release_blobs(self, sha256s):
+        """删除不再被任何版本引用的内容存储文件"""
+        for sha256 in sha256s:
+            if self.state.sha256_refcount(sha256) == 0:
+                blob = self.blob_path(sha256)
+                try:
+                    if blob.exists():
+                        blob.unlink()
+                except OSError as e:
+                    logger.error(f"删除内容存储文件失败 {blob}: {e}")
+    
+    def stored_size(self, path):
+        """返回文件的大小，文件为增量存储时返回还原后的大小，都不存在时返回 None"""
+        try:
+            return path.stat().st_size
+        except OSError:
+            pass
+        try:
+            return DeltaStore.read_header(DeltaStore.stored_path(path))["size"]
+        except (OSError, ValueError, KeyError):
+            return None
+    
+    def compact_repository(self, owner, repo):
+        """把仓库较旧的保留版本转为增量存储，返回本次节省的字节数
+
+        最新版本始终完整保存（之前转换过的文件先还原），其余版本从最旧的开始，以相邻的
+        较新版本为基准逐个转换，此时基准版本还是完整文件，不需要先还原。
+        """
+        latest = self.state.latest_release(owner, repo)
+        if latest is None:
+            return 0
+        order = [latest] + [row for row in self.state.releases(owner, repo) if row["tag"] != latest["tag"]]
+        deltas = {(row["tag"], row["name"]): row for row in self.state.deltas(owner, repo)}
+        for (tag, name), row in deltas.items():
+            if tag == latest["tag"] and row["method"] != "full":
+                self._restore_file(owner, repo, tag, Path(latest["path"]), name)
+        
+        saved = 0
+        with self.metrics.phase(owner, repo, "compact"):
+            for newer, older in reversed(list(zip(order, order[1:]))):
+                saved += self._compact_release(owner, repo, older, newer, deltas)
+        totals = self.state.delta_savings().get(f"{owner}/{repo}")
+        if saved or totals:
+            logger.info(f"增量存储 {owner}/{repo}: 本次节省 {self.format_size(saved)}，"
+                        f"共 {totals['files'] if totals else 0} 个文件节省 "
+                        f"{self.format_size(totals['saved_bytes'] if totals else 0)}")
+        return saved
+    
+    def _compact_release(self, owner, repo, release, base_release, deltas):
+        """以 base_release 中对应的文件为基准转换 release 中的文件，返回节省的字节数"""
+        tag, base_tag = release["tag"], base_release["tag"]
+        release_dir, base_dir = Path(release["path"]), Path(base_release["path"])
+        base_names = {_asset_key(row["name"], base_tag): row["name"]
+                      for row in self.state.assets(owner, repo, base_tag)}
+        recorded = self.read_file_info(release_dir)
+        known_hashes = {}
+        saved = 0
+        for asset in self.state.assets(owner, repo, tag):
+            name, sha256 = asset["name"], asset["sha256"]
+            path = release_dir / name
+            row = deltas.get((tag, name))
+            # 已转换的文件保持不变；节省太少的文件在基准版本变化前不再尝试
+            if row is not None and (row["method"] != "full" or row["base_tag"] == base_tag):
+                continue
+            if not sha256 or not path.exists():
+                continue
+            # 去重存储中被多个版本共用的内容不转换
+            if self.dedup and self.state.sha256_refcount(sha256) > 1:
+                continue
+            base_name = base_names.get(_asset_key(name, tag))
+            if base_name and self.delta_store.depends_on(base_dir / base_name, path):
+                # 版本顺序变化后（如重建状态库）基准文件可能反过来依赖这个文件，改为不使用基准
+                base_name = None
+            try:
+                header = self.delta_store.encode(path, tag, name, sha256,
+                                                 base_dir / base_name if base_name else None, base_tag, base_name)
+            except (OSError, ValueError) as e:
+                logger.error(f"转换为增量存储失败 {path}: {e}")
+                continue
+            if header is None:
+                self.state.record_delta(owner, repo, tag, name, "full", asset["size"], asset["size"], base_tag)
+                continue
+            if self.dedup:
+                # 内容只被这个文件使用，删除内容存储中的副本才能真正释放空间
+                blob = self.blob_path(sha256)
+                if blob.exists():
+                    blob.unlink()
+            self.state.record_delta(owner, repo, tag, name, header["method"], asset["size"],
+                                    header["stored_size"], header["base_tag"], header["base_name"])
+            self.metrics.count(owner, repo, "assets_delta")
+            self.metrics.count(owner, repo, "delta_saved_bytes", asset["size"] - header["stored_size"])
+            saved += asset["size"] - header["stored_size"]
+            known_hashes[name] = recorded.get(name)
+            logger.info(f"已转为增量存储 ({header['method']}): {path} "
+                        f"{self.format_size(asset['size'])} -> {self.format_size(header['stored_size'])}")
+        if known_hashes:
+            self.generate_file_info(str(release_dir), known_hashes)
+        return saved
+    
+    def _restore_file(self, owner, repo, tag, release_dir, name):
+        """把增量存储的文件还原为完整文件，返回是否成功"""
+        path = release_dir / name
+        try:
+            header = self.delta_store.restore(path)
+        except FileNotFoundError:
+            self.state.remove_delta(owner, repo, tag, name)
+            return True
+        except (OSError, ValueError) as e:
+            logger.error(f"还原增量存储的文件失败 {path}: {e}")
+            return False
+        self.state.remove_delta(owner, repo, tag, name)
+        if self.dedup:
+            self.store_blob(path, header["sha256"])
+        logger.info(f"已还原为完整文件: {path}")
+        return True
+    
+    def detach_delta_dependents(self, owner, repo, tag):
+        """删除或替换版本前，把以它为基准的其他版本中的增量文件还原为完整文件"""
+        rows = self.state.delta_dependents(owner, repo, tag)
+        for row in rows:
+            self._restore_file(owner, repo, row["tag"], Path(row["path"]), row["name"])
+        for release_dir in {row["path"] for row in rows}:
+            self.generate_file_info(release_dir, self.read_file_info(release_dir))
+    
+    def restore_repository(self, owner, repo):
+        """把仓库所有增量存储的文件还原为完整文件（restore 命令），返回是否全部成功"""
+        releases = {row["tag"]: row for row in self.state.releases(owner, repo)}
+        restored = {}
+        count = 0
+        ok = True
+        # 从新到旧还原，每个文件的基准已经是完整文件
+        order = list(releases)
+        for row in sorted(self.state.deltas(owner, repo), key=lambda row: order.index(row["tag"])
+                          if row["tag"] in releases else len(order)):
+            if row["method"] == "full":
+                self.state.remove_delta(owner, repo, row["tag"], row["name"])
+            elif row["tag"] in releases:
+                release_dir = Path(releases[row["tag"]]["path"])
+                if self._restore_file(owner, repo, row["tag"], release_dir, row["name"]):
+                    restored[release_dir] = True
+                    count += 1
+                else:
+                    ok = False
+        for release_dir in restored:
+            self.generate_file_info(str(release_dir), self.read_file_info(release_dir))
+        logger.info(f"{owner}/{repo}: 已还原 {len(restored)} 个版本中的 {count} 个增量存储文件")
+        return ok
+    
+    def release_files(self, repo, release):
+        """列出版本包含的所有文件，返回 (文件名, 下载地址, 大小) 列表，源代码包大小未知"""
+        version = release.tag
+        files = [(asset.name, asset.url, asset.size) for asset in release.assets]
+        if release.zipball_url:
+            files.append((f"{repo}-{version}-source.zip", release.zipball_url, None))
+        if release.tarball_url:
+            files.append((f"{repo}-{version}-source.tar.gz", release.tarball_url, None))
+        return files
+    
+    def _match_asset_pattern(self, pattern, name):
+        """匹配资源文件名：re: 开头为正则表达式，否则为通配符，均不区分大小写"""
+        if pattern.startswith("re:"):
+            return re.search(pattern[3:], name, re.IGNORECASE) is not None
+        return fnmatch.fnmatch(name.lower(), pattern.lower())
+    
+    def asset_skip_reason(self, owner, repo, name, size, source=None):
+        """按仓库的资源选择规则判断文件是否跳过，返回跳过原因，需要下载时返回 None
+
+        source 为源代码包类型（zip 或 tar），普通资源为 None。include/exclude 和
+        max_asset_size 只作用于普通资源，源代码包由 source_archive 控制。
+        """
+        if source is not None:
+            archive = self.get_repository_setting(owner, repo, "source_archive", "both")
+            return None if archive in ("both", source) else "source_archive"
+        
+        include = self.get_repository_setting(owner, repo, "include", [])
+        exclude = self.get_repository_setting(owner, repo, "exclude", [])
+        if isinstance(include, str):
+            include = [include]
+        if isinstance(exclude, str):
+            exclude = [exclude]
+        if include and not any(self._match_asset_pattern(p, name) for p in include):
+            return "include"
+        if any(self._match_asset_pattern(p, name) for p in exclude):
+            return "exclude"
+        
+        max_size = self.get_repository_setting(owner, repo, "max_asset_size", 0)
+        if max_size and size is not None and size > max_size:
+            return "max_asset_size"
+        return None
+    
+    def select_release_files(self, owner, repo, release):
+        """按资源选择规则划分版本文件，返回 (需要下载的文件, 跳过的文件)
+
+        需要下载的文件与 release_files 格式相同，跳过的文件为字典列表，
+        包含 name、url、size、source、reason，用于写入状态库。
+        """
+        sources = {release.zipball_url: "zip", release.tarball_url: "tar"}
+        selected, skipped = [], []
+        for name, url, size in self.release_files(repo, release):
+            source = sources.get(url)
+            reason = self.asset_skip_reason(owner, repo, name, size, source)
+            if reason is None:
+                selected.append((name, url, size))
+            else:
+                skipped.append({"name": name, "url": url, "size": size, "source": source, "reason": reason})
+        return selected, skipped
+    
+    def backfill_tags(self, owner, repo):
+        """返回之前跳过的文件在当前规则下需要下载的版本标签集合"""
+        return {row["tag"] for row in self.state.skipped_assets(owner, repo)
+                if self.asset_skip_reason(owner, repo, row["name"], row["size"], row["source"]) is None}
+    
+    def staging_path(self, owner, repo, version):
+        """返回版本的暂存目录，下载和校验在这里完成后才整体移入下载目录"""
+        return self.base_dir / ".staging" / owner / repo / version
+    
+    def move_to_trash(self, path):
+        """把目录移入回收区并在后台删除
+
+        回收区与下载目录在同一文件系统中，移动只是一次重命名，不会阻塞更新流程。
+        """
+        trash_dir = self.base_dir / ".trash"
+        os.makedirs(trash_dir, exist_ok=True)
+        relative = Path(path).relative_to(self.base_dir)
+        target = trash_dir / f"{time.time_ns()}-{'-'.join(relative.parts)}"
+        os.rename(path, target)
+        self.purge_trash()
+    
+    def purge_trash(self, wait=False):
+        """启动后台线程删除回收区的内容，wait 为 True 时等待删除完成"""
+        with self._trash_lock:
+            if self._trash_thread is None:
+                self._trash_thread = threading.Thread(target=self._purge_trash, name="grm-trash", daemon=True)
+                self._trash_thread.start()
+            thread = self._trash_thread
+        if wait:
+            thread.join()
+    
+    def _purge_trash(self):
+        """逐个删除回收区中的条目，直到回收区为空"""
+        trash_dir = self.base_dir / ".trash"
+        failed = set()
+        while True:
+            with self._trash_lock:
+                entries = [e for e in trash_dir.iterdir() if e.name not in failed] if trash_dir.exists() else []
+                if not entries:
+                    self._trash_thread = None
+                    return
+            for entry in entries:
+                try:
+                    if entry.is_dir() and not entry.is_symlink():
+                        shutil.rmtree(entry)
+                    else:
+                        entry.unlink()
+                except OSError as e:
+                    logger.error(f"清理回收区失败 {entry}: {e}")
+                    failed.add(entry.name)
+    
+    def prepare_release(self, owner, repo, release, force=False):
+        """准备暂存目录并列出需要下载的文件
+
+        文件下载到暂存目录，全部校验通过后由 finish_release 移入版本目录，版本目录中
+        不会出现下载了一半的文件。返回 (release_dir, downloads, known_hashes)，downloads
+        中每项为 download_asset 的参数 (url, save_path, digests, expected_size, segments, meta)；
+        版本已完整下载时返回 None。
+        """
+        version = release.tag
         release_dir = self.base_dir / owner / repo / version
+        staging_dir = self.staging_path(owner, repo, version)
         
-        # 检查是否已下载，如果已存在且不是强制更新，则跳过
+        # 检查是否已下载，如果已完整下载且不是强制更新，则跳过
         if release_dir.exists() and not force:
-            logger.info(f"版本已存在: {owner}/{repo}/{version}")
-            return
+            if not self.is_release_complete(release_dir):
+                # 旧版本直接在版本目录中下载，中断后留下的目录移入暂存区继续下载
+                logger.info(f"继续下载未完成的版本: {owner}/{repo}/{version}")
+                if staging_dir.exists():
+                    self.move_to_trash(release_dir)
+                else:
+                    os.makedirs(staging_dir.parent, exist_ok=True)
+                    os.rename(release_dir, staging_dir)
+            else:
+                selected, skipped = self.select_release_files(owner, repo, release)
+                if all(self.stored_size(release_dir / name) is not None for name, _, _ in selected):
+                    logger.info(f"版本已存在: {owner}/{repo}/{version}")
+                    self.metrics.count(owner, repo, "assets_skipped", len(selected))
+                    # 目录完整但状态库中没有记录（如上次写入前中断），从磁盘补录
+                    self.index_release_dir(owner, repo, version, release_dir, release.published_at,
+                                           [f for f in skipped if self.stored_size(release_dir / f["name"]) is None])
+                    return None
+                # 资源选择规则变化后，补充下载之前跳过的文件
+                logger.info(f"补充下载按当前规则选中的文件: {owner}/{repo}/{version}")
+        elif staging_dir.exists() and not force:
+            logger.info(f"继续下载未完成的版本: {owner}/{repo}/{version}")
         
-        # 如果是强制更新且目录已存在，先删除旧目录
+        # 如果是强制更新，旧目录和暂存目录移入回收区
         if force and release_dir.exists():
             logger.info(f"强制更新: 删除旧版本 {owner}/{repo}/{version}")
-            shutil.rmtree(release_dir)
-        
-        os.makedirs(release_dir, exist_ok=True)
-        
-        # 使用多线程下载所有资源
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = []
-            
-            # 下载发布资源
-            for asset in release["assets"]:
-                asset_path = release_dir / asset["name"]
-                futures.append(executor.submit(
-                    self.download_asset, 
-                    asset["browser_download_url"], 
-                    asset_path
-                ))
-            
-            # 下载源代码包
-            if "zipball_url" in release:
-                zip_path = release_dir / f"{repo}-{version}-source.zip"
-                futures.append(executor.submit(
-                    self.download_asset,
-                    release["zipball_url"],
-                    zip_path
-                ))
-            
-            if "tarball_url" in release:
-                tar_path = release_dir / f"{repo}-{version}-source.tar.gz"
-                futures.append(executor.submit(
-                    self.download_asset,
-                    release["tarball_url"],
-                    tar_path
-                ))
-            
-            # 等待所有下载完成
-            for future in futures:
-                future.result()
-        
-        # 生成文件信息记录
-        self.generate_file_info(str(release_dir))
+            with self._delta_lock:
+                self.detach_delta_dependents(owner, repo, version)
+                self.move_to_trash(release_dir)
+                sha256s = self.state.release_sha256s(owner, repo, version)
+                self.state.remove_release(owner, repo, version)
+            self.release_blobs(sha256s)
+        if force and staging_dir.exists():
+            self.move_to_trash(staging_dir)
+        
+        os.makedirs(staging_dir, exist_ok=True)
+        
+        # 下载时计算的哈希值，按文件名记录
+        known_hashes = {}
+        
+        # 超过阈值的大文件使用多连接分段下载
+        segments = self.get_repository_setting(owner, repo, "download_segments", 4)
+        segment_threshold = self.get_repository_setting(owner, repo, "segment_threshold", 64 * 1024 * 1024)
+        
+        selected, skipped = self.select_release_files(owner, repo, release)
+        if skipped:
+            logger.info(f"按资源选择规则跳过 {len(skipped)} 个文件: {owner}/{repo}/{version}")
+            self.metrics.count(owner, repo, "assets_excluded", len(skipped))
+        
+        assets = {asset.name: asset for asset in release.assets}
+        downloads = []
+        for name, url, size in selected:
+            path = staging_dir / name
+            # 版本目录中已有（含增量存储）或上次运行已下载完成的文件跳过（源代码包大小未知，存在即视为完成）
+            if any(stored is not None and (size is None or stored == size)
+                   for stored in (self.stored_size(release_dir / name), self.stored_size(path))):
+                self.metrics.count(owner, repo, "assets_skipped")
+                continue
+            # 启用去重时，内容存储中已有的资源直接链接，不再下载
+            if self.dedup and name in assets:
+                digests = self.link_existing_blob(name, url, size, assets[name].digest,
+                                                  assets[name].updated_at, path)
+                if digests:
+                    known_hashes[name] = digests
+                    self.metrics.count(owner, repo, "assets_linked")
+                    continue
+            downloads.append((
+                url,
+                path,
+                known_hashes.setdefault(name, {}),
+                size,
+                segments if size is not None and size >= segment_threshold else 1,
+                {"updated_at": assets[name].updated_at} if name in assets else {}
+            ))
+        
+        return release_dir, downloads, known_hashes
+    
+    def finish_release(self, owner, repo, release, release_dir, results, known_hashes, downloads=()):
+        """所有下载成功并校验通过后，把暂存目录移入版本目录并写入状态库，否则留到下次更新时继续"""
+        self.metrics.record_downloads(owner, repo, downloads, results)
+        version = release.tag
+        if not all(results):
+            # 保留暂存目录，下次更新时继续下载未完成的文件
+            logger.error(f"版本下载不完整，将在下次更新时继续: {owner}/{repo}/{version}")
+            self.metrics.count(owner, repo, "releases_incomplete")
+            return False
+        
+        staging_dir = self.staging_path(owner, repo, version)
+        # 清单中记录版本 JSON 给出的大小和下载地址，供 verify 命令校验和修复
+        manifest_sources = {name: {"expected_size": size, "url": url}
+                            for name, url, size in self.release_files(repo, release)}
+        with self.metrics.phase(owner, repo, "hash"):
+            if release_dir.exists():
+                # 补充下载：校验新文件后逐个移入已有的版本目录
+                if not self.verify_release_digests(owner, repo, release, staging_dir, known_hashes):
+                    return False
+                for path in staging_dir.iterdir():
+                    if path.is_file() and not is_file_info_ignored(path.name):
+                        os.replace(path, release_dir / path.name)
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                file_info = self.generate_file_info(str(release_dir), known_hashes, manifest_sources)
+            else:
+                # 在暂存目录中生成文件信息记录（哈希缓存按相对路径和 inode 记录，重命名后仍然有效）
+                file_info = self.generate_file_info(str(staging_dir), known_hashes, manifest_sources)
+                if not self.verify_release_digests(owner, repo, release, staging_dir,
+                                                   {name: item["hashes"] for name, item in file_info.items()}):
+                    return False
+                os.makedirs(release_dir.parent, exist_ok=True)
+                os.rename(staging_dir, release_dir)
+
+            # 启用去重时，把文件放入内容存储，版本目录中只保留链接
+            if self.dedup:
+                for name, item in file_info.items():
+                    if item["hashes"].get("sha256"):
+                        self.store_blob(release_dir / name, item["hashes"]["sha256"])
+        
+        etags = {Path(args[1]).name: args[5].get("etag") for args in downloads}
+        sources = {name: url for name, url, _ in self.release_files(repo, release)}
+        updated = {asset.name: asset.updated_at for asset in release.assets}
+        # 跳过的文件记入状态库，规则变化后无需强制更新即可补充下载
+        _, skipped = self.select_release_files(owner, repo, release)
+        self.state.record_release(owner, repo, release.tag, release.published_at, release_dir, [
+            {"name": name, "size": item["size"], "digests": item["hashes"],
+             "url": sources.get(name), "etag": etags.get(name), "updated_at": updated.get(name)}
+            for name, item in file_info.items()
+        ], [f for f in skipped if f["name"] not in file_info])
+        self.metrics.count(owner, repo, "releases_downloaded")
+        return True
+    
+    def process_release(self, owner, repo, release, force=False):
+        """处理单个发布版本"""
+        prepared = self.prepare_release(owner, repo, release, force)
+        if prepared is None:
+            return
+        release_dir, downloads, known_hashes = prepared
+        
+        # 所有资源作为下载任务提交到全局调度器，等待所有下载完成
+        with self.metrics.phase(owner, repo, "download"):
+            results = self.scheduler.run_all(2, [(self.download_asset, args, {}) for args in downloads])
+        self.finish_release(owner, repo, release, release_dir, results, known_hashes, downloads)
     
     def get_directory_size(self, path):
         """计算目录大小"""
@@ -268,97 +2996,352 @@ class GithubReleaseUpdater:
             size /= 1024
         return f"{size:.2f} TB"
     
-    def update_repository(self, owner, repo, force=False):
-        """更新单个仓库的发布版本"""
-        logger.info(f"正在检查 {owner}/{repo} 的更新...")
-        releases = self.get_releases(owner, repo)
-        
-        if not releases:
-            logger.info(f"没有找到 {owner}/{repo} 的发布版本")
-            return
+    def get_repository_max_versions(self, owner, repo):
+        """获取仓库的max_versions设置，未设置时使用默认值"""
+        repo_config = self.find_repository(owner, repo)
         
-        # 获取已下载的版本
-        repo_dir = self.base_dir / owner / repo
-        existing_versions = []
-        if repo_dir.exists():
-            existing_versions = [d.name for d in repo_dir.iterdir() if d.is_dir()]
+        if repo_config and "max_versions" in repo_config:
+            return repo_config["max_versions"]
+        return self.default_max_versions
+    
+    def plan_repository_update(self, owner, repo, releases, max_versions, not_modified=False, force=False):
+        """确定需要下载的版本，返回版本列表；版本列表未变化且无需下载时返回 None"""
+        # 从状态库获取已下载的版本
+        existing_versions = self.state.release_tags(owner, repo)
         
         # 获取GitHub上所有版本的标签
-        all_versions = [release["tag_name"] for release in releases]
+        all_versions = [release.tag for release in releases]
+        
+        # 之前跳过的文件在当前规则下需要下载的版本
+        backfill = self.backfill_tags(owner, repo)
         
         # 找出需要下载的新版本
         versions_to_download = []
         for release in releases:
-            version = release["tag_name"]
-            if force or version not in existing_versions:
+            version = release.tag
+            if force or version not in existing_versions or version in backfill:
                 versions_to_download.append(release)
-        
-        # 获取此仓库的max_versions设置
-        repo_config = next((r for r in self.config["repositories"] 
-                           if r["owner"] == owner and r["repo"] == repo), None)
-        
-        if repo_config and "max_versions" in repo_config:
-            max_versions = repo_config["max_versions"]
-        else:
-            max_versions = self.default_max_versions
-            
+
         # 确定要保留的版本（最新的max_versions个）
         versions_to_keep = all_versions[:max_versions]
         
-        # 下载需要的新版本
-        if versions_to_download:
-            # 只下载需要保留的版本中尚未下载的部分
-            versions_to_actually_download = [r for r in versions_to_download if r["tag_name"] in versions_to_keep]
-            if versions_to_actually_download:
-                logger.info(f"将为 {owner}/{repo} 下载 {len(versions_to_actually_download)} 个新版本")
-                with ThreadPoolExecutor(max_workers=3) as executor:
-                    for release in versions_to_actually_download:
-                        executor.submit(self.process_release, owner, repo, release, force)
-            else:
-                logger.info(f"没有新版本需要下载: {owner}/{repo}")
+        if not force and backfill.intersection(versions_to_keep):
+            logger.info(f"{owner}/{repo} 的资源选择规则已变化，补充下载: "
+                        f"{', '.join(v for v in versions_to_keep if v in backfill)}")
+        
+        # 版本列表未变化且要保留的版本都已下载，跳过下载和清理
+        if (not_modified and not force and all(v in existing_versions for v in versions_to_keep)
+                and not backfill.intersection(versions_to_keep)):
+            logger.info(f"{owner}/{repo} 没有变化，跳过")
+            return None
+        
+        # 只下载需要保留的版本中尚未下载的部分
+        keep = set(versions_to_keep)
+        versions_to_actually_download = [r for r in versions_to_download if r.tag in keep]
+        if versions_to_actually_download:
+            logger.info(f"将为 {owner}/{repo} 下载 {len(versions_to_actually_download)} 个新版本")
         else:
             logger.info(f"没有新版本需要下载: {owner}/{repo}")
+        return versions_to_actually_download
+    
+    def cleanup_old_versions(self, owner, repo, releases, max_versions):
+        """清理多余版本，只保留最新的max_versions个版本
+
+        已下载版本从状态库读取（按发布时间排序），再按本次获取的版本顺序排序；排序使用
+        预先建立的 标签→序号 映射，不在列表中的版本排在最后。删除的版本移入回收区后台删除。
+        """
+        rank = {release.tag: i for i, release in enumerate(releases)}
+        versions = sorted((row["tag"] for row in self.state.releases(owner, repo)),
+                          key=lambda tag: rank.get(tag, len(rank)))
         
-        # 清理多余版本，只保留最新的max_versions个版本
-        if repo_dir.exists():
-            versions = sorted([d.name for d in repo_dir.iterdir() if d.is_dir()], 
-                             key=lambda x: releases.index(next((r for r in releases if r["tag_name"] == x), {"tag_name": x}))
-                             if x in all_versions else float('inf'))
-            
-            versions_to_delete = versions[max_versions:]
-            if versions_to_delete:
-                logger.info(f"清理 {owner}/{repo} 的旧版本: {', '.join(versions_to_delete)}")
-                for version in versions_to_delete:
-                    version_dir = repo_dir / version
-                    try:
-                        shutil.rmtree(version_dir)
-                        logger.info(f"已删除旧版本: {owner}/{repo}/{version}")
-                    except Exception as e:
-                        logger.error(f"删除版本 {owner}/{repo}/{version} 失败: {e}")
-            
+        versions_to_delete = versions[max_versions:]
+        cleanup_start = time.monotonic()
+        if versions_to_delete:
+            logger.info(f"清理 {owner}/{repo} 的旧版本: {', '.join(versions_to_delete)}")
+            for version in versions_to_delete:
+                version_dir = self.base_dir / owner / repo / version
+                try:
+                    self.detach_delta_dependents(owner, repo, version)
+                    if version_dir.exists():
+                        self.move_to_trash(version_dir)
+                    sha256s = self.state.release_sha256s(owner, repo, version)
+                    self.state.remove_release(owner, repo, version)
+                    self.release_blobs(sha256s)
+                    self.metrics.count(owner, repo, "releases_removed")
+                    logger.info(f"已删除旧版本: {owner}/{repo}/{version}")
+                except Exception as e:
+                    logger.error(f"删除版本 {owner}/{repo}/{version} 失败: {e}")
+        
+        # 不再保留的版本留下的未完成暂存目录一并清理
+        staging_root = self.base_dir / ".staging" / owner / repo
+        if staging_root.exists():
+            keep = {Path(tag).parts[0] for tag in list(rank)[:max_versions]}
+            for staged in staging_root.iterdir():
+                if staged.name not in keep:
+                    logger.info(f"清理未完成的旧版本: {owner}/{repo}/{staged.name}")
+                    self.move_to_trash(staged)
+        if versions_to_delete:
+            self.metrics.add_phase(owner, repo, "cleanup", time.monotonic() - cleanup_start)
+        # 按本次获取的顺序排在最前的已下载版本即最新版本，供 list 和 serve 的 latest 使用
+        if versions and versions[0] in rank:
+            self.state.set_latest(owner, repo, versions[0])
+
         logger.info(f"保留 {owner}/{repo} 的最新 {max_versions} 个版本")
+        if self.delta_storage:
+            self.compact_repository(owner, repo)
     
-    def update_all(self, force_repo_index=None):
-        """更新所有配置的仓库"""
-        if force_repo_index is not None:
+    def update_repository(self, owner, repo, force=False, releases=None):
+        """更新单个仓库的发布版本，返回获取到的最新版本列表
+
+        releases 为预先批量获取（如 GraphQL）的版本列表，为 None 时通过 REST 接口获取。
+        """
+        with self.metrics.phase(owner, repo, "total"):
+            logger.info(f"正在检查 {owner}/{repo} 的更新...")
+            max_versions = self.get_repository_max_versions(owner, repo)
+
+            # 只获取需要保留的最新max_versions个版本
+            if releases is None:
+                with self.metrics.phase(owner, repo, "api"):
+                    releases, not_modified = self.get_releases(owner, repo, limit=max_versions)
+            else:
+                releases, not_modified = releases[:max_versions], False
+
+            if not releases:
+                logger.info(f"没有找到 {owner}/{repo} 的发布版本")
+                return releases
+
+            to_download = self.plan_repository_update(owner, repo, releases, max_versions, not_modified, force)
+            if to_download is None:
+                return releases
+
+            # 下载需要的新版本
+            self.scheduler.run_all(1, [(self.process_release, (owner, repo, release, force), {})
+                                       for release in to_download])
+
+            self.cleanup_old_versions(owner, repo, releases, max_versions)
+            return releases
+    
+    def prefetch_releases(self, discovery):
+        """discovery 为 graphql 时批量获取所有仓库的版本，返回 {(owner, repo): releases}"""
+        if discovery != "graphql":
+            return {}
+        if not self.github_token:
+            logger.warning("GraphQL 查询需要 GitHub Token（github_token 或 GITHUB_TOKEN），改用 REST 接口")
+            return {}
+        with self.metrics.phase(None, None, "graphql"):
+            return self.discover_releases_graphql([
+                (r["owner"], r["repo"], r.get("max_versions", self.default_max_versions))
+                for r in self.config["repositories"]
+            ])
+    
+    def update_all(self, force_repo_index=None, discovery=None, engine=None):
+        """更新所有配置的仓库
+
+        discovery 为 "graphql" 时（默认取配置中的 discovery），先用一次 GraphQL
+        查询批量获取所有仓库的版本，再进入下载流程。engine 为 "async" 时
+        （默认取配置中的 engine）使用基于 asyncio 的更新引擎，缺少 aiohttp 时不做任何更新，
+        返回 False。
+        """
+        discovery = discovery or self.discovery
+        engine = engine or self.config.get("engine", "thread")
+        if engine == "async" and not AsyncUpdateEngine.available():
+            return False
+        self.metrics = RunMetrics(engine)
+        self.purge_trash()  # 上次运行中断时留在回收区的内容
+        if engine == "async":
+            AsyncUpdateEngine(self).run(force_repo_index, discovery)
+        elif force_repo_index is not None:
             # 强制更新指定序号的仓库
             if 1 <= force_repo_index <= len(self.config["repositories"]):
                 repo_info = self.config["repositories"][force_repo_index - 1]
-                self.update_repository(repo_info["owner"], repo_info["repo"], force=True)
+                self.run_repository_updates([(repo_info["owner"], repo_info["repo"], {"force": True})])
             else:
                 logger.error(f"无效的仓库序号: {force_repo_index}")
         else:
             # 正常更新所有仓库
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                for repo_info in self.config["repositories"]:
-                    owner = repo_info["owner"]
-                    repo = repo_info["repo"]
-                    executor.submit(self.update_repository, owner, repo)
+            prefetched = self.prefetch_releases(discovery)
+            self.run_repository_updates([
+                (repo_info["owner"], repo_info["repo"],
+                 {"releases": prefetched.get((repo_info["owner"], repo_info["repo"]))})
+                for repo_info in self.config["repositories"]
+            ])
+        
+        self.response_cache.save()
+        self.state.save_mirror_stats(self.mirror_pool.snapshot())
+        self.token_pool.log_report()
+        self.write_run_report()
+        self.purge_trash(wait=True)  # 等待后台删除旧版本完成
+    
+    def write_run_report(self):
+        """输出本次运行的统计
+
+        JSON 报告写入 run_report（默认为配置文件旁的 run_report.json，设为空字符串时不写入），
+        设置了 prometheus_textfile 时同时写入 Prometheus 文本格式，供 node_exporter 的
+        textfile collector 采集。返回报告字典。
+        """
+        self.metrics.finish()
+        report = self.metrics.report(self.token_pool.report(), self.mirror_pool.report(), self.state.delta_savings())
+        totals = report["totals"]
+        logger.info(f"本次运行耗时 {report['wall_time']:.1f} 秒: 下载 {totals['assets_downloaded']} 个文件 "
+                    f"({self.format_size(totals['bytes'])}，平均 {self.format_size(totals['throughput'])}/s)，"
+                    f"跳过 {totals['assets_skipped'] + totals['assets_linked']} 个，"
+                    f"按规则排除 {totals['assets_excluded']} 个，失败 {totals['assets_failed']} 个，"
+                    f"重试 {totals['retries']} 次，API 请求 {report['api']['calls']} 次")
+        if report["storage"]:
+            logger.info(f"增量存储共节省 {self.format_size(sum(item['saved_bytes'] for item in report['storage'].values()))}"
+                        f"（本次转换 {totals['assets_delta']} 个文件，节省 {self.format_size(totals['delta_saved_bytes'])}）")
+        
+        report_path = self.config.get("run_report", str(Path(self.config_path).parent / "run_report.json"))
+        try:
+            if report_path:
+                _write_text_atomic(report_path, json.dumps(report, ensure_ascii=False, indent=2))
+            if self.config.get("prometheus_textfile"):
+                _write_text_atomic(self.config["prometheus_textfile"], self.metrics.prometheus(report))
+        except OSError as e:
+            logger.error(f"写入运行报告失败: {e}")
+        return report
+    
+    def _update_or_defer(self, deferred, owner, repo, **kwargs):
+        """更新仓库，API 额度用完时记入 deferred，等额度恢复后再更新"""
+        try:
+            self.update_repository(owner, repo, **kwargs)
+        except RateLimitExceeded as e:
+            logger.warning(f"{owner}/{repo}: {e}，推迟到额度恢复后再更新")
+            deferred.append((owner, repo, kwargs, e.reset_at))
+    
+    def run_repository_updates(self, calls):
+        """通过全局调度器更新一组仓库，calls 为 (owner, repo, kwargs) 列表
+
+        因 API 额度用完而推迟的仓库在额度重置后重新提交，不会被丢弃。
+        """
+        while calls:
+            deferred = []
+            self.scheduler.run_all(0, [(self._update_or_defer, (deferred, owner, repo), kwargs)
+                                       for owner, repo, kwargs in calls])
+            if not deferred or not self.wait_for_rate_limit(min(d[3] for d in deferred), len(deferred)):
+                return
+            calls = [(owner, repo, kwargs) for owner, repo, kwargs, _ in deferred]
+    
+    def wait_for_rate_limit(self, reset_at, count):
+        """等待 API 额度重置，等待时间超过 rate_limit_max_wait 时返回 False"""
+        wait = reset_at - time.time() + 1
+        if wait > self.rate_limit_max_wait:
+            logger.error(f"API 额度要到 {datetime.fromtimestamp(reset_at):%H:%M:%S} 才恢复，"
+                         f"超过 rate_limit_max_wait，{count} 个仓库留到下次更新")
+            return False
+        if wait > 0:
+            logger.warning(f"API 额度已用完，等待 {int(wait)} 秒后继续更新 {count} 个仓库")
+            time.sleep(wait)
+        return True
+    
+    def polling_interval(self, owner, repo, releases):
+        """根据仓库的发布节奏计算 watch 模式的检查间隔（秒）
+
+        取本次获取的版本和状态库中已下载版本的发布时间，以相邻版本间隔的中位数和
+        距最近一次发布的时间中较大者乘以 watch_cadence_factor，并限制在
+        watch_min_interval 和 watch_max_interval 之间：经常发布的仓库检查得勤，
+        长期没有发布的仓库检查得少。
+        """
+        min_interval = self.get_repository_setting(owner, repo, "watch_min_interval", 15 * 60)
+        max_interval = self.get_repository_setting(owner, repo, "watch_max_interval", 24 * 3600)
+        factor = self.get_repository_setting(owner, repo, "watch_cadence_factor", 0.25)
+        
+        published = {release.published_at for release in releases}
+        published.update(row["published_at"] for row in self.state.releases(owner, repo))
+        times = []
+        for value in published:
+            try:
+                times.append(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp())
+            except (AttributeError, ValueError):
+                continue
+        if not times:
+            return max_interval
+        
+        times.sort()
+        gaps = sorted(b - a for a, b in zip(times, times[1:]) if b > a)
+        typical = gaps[len(gaps) // 2] if gaps else 0
+        interval = max(typical, time.time() - times[-1]) * factor
+        return min(max(interval, min_interval), max_interval)
+    
+    def _watch_check(self, owner, repo, stop):
+        """watch 模式下检查一个仓库并安排下次检查，收到退出信号后不再开始新的检查"""
+        if stop.is_set():
+            return
+        interval = self.get_repository_setting(owner, repo, "watch_min_interval", 15 * 60)
+        try:
+            releases = self.update_repository(owner, repo)
+            if releases:
+                interval = self.polling_interval(owner, repo, releases)
+            next_check = time.time() + interval
+        except RateLimitExceeded as e:
+            logger.warning(f"{owner}/{repo}: {e}，推迟到额度恢复后再检查")
+            next_check = e.reset_at + 1
+        except Exception as e:
+            # 出错的仓库按最短间隔重试，避免反复立即检查
+            logger.exception(f"检查 {owner}/{repo} 失败: {e}")
+            next_check = time.time() + interval
+        self.state.set_schedule(owner, repo, next_check, interval)
+        logger.info(f"{owner}/{repo} 下次检查时间: {datetime.fromtimestamp(next_check):%Y-%m-%d %H:%M:%S}")
+    
+    def watch(self):
+        """常驻运行，按每个仓库的检查时间持续更新
+
+        只创建一次更新器和 HTTP 会话。配置文件修改后自动重新加载；收到 SIGINT/SIGTERM
+        后不再开始新的检查，等待正在进行的下载完成后退出，再次收到信号时立即退出。
+        """
+        import signal
+        
+        stop = threading.Event()
+        
+        def handle_signal(signum, frame):
+            if stop.is_set():
+                raise KeyboardInterrupt
+            logger.info("收到退出信号，等待正在进行的下载完成后退出（再次按 Ctrl+C 立即退出）")
+            stop.set()
+        
+        signal.signal(signal.SIGINT, handle_signal)
+        signal.signal(signal.SIGTERM, handle_signal)
+        
+        config_mtime = os.stat(self.config_path).st_mtime_ns
+        next_checks = self.state.schedules()
+        self.purge_trash()
+        logger.info(f"进入 watch 模式，共 {len(self.config['repositories'])} 个仓库")
+        while not stop.is_set():
+            # 配置文件被修改时重新加载，新增的仓库立即检查
+            try:
+                mtime = os.stat(self.config_path).st_mtime_ns
+                if mtime != config_mtime:
+                    config_mtime = mtime
+                    self.reload_config()
+            except (OSError, ValueError) as e:
+                logger.error(f"重新加载配置失败，继续使用原配置: {e}")
+
+            now = time.time()
+            repositories = [(r["owner"], r["repo"]) for r in self.config["repositories"]]
+            due = [key for key in repositories if next_checks.get(key, 0) <= now]
+            if due:
+                self.metrics = RunMetrics()
+                self.scheduler.run_all(0, [(self._watch_check, (owner, repo, stop), {}) for owner, repo in due])
+                self.response_cache.save()
+                self.state.save_mirror_stats(self.mirror_pool.snapshot())
+                self.write_run_report()
+                next_checks = self.state.schedules()
+                continue
+
+            # 等到最早的检查时间，最多 60 秒检查一次配置文件
+            wake = min((next_checks.get(key, now) for key in repositories), default=now + 60)
+            stop.wait(min(max(wake - now, 1), 60))
+        
+        self.response_cache.save()
+        self.state.save_mirror_stats(self.mirror_pool.snapshot())
+        self.token_pool.log_report()
+        self.purge_trash(wait=True)
+        logger.info("watch 模式已退出")
     
     def parse_github_url(self, url):
         """从GitHub URL中解析出所有者和仓库名"""
-        # 匹配格式: https://github.com/owner/repo 或 github.com/owner/repo
-        pattern = r'(?:https?://)?(?:www\.)?github\.com/([^/]+)/([^/]+)'
+        # 匹配格式: https://github.com/owner/repo 或 github.com/owner/repo（可带 .git 后缀或后续路径）
+        pattern = r'(?:https?://)?(?:www\.)?github\.com/([^/\s]+)/([^/\s]+?)(?:\.git)?(?:[/?#]|$)'
         match = re.match(pattern, url)
         if match:
             return match.group(1), match.group(2)
@@ -368,75 +3351,499 @@ class GithubReleaseUpdater:
         """列出所有仓库及其版本信息"""
         print("\n已配置的仓库:")
         print("-" * 80)
+        savings = self.state.delta_savings()
         for idx, repo_info in enumerate(self.config["repositories"], 1):
             owner = repo_info["owner"]
             repo = repo_info["repo"]
             max_versions = repo_info.get("max_versions", self.default_max_versions)
-            repo_dir = self.base_dir / owner / repo
-            
+
             print(f"[{idx}] 仓库: {owner}/{repo} (保留版本数: {max_versions})")
-            if repo_dir.exists():
-                versions = [d.name for d in repo_dir.iterdir() if d.is_dir()]
-                total_size = self.get_directory_size(repo_dir)
+            # 版本和大小从状态库读取，不遍历下载目录
+            releases = self.state.releases(owner, repo)
+            if releases:
+                versions = [r["tag"] for r in releases]
+                total_size = sum(r["total_size"] for r in releases)
+                latest = self.state.latest_release(owner, repo)
                 print(f"    版本数量: {len(versions)}")
                 print(f"    总大小: {self.format_size(total_size)}")
                 print(f"    版本列表: {', '.join(versions)}")
-                if versions:
-                    latest_version = versions[0]  # 假设版本按时间倒序排列
-                    latest_path = repo_dir / latest_version
-                    if latest_path.exists():
-                        print(f"    最新版本: {latest_version} -> {latest_path}")
+                print(f"    最新版本: {latest['tag']} -> {latest['path']}")
+                skipped = self.state.skipped_assets(owner, repo)
+                if skipped:
+                    print(f"    按规则跳过: {len(skipped)} 个文件")
+                storage = savings.get(f"{owner}/{repo}")
+                if storage:
+                    print(f"    增量存储: {storage['files']} 个文件，实际占用 {self.format_size(storage['stored_size'])}，"
+                          f"节省 {self.format_size(storage['saved_bytes'])}")
             else:
                 print("    尚未下载任何版本")
             print("-" * 80)
 
-    def calculate_file_hashes(self, file_path):
-        """计算文件的多种哈希值"""
+    def calculate_file_hashes(self, file_path, algorithms=None):
+        """分块读取文件，一次遍历计算所有配置的哈希值（或 algorithms 中的哈希值）"""
+        algorithms = algorithms or self.hash_algorithms
         hashes = {}
         try:
+            hashers = [hashlib.new(name) for name in algorithms]
             with open(file_path, 'rb') as f:
-                data = f.read()
-                hashes['md5'] = hashlib.md5(data).hexdigest()
-                hashes['sha1'] = hashlib.sha1(data).hexdigest()
-                hashes['sha256'] = hashlib.sha256(data).hexdigest()
-                hashes['sha512'] = hashlib.sha512(data).hexdigest()
+                while True:
+                    chunk = f.read(HASH_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    for hasher in hashers:
+                        hasher.update(chunk)
+            for name, hasher in zip(algorithms, hashers):
+                hashes[name] = hasher.hexdigest()
         except Exception as e:
             logger.error(f"计算文件哈希值时出错 {file_path}: {e}")
         return hashes
 
-    def generate_file_info(self, directory):
-        """生成目录下所有文件的信息记录"""
-        info = []
-        for root, _, files in os.walk(directory):
-            for file in files:
-                if file == "files_info.txt":  # 跳过信息文件本身
+    def _load_file_info_cache(self, directory):
+        """读取目录的哈希缓存 {相对路径: {"key": [大小, 修改时间(ns), inode], "hashes": {...}}}"""
+        try:
+            with open(os.path.join(directory, FILE_INFO_CACHE), 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            return cache if isinstance(cache, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def generate_file_info(self, directory, known_hashes=None, sources=None):
+        """生成目录下所有文件的信息记录
+
+        known_hashes 为 {相对路径: 哈希值字典}，例如下载时已计算好的哈希值；
+        其余文件的大小、修改时间和 inode 与目录哈希缓存 (.files_info.cache.json) 一致时
+        直接使用缓存，只有新增或变化的文件才重新读取计算。同时写入机器可读的清单
+        files_info.json，sources 为 {相对路径: {"expected_size": 版本 JSON 中的大小, "url": 下载地址}}，
+        未提供时沿用已有清单中的值。增量存储的文件按还原后的文件记录，清单中另记 storage。
+        没有任何变化时不重写。返回 {相对路径: {"size": 字节数, "hashes": 哈希值字典}}。
+        """
+        known_hashes = known_hashes or {}
+        cache = self._load_file_info_cache(directory)
+        manifest = self.read_manifest(directory)
+        sources = {name: dict(manifest.get(name, {}), **(sources or {}).get(name, {})) for name in
+                   set(manifest) | set(sources or {})}
+        entries = {}
+        new_cache = {}
+        info = []
+        result = {}
+        cached_count = cached_bytes = hashed_count = hashed_bytes = 0
+        for root, _, files in os.walk(directory):
+            for file in files:
+                if is_file_info_ignored(file):  # 跳过信息文件、缓存和未完成的文件
+                    continue
+                file_path = os.path.join(root, file)
+                stat = os.stat(file_path)
+                size = stat.st_size
+                storage = None
+                if file.endswith(DELTA_SUFFIX):
+                    # 增量存储的文件按还原后的文件记录，同时存在完整文件时（转换中断）以完整文件为准
+                    file_path = file_path[:-len(DELTA_SUFFIX)]
+                    if os.path.exists(file_path):
+                        continue
+                    try:
+                        header = DeltaStore.read_header(file_path + DELTA_SUFFIX)
+                    except (OSError, ValueError) as e:
+                        logger.error(f"无法读取增量存储文件 {file_path}{DELTA_SUFFIX}: {e}")
+                        continue
+                    size = header["size"]
+                    storage = {"method": header["method"], "stored_size": stat.st_size,
+                               "base": f"{header['base_tag']}/{header['base_name']}" if header.get("base_tag") else None}
+                relative_path = os.path.relpath(file_path, directory)
+                key = [size, stat.st_mtime_ns, stat.st_ino]
+                entry = cache.get(relative_path)
+                if known_hashes.get(relative_path):
+                    hashes = known_hashes[relative_path]
+                    hashed_count += 1
+                    hashed_bytes += size
+                elif (entry and entry.get("key") == key
+                      and all(name in entry.get("hashes", {}) for name in self.hash_algorithms)):
+                    hashes = {name: entry["hashes"][name] for name in self.hash_algorithms}
+                    cached_count += 1
+                    cached_bytes += size
+                else:
+                    hashes = self.calculate_file_hashes(file_path) if storage is None else self._delta_hashes(file_path)
+                    hashed_count += 1
+                    hashed_bytes += size
+                new_cache[relative_path] = {"key": key, "hashes": hashes}
+                result[relative_path] = {"size": size, "hashes": hashes}
+                file_time = datetime.fromtimestamp(stat.st_mtime)
+                source = sources.get(relative_path, {})
+                entries[relative_path] = {
+                    "size": size,
+                    "expected_size": source.get("expected_size"),
+                    "modified": file_time.isoformat(timespec="seconds"),
+                    "hashes": hashes,
+                    "url": source.get("url")
+                }
+                if storage is not None:
+                    entries[relative_path]["storage"] = storage
+                
+                info.append({
+                    "文件名": relative_path,
+                    "大小": self.format_size(size),
+                    "修改时间": file_time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "哈希值": hashes,
+                    "存储": storage
+                })
+        
+        logger.info(f"文件信息 {directory}: 使用缓存 {cached_count} 个 ({self.format_size(cached_bytes)})，"
+                    f"重新计算 {hashed_count} 个 ({self.format_size(hashed_bytes)})")
+        
+        info_file = os.path.join(directory, "files_info.txt")
+        if new_cache == cache and os.path.exists(info_file) and entries == manifest:
+            return result
+        
+        # 将信息写入文件，每个文件都先写临时文件再替换，serve/verify 不会读到写了一半的记录
+        lines = ["文件信息记录", "=" * 50, ""]
+        for item in info:
+            lines.append(f"文件名: {item['文件名']}")
+            lines.append(f"大小: {item['大小']}")
+            lines.append(f"修改时间: {item['修改时间']}")
+            if item["存储"]:
+                lines.append(f"存储: 增量 ({item['存储']['method']})，实际占用 {self.format_size(item['存储']['stored_size'])}")
+            lines.append("哈希值:")
+            for hash_type, hash_value in item['哈希值'].items():
+                lines.append(f"  {hash_type}: {hash_value}")
+            lines.append("-" * 50)
+        _write_text_atomic(info_file, "\n".join(lines) + "\n")
+        _write_text_atomic(os.path.join(directory, FILE_MANIFEST), json.dumps({
+            "format": 1,
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            "files": entries
+        }, ensure_ascii=False, indent=1))
+        _write_text_atomic(os.path.join(directory, FILE_INFO_CACHE), json.dumps(new_cache, ensure_ascii=False))
+        return result
+    
+    def _delta_hashes(self, path):
+        """计算增量存储的文件还原后的哈希值（不写入磁盘）"""
+        try:
+            return self.delta_store.digests(path, self.hash_algorithms)
+        except (OSError, ValueError) as e:
+            logger.error(f"计算文件哈希值时出错，无法还原增量存储的文件 {path}: {e}")
+            return {}
+    
+    def read_manifest(self, directory):
+        """读取 files_info.json，返回 {相对路径: {"size", "expected_size", "modified", "hashes", "url"}}"""
+        try:
+            with open(os.path.join(directory, FILE_MANIFEST), 'r', encoding='utf-8') as f:
+                files = json.load(f).get("files", {})
+            return files if isinstance(files, dict) else {}
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def read_file_info(self, directory):
+        """读取记录的哈希值，返回 {相对路径: 哈希值字典}
+
+        优先读取 files_info.json，没有时解析 files_info.txt，都不存在时返回空字典。
+        """
+        manifest = self.read_manifest(directory)
+        if manifest:
+            return {name: entry.get("hashes", {}) for name, entry in manifest.items()}
+        hashes = {}
+        current = None
+        try:
+            with open(os.path.join(directory, "files_info.txt"), 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.rstrip("\n")
+                    if line.startswith("文件名: "):
+                        current = hashes.setdefault(line[len("文件名: "):], {})
+                    elif line.startswith("  ") and current is not None and ": " in line:
+                        hash_type, hash_value = line.strip().split(": ", 1)
+                        current[hash_type] = hash_value
+        except FileNotFoundError:
+            pass
+        return hashes
+
+    def index_release_dir(self, owner, repo, tag, release_dir, published_at=None, skipped=()):
+        """根据磁盘上已完整下载的版本目录写入状态库，哈希值优先取自 files_info.txt"""
+        recorded = self.read_file_info(release_dir)
+        files = []
+        deltas = []
+        for root, _, names in os.walk(release_dir):
+            for name in names:
+                if is_file_info_ignored(name):
                     continue
-                file_path = os.path.join(root, file)
-                relative_path = os.path.relpath(file_path, directory)
-                file_size = os.path.getsize(file_path)
-                file_time = datetime.fromtimestamp(os.path.getmtime(file_path))
-                hashes = self.calculate_file_hashes(file_path)
-                
-                info.append({
-                    "文件名": relative_path,
-                    "大小": self.format_size(file_size),
-                    "修改时间": file_time.strftime("%Y-%m-%d %H:%M:%S"),
-                    "哈希值": hashes
+                file_path = os.path.join(root, name)
+                if name.endswith(DELTA_SUFFIX):
+                    # 增量存储的文件按还原后的文件记录
+                    file_path = file_path[:-len(DELTA_SUFFIX)]
+                    if os.path.exists(file_path):
+                        continue
+                    try:
+                        header = DeltaStore.read_header(file_path + DELTA_SUFFIX)
+                    except (OSError, ValueError) as e:
+                        logger.error(f"无法读取增量存储文件 {file_path}{DELTA_SUFFIX}: {e}")
+                        continue
+                    relative_path = os.path.relpath(file_path, release_dir)
+                    deltas.append((relative_path, header, os.path.getsize(file_path + DELTA_SUFFIX)))
+                    files.append({
+                        "name": relative_path,
+                        "size": header["size"],
+                        "digests": recorded.get(relative_path) or self._delta_hashes(file_path)
+                    })
+                    continue
+                relative_path = os.path.relpath(file_path, release_dir)
+                files.append({
+                    "name": relative_path,
+                    "size": os.path.getsize(file_path),
+                    "digests": recorded.get(relative_path) or self.calculate_file_hashes(file_path)
                 })
+        self.state.record_release(owner, repo, tag, published_at, release_dir, files, skipped)
+        for name, header, stored_size in deltas:
+            self.state.record_delta(owner, repo, tag, name, header["method"], header["size"], stored_size,
+                                    header.get("base_tag"), header.get("base_name"))
+
+    def _select_repositories(self, repo_index):
+        """返回序号对应的仓库配置列表，repo_index 为 None 时返回所有仓库，序号无效时返回 None"""
+        if repo_index is None:
+            return self.config["repositories"]
+        if 1 <= repo_index <= len(self.config["repositories"]):
+            return [self.config["repositories"][repo_index - 1]]
+        logger.error(f"无效的仓库序号: {repo_index}")
+        return None
+    
+    def compact(self, repo_index=None):
+        """把仓库较旧的保留版本转为增量存储（compact 命令，不要求启用 delta_storage）"""
+        repositories = self._select_repositories(repo_index)
+        if repositories is None:
+            return False
+        saved = sum(self.compact_repository(r["owner"], r["repo"]) for r in repositories)
+        logger.info(f"增量存储转换完成，本次节省 {self.format_size(saved)}")
+        return True
+    
+    def restore(self, repo_index=None):
+        """把增量存储的文件全部还原为完整文件（restore 命令），返回是否全部成功"""
+        repositories = self._select_repositories(repo_index)
+        if repositories is None:
+            return False
+        results = [self.restore_repository(r["owner"], r["repo"]) for r in repositories]
+        return all(results)
+    
+    def _verify_items(self, repositories):
+        """逐个版本生成需要校验的文件，优先使用清单 files_info.json，没有清单时使用状态库记录"""
+        for repo_info in repositories:
+            owner, repo = repo_info["owner"], repo_info["repo"]
+            for row in self.state.releases(owner, repo):
+                release_dir = Path(row["path"])
+                entries = self.read_manifest(release_dir)
+                if not entries:
+                    entries = {asset["name"]: {"size": asset["size"], "expected_size": None,
+                                               "hashes": json.loads(asset["digests"]), "url": asset["url"]}
+                               for asset in self.state.assets(owner, repo, row["tag"])}
+                for name, entry in sorted(entries.items()):
+                    yield {"owner": owner, "repo": repo, "tag": row["tag"], "name": name,
+                           "path": release_dir / name, "entry": entry}
+    
+    def verify(self, repo_index=None, repair=False, jobs=None):
+        """校验已保留的版本，返回仍然损坏的文件列表（仓库序号无效时返回 None）
+
+        第一遍只读取元数据，检查文件是否存在、大小是否与记录和版本 JSON 一致；第二遍由
+        jobs 个线程（默认为 CPU 核心数）分块流式计算哈希值，与清单中记录的最强算法比较。
+        同时进行的校验任务数有上限，内存占用与文件数量和大小无关；去重存储中链接到同一
+        内容的文件只读取一次；增量存储的文件从增量文件还原（不写入磁盘）后计算。
+        repair 为 True 时只重新下载损坏的文件。
+        """
+        repositories = self._select_repositories(repo_index)
+        if repositories is None:
+            return None
         
-        # 将信息写入文件
-        info_file = os.path.join(directory, "files_info.txt")
-        with open(info_file, 'w', encoding='utf-8') as f:
-            f.write("文件信息记录\n")
-            f.write("=" * 50 + "\n\n")
-            for item in info:
-                f.write(f"文件名: {item['文件名']}\n")
-                f.write(f"大小: {item['大小']}\n")
-                f.write(f"修改时间: {item['修改时间']}\n")
-                f.write("哈希值:\n")
-                for hash_type, hash_value in item['哈希值'].items():
-                    f.write(f"  {hash_type}: {hash_value}\n")
-                f.write("-" * 50 + "\n")
+        workers = jobs or os.cpu_count() or 1
+        broken = []
+        broken_paths = set()
+        start = time.monotonic()
+        
+        def report(item, reason):
+            logger.error(f"文件损坏 {item['path']}: {reason}")
+            broken.append(dict(item, reason=reason))
+            broken_paths.add(item["path"])
+        
+        # 第一遍：检查文件是否存在和大小
+        total_files = total_bytes = 0
+        for item in self._verify_items(repositories):
+            total_files += 1
+            entry = item["entry"]
+            size = self.stored_size(item["path"])
+            if size is None:
+                report(item, "增量存储文件已损坏" if DeltaStore.stored_path(item["path"]).exists() else "文件不存在")
+                continue
+            expected = entry.get("expected_size")
+            if size != entry.get("size") or (expected is not None and size != expected):
+                report(item, f"大小不符: 记录 {entry.get('size')} 字节，"
+                             f"版本 JSON {'未知' if expected is None else expected} 字节，实际 {size} 字节")
+                continue
+            total_bytes += size
+        logger.info(f"大小检查完成: {total_files} 个文件 ({self.format_size(total_bytes)})，"
+                    f"发现 {len(broken)} 个损坏，开始使用 {workers} 个线程校验哈希值")
+        
+        # 第二遍：流式计算哈希值
+        linked = {}  # (设备, inode, 算法) -> 哈希值，只记录有多个链接的文件
+        progress = {"files": 0, "bytes": 0, "logged": time.monotonic()}
+        
+        def check(item, stat, algorithm, actual):
+            expected = item["entry"]["hashes"][algorithm]
+            progress["files"] += 1
+            progress["bytes"] += stat.st_size
+            if not actual:
+                report(item, "读取失败")
+            elif actual != expected:
+                report(item, f"{algorithm} 不符: 记录 {expected}，实际 {actual}")
+            if time.monotonic() - progress["logged"] >= 30:
+                progress["logged"] = time.monotonic()
+                elapsed = progress["logged"] - start
+                logger.info(f"已校验 {progress['files']} 个文件 ({self.format_size(progress['bytes'])}，"
+                            f"{self.format_size(progress['bytes'] / elapsed)}/s)")
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+
+            def collect(done):
+                for future in done:
+                    item, stat, algorithm = pending.pop(future)
+                    result = future.result()
+                    if "error" in result:
+                        report(item, f"无法还原: {result['error']}")
+                        continue
+                    actual = result.get(algorithm)
+                    if stat.st_nlink > 1:
+                        linked[(stat.st_dev, stat.st_ino, algorithm)] = actual
+                    check(item, stat, algorithm, actual)
+
+            for item in self._verify_items(repositories):
+                if item["path"] in broken_paths:
+                    continue
+                hashes = item["entry"].get("hashes", {})
+                algorithm = next((name for name in VERIFY_ALGORITHMS
+                                  if hashes.get(name) and name in hashlib.algorithms_available), None)
+                delta = False
+                try:
+                    stat = item["path"].stat()
+                except OSError:
+                    try:
+                        stat = DeltaStore.stored_path(item["path"]).stat()
+                        delta = True
+                    except OSError:
+                        report(item, "文件不存在")
+                        continue
+                if algorithm is None:
+                    continue
+                key = (stat.st_dev, stat.st_ino, algorithm)
+                if stat.st_nlink > 1 and key in linked:
+                    check(item, stat, algorithm, linked[key])
+                    continue
+                if len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                if delta:
+                    future = executor.submit(self._verify_delta, item["path"], algorithm)
+                else:
+                    future = executor.submit(self.calculate_file_hashes, item["path"], [algorithm])
+                pending[future] = (item, stat, algorithm)
+            collect(wait(pending)[0])
+        
+        elapsed = time.monotonic() - start
+        logger.info(f"校验完成: {total_files} 个文件，读取 {progress['files']} 个 "
+                    f"({self.format_size(progress['bytes'])})，耗时 {elapsed:.1f} 秒，损坏 {len(broken)} 个")
+        if not broken:
+            return []
+        if not repair:
+            logger.info("使用 verify --repair 重新下载损坏的文件")
+            return broken
+        
+        # 重新下载损坏的文件，按版本更新文件信息和状态库
+        results = self.scheduler.run_all(2, [(self._repair_file, (item,), {}) for item in broken])
+        repaired = {}
+        for item, digests in zip(broken, results):
+            if digests:
+                repaired.setdefault((item["owner"], item["repo"], item["tag"]), {})[item["name"]] = digests
+        for (owner, repo, tag), known_hashes in repaired.items():
+            release_dir = next(item["path"].parent for item in broken
+                               if (item["owner"], item["repo"], item["tag"]) == (owner, repo, tag))
+            file_info = self.generate_file_info(str(release_dir), known_hashes)
+            for name in known_hashes:
+                item = file_info.get(name)
+                if item is None:
+                    continue
+                if self.dedup and item["hashes"].get("sha256"):
+                    self.store_blob(release_dir / name, item["hashes"]["sha256"])
+                self.state.update_asset(owner, repo, tag, name, item["size"], item["hashes"])
+        remaining = [item for item, digests in zip(broken, results) if not digests]
+        logger.info(f"修复完成: 重新下载 {len(broken) - len(remaining)} 个文件，失败 {len(remaining)} 个")
+        return remaining
+    
+    def _verify_delta(self, path, algorithm):
+        """从增量文件还原内容并计算哈希值，无法还原时返回 {"error": 原因}"""
+        try:
+            return self.delta_store.digests(path, [algorithm])
+        except (OSError, ValueError, KeyError) as e:
+            return {"error": str(e)}
+    
+    def _repair_file(self, item):
+        """重新下载损坏的文件（先下载到暂存目录再替换），成功时返回哈希值字典"""
+        entry = item["entry"]
+        path = item["path"]
+        if not entry.get("url"):
+            logger.error(f"没有记录下载地址，无法修复: {path}")
+            return None
+        staging_dir = self.staging_path(item["owner"], item["repo"], item["tag"])
+        temp_path = staging_dir / item["name"]
+        digests = {}
+        try:
+            if not self.download_asset(entry["url"], temp_path, digests, entry.get("expected_size")):
+                return None
+        except RateLimitExceeded as e:
+            logger.warning(f"{e}，暂时无法修复: {path}")
+            return None
+        
+        # 去重存储中的内容本身已损坏时先移除，修复后的文件重新放入
+        sha256 = entry.get("hashes", {}).get("sha256")
+        if self.dedup and sha256:
+            blob = self.blob_path(sha256)
+            try:
+                if blob.exists() and path.exists() and os.path.samefile(blob, path):
+                    blob.unlink()
+            except OSError:
+                pass
+        os.makedirs(path.parent, exist_ok=True)
+        os.replace(temp_path, path)
+        # 增量存储的文件修复后改为完整保存
+        delta_path = DeltaStore.stored_path(path)
+        if delta_path.exists():
+            delta_path.unlink()
+            self.state.remove_delta(item["owner"], item["repo"], item["tag"], item["name"])
+        try:
+            os.removedirs(staging_dir)
+        except OSError:
+            pass
+        
+        changed = [name for name, value in entry.get("hashes", {}).items() if digests.get(name, value) != value]
+        if changed:
+            logger.warning(f"重新下载的文件与记录的哈希值不同（上游文件可能已更新）: {path}")
+        logger.info(f"已修复: {path}")
+        return digests
+    
+    def serve(self, host=None, port=None):
+        """通过 HTTP 提供下载目录，地址和端口默认使用配置中的 serve_host/serve_port"""
+        host = host or self.config.get("serve_host", "0.0.0.0")
+        port = port if port is not None else self.config.get("serve_port", 8080)
+        MirrorServer(self, host, port).run()
+    
+    def reindex(self):
+        """从下载目录重建状态库（只导入已完整下载的版本）"""
+        logger.info(f"正在从 {self.base_dir} 重建状态库...")
+        self.state.clear()
+        count = 0
+        if self.base_dir.exists():
+            for owner_dir in self.base_dir.iterdir():
+                if not owner_dir.is_dir() or owner_dir.name.startswith("."):
+                    continue
+                for repo_dir in owner_dir.iterdir():
+                    if not repo_dir.is_dir() or repo_dir.name.startswith("."):
+                        continue
+                    for release_dir in repo_dir.iterdir():
+                        if release_dir.is_dir() and self.is_release_complete(release_dir):
+                            self.index_release_dir(owner_dir.name, repo_dir.name, release_dir.name, release_dir)
+                            count += 1
+        logger.info(f"状态库重建完成，共 {count} 个版本")
 
     def set_default_max_versions(self, versions):
         """设置默认的最大版本数量"""
@@ -454,7 +3861,7 @@ class GithubReleaseUpdater:
         except ValueError:
             logger.error("版本数量必须是整数")
             return False
-            
+
     def set_repository_max_versions(self, owner, repo, versions):
         """为指定仓库设置最大版本数量"""
         try:
@@ -464,16 +3871,11 @@ class GithubReleaseUpdater:
                 return False
                 
             # 查找仓库
-            repo_found = False
-            for repo_info in self.config["repositories"]:
-                if repo_info["owner"] == owner and repo_info["repo"] == repo:
-                    repo_info["max_versions"] = versions
-                    repo_found = True
-                    break
-            
-            if not repo_found:
+            repo_info = self.find_repository(owner, repo)
+            if repo_info is None:
                 logger.error(f"仓库不存在: {owner}/{repo}")
                 return False
+            repo_info["max_versions"] = versions
                 
             self._save_config()
             logger.info(f"已为 {owner}/{repo} 设置版本数量: {versions}")
@@ -482,24 +3884,962 @@ class GithubReleaseUpdater:
             logger.error("版本数量必须是整数")
             return False
 
+class AsyncUpdateEngine:
+    """基于 asyncio 的更新引擎（update --engine async）
+
+    API 查询和下载都在同一个事件循环中通过 aiohttp 完成，不再为每个请求占用一个线程；
+    写文件、计算哈希和生成文件信息放到线程池执行。版本选择、下载目录结构、.part 续传、
+    分段下载和 files_info.txt 都复用 GithubReleaseUpdater 的实现，两种引擎可以交替使用。
+    """
+
+    def __init__(self, updater):
+        self.updater = updater
+        self.concurrency = updater.config.get("async_concurrency", 32)
+        self.session = None
+        self._slots = None
+        self._host_semaphores = {}
+
+    @staticmethod
+    def available():
+        """检查依赖的 aiohttp 是否可用，不可用时记录错误并返回 False"""
+        try:
+            import aiohttp  # noqa: F401
+        except ImportError:
+            if getattr(sys, "frozen", False):
+                logger.error("此可执行文件没有包含异步引擎依赖的 aiohttp，请改用 --engine thread")
+            else:
+                logger.error("异步引擎需要安装 aiohttp: pip install -r requirements.txt，或改用 --engine thread")
+            return False
+        return True
+
+    def run(self, force_repo_index=None, discovery=None):
+        """运行一次更新"""
+        import asyncio
+        
+        asyncio.run(self._run(force_repo_index, discovery))
+
+    async def _run(self, force_repo_index, discovery):
+        import asyncio
+        import aiohttp
+        
+        updater = self.updater
+        repositories = updater.config["repositories"]
+        force = False
+        prefetched = {}
+        if force_repo_index is not None:
+            if not 1 <= force_repo_index <= len(repositories):
+                logger.error(f"无效的仓库序号: {force_repo_index}")
+                return
+            repositories = [repositories[force_repo_index - 1]]
+            force = True
+        else:
+            prefetched = await asyncio.to_thread(updater.prefetch_releases, discovery)
+        
+        self._slots = asyncio.Semaphore(self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=300)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            self.session = session
+            calls = [(r["owner"], r["repo"], prefetched.get((r["owner"], r["repo"]))) for r in repositories]
+            while calls:
+                deferred = []
+                await asyncio.gather(*(self._update_or_defer(deferred, owner, repo, force, releases)
+                                       for owner, repo, releases in calls))
+                if not deferred or not await asyncio.to_thread(
+                        updater.wait_for_rate_limit, min(d[3] for d in deferred), len(deferred)):
+                    break
+                calls = [(owner, repo, releases) for owner, repo, releases, _ in deferred]
+
+    async def _update_or_defer(self, deferred, owner, repo, force, releases):
+        """异步版本的 GithubReleaseUpdater._update_or_defer
+
+        与线程引擎的任务一样，单个仓库出错只记录日志，不影响其他仓库和共用的会话。
+        """
+        try:
+            await self._update_repository(owner, repo, force, releases)
+        except RateLimitExceeded as e:
+            logger.warning(f"{owner}/{repo}: {e}，推迟到额度恢复后再更新")
+            deferred.append((owner, repo, releases, e.reset_at))
+        except Exception:
+            logger.exception(f"更新 {owner}/{repo} 时出错")
+
+    def _host_slot(self, url):
+        """返回限制该主机并发请求数的信号量"""
+        import asyncio
+        
+        host = urlparse(url).netloc
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            scheduler = self.updater.scheduler
+            semaphore = asyncio.Semaphore(scheduler.host_limits.get(host, scheduler.default_host_limit))
+            self._host_semaphores[host] = semaphore
+        return semaphore
+
+    async def _throttle(self, amount):
+        """按全局带宽上限等待"""
+        import asyncio
+        
+        bucket = self.updater.scheduler.bucket
+        if bucket:
+            wait = bucket.reserve(amount)
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    async def _fetch_releases(self, url):
+        """异步版本的 GithubReleaseUpdater._fetch_releases，共用同一个条件请求缓存
+
+        与线程引擎的 API 会话相同，连接错误和 5xx 响应最多重试 max_retries 次，
+        重试间隔按 1、2、4 秒递增。
+        """
+        import asyncio
+        import aiohttp
+        
+        cache = self.updater.response_cache
+        pool = self.updater.token_pool
+        metrics = self.updater.metrics
+        max_retries = self.updater.max_retries
+        headers = cache.conditional_headers(url)
+        retries = 0
+        async with self._host_slot(url):
+            while True:
+                if retries:
+                    await asyncio.sleep(2 ** (retries - 1))
+                token, delay = pool.acquire()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                request_headers = dict(headers)
+                if token:
+                    request_headers["Authorization"] = f"token {token}"
+                try:
+                    response = await self.session.get(url, headers=request_headers)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    metrics.api_call()
+                    if retries >= max_retries:
+                        raise
+                    retries += 1
+                    logger.warning(f"API 请求失败，{retries}/{max_retries} 次重试: {url}: {e}")
+                    continue
+                try:
+                    rate_limited = pool.update(token, "core", response.headers, response.status)
+                    metrics.api_call(response.status, rate_limited)
+                    if response.status in API_RETRY_STATUSES and retries < max_retries:
+                        retries += 1
+                        logger.warning(f"API 返回 HTTP {response.status}，{retries}/{max_retries} 次重试: {url}")
+                        continue
+                    if rate_limited:
+                        logger.warning(f"触发 API 速率限制 (HTTP {response.status})，换用其他 Token 重试: {url}")
+                        continue
+                    if response.status == 304:
+                        cached = cache.get(url)
+                        if cached is not None:
+                            return releases_from_cache(cached), cached["next"], True
+                        # 缓存丢失时去掉条件头重新请求
+                        headers = {}
+                        continue
+                    response.raise_for_status()
+                    parser = ReleaseListParser()
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        parser.feed(chunk)
+                    releases = parser.close()
+                    next_link = response.links.get("next")
+                    next_url = str(next_link["url"]) if next_link else None
+                    cache.store(url, response.headers,
+                                {"releases": [release.to_json() for release in releases], "next": next_url})
+                    return releases, next_url, False
+                finally:
+                    response.release()
+
+    async def _get_releases(self, owner, repo, limit):
+        """异步版本的 GithubReleaseUpdater.get_releases"""
+        import asyncio
+        import aiohttp
+        
+        api_url = self.updater.api_url
+        try:
+            if limit == 1:
+                try:
+                    releases, _, not_modified = await self._fetch_releases(
+                        f"{api_url}/repos/{owner}/{repo}/releases/latest")
+                    return releases, not_modified
+                except aiohttp.ClientResponseError as e:
+                    if e.status != 404:
+                        raise
+
+            releases = []
+            not_modified = True
+            url = f"{api_url}/repos/{owner}/{repo}/releases?per_page={min(limit, 100)}"
+            while url and len(releases) < limit:
+                page, url, page_not_modified = await self._fetch_releases(url)
+                releases.extend(page)
+                not_modified = not_modified and page_not_modified
+            if not_modified and releases:
+                logger.info(f"{owner}/{repo} 的发布版本未变化 (304)")
+            return releases[:limit], not_modified
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.error(f"获取 {owner}/{repo} 的发布版本失败: {e}")
+            return [], False
+
+    async def _update_repository(self, owner, repo, force=False, releases=None):
+        """异步版本的 GithubReleaseUpdater.update_repository"""
+        import asyncio
+        
+        updater = self.updater
+        with updater.metrics.phase(owner, repo, "total"):
+            logger.info(f"正在检查 {owner}/{repo} 的更新...")
+            max_versions = updater.get_repository_max_versions(owner, repo)
+
+            if releases is None:
+                with updater.metrics.phase(owner, repo, "api"):
+                    releases, not_modified = await self._get_releases(owner, repo, max_versions)
+            else:
+                releases, not_modified = releases[:max_versions], False
+
+            if not releases:
+                logger.info(f"没有找到 {owner}/{repo} 的发布版本")
+                return
+
+            to_download = await asyncio.to_thread(
+                updater.plan_repository_update, owner, repo, releases, max_versions, not_modified, force)
+            if to_download is None:
+                return
+
+            results = await asyncio.gather(*(self._process_release(owner, repo, release, force)
+                                             for release in to_download), return_exceptions=True)
+            for release, result in zip(to_download, results):
+                if isinstance(result, RateLimitExceeded):
+                    raise result
+                if isinstance(result, Exception):
+                    logger.error(f"处理 {owner}/{repo} 的版本 {release.tag} 时出错",
+                                 exc_info=(type(result), result, result.__traceback__))
+            await asyncio.to_thread(updater.cleanup_old_versions, owner, repo, releases, max_versions)
+
+    async def _process_release(self, owner, repo, release, force=False):
+        """异步版本的 GithubReleaseUpdater.process_release"""
+        import asyncio
+        
+        updater = self.updater
+        prepared = await asyncio.to_thread(updater.prepare_release, owner, repo, release, force)
+        if prepared is None:
+            return
+        release_dir, downloads, known_hashes = prepared
+        with updater.metrics.phase(owner, repo, "download"):
+            results = await asyncio.gather(*(self._download_asset(*args) for args in downloads),
+                                           return_exceptions=True)
+        for args, result in zip(downloads, results):
+            if isinstance(result, RateLimitExceeded):
+                raise result
+            if isinstance(result, Exception):
+                logger.error(f"下载 {args[0]} 时出错", exc_info=(type(result), result, result.__traceback__))
+        results = [result is True for result in results]
+        await asyncio.to_thread(updater.finish_release, owner, repo, release, release_dir, results,
+                                known_hashes, downloads)
+
+    async def _download_asset(self, url, save_path, digests=None, expected_size=None, segments=1, meta=None):
+        """异步版本的 GithubReleaseUpdater.download_asset"""
+        import asyncio
+        import aiohttp
+        
+        updater = self.updater
+        meta = {} if meta is None else meta
+        save_path = Path(save_path)
+        part_path = save_path.with_name(save_path.name + ".part")
+        resume_path = part_path.with_name(part_path.name + ".resume")
+        os.makedirs(save_path.parent, exist_ok=True)
+        resume = await asyncio.to_thread(updater.load_resume_state, url, part_path, meta.get("updated_at"))
+        
+        pool = updater.mirror_pool if updater.uses_mirror(url) else None
+        attempts = updater.max_retries + (len(pool.prefixes) - 1 if pool else 0)
+        failed = set()
+        prefix = None
+        if pool and expected_size and expected_size >= updater.mirror_race_threshold and not part_path.exists():
+            prefix = await self._race_mirrors(url)
+        
+        for attempt in range(1, attempts + 1):
+            if pool:
+                prefix = pool.acquire(exclude=failed, prefer=None if attempt > 1 else prefix)
+            if attempt > 1 and (pool is None or prefix in failed):
+                await asyncio.sleep(updater.retry_delay)
+            download_url = updater.resolve_download_url(url, prefix)
+            host = urlparse(download_url).netloc
+            start_bytes = meta.get("bytes", 0)
+            attempt_start = time.monotonic()
+            try:
+                # 分段下载：没有单连接下载留下的 .part 文件时才使用
+                segment_state = part_path.with_name(part_path.name + ".segments")
+                if segments > 1 and expected_size and (segment_state.exists() or not part_path.exists()):
+                    if not part_path.exists():
+                        resume = updater.save_resume_state(url, part_path, meta.get("updated_at"), host, None)
+                    if await self._download_segmented(download_url, part_path, expected_size, segments, meta):
+                        os.replace(part_path, save_path)
+                        resume_path.unlink(missing_ok=True)
+                        updater._finish_attempt(host, prefix, meta, start_bytes, attempt_start, True)
+                        if digests is not None:
+                            digests.update(await asyncio.to_thread(updater.calculate_file_hashes, save_path))
+                        logger.info(f"分段下载完成: {save_path}")
+                        return True
+                    logger.info(f"服务器不支持分段下载，改用单连接下载: {url}")
+                    segments = 1
+                
+                offset = part_path.stat().st_size if part_path.exists() else 0
+                if expected_size is not None and offset > expected_size:
+                    offset = 0
+                
+                hashers = [hashlib.new(name) for name in updater.hash_algorithms]
+                if expected_size is None or offset < expected_size:
+                    async with self._slots, self._host_slot(download_url):
+                        offset = await self._stream_to_part(download_url, url, part_path, offset, hashers, meta,
+                                                            resume)
+                else:
+                    await asyncio.to_thread(updater._hash_prefix, part_path, offset, hashers)
+                
+                # 校验文件大小后再原子地移动到目标位置
+                size = part_path.stat().st_size
+                if expected_size is not None and size != expected_size:
+                    if size > expected_size:
+                        part_path.unlink()
+                        resume_path.unlink(missing_ok=True)
+                        resume.clear()
+                    raise aiohttp.ClientPayloadError(
+                        f"文件大小不符: 期望 {expected_size} 字节，实际 {size} 字节")
+                os.replace(part_path, save_path)
+                resume_path.unlink(missing_ok=True)
+                updater._finish_attempt(host, prefix, meta, start_bytes, attempt_start, True)
+                
+                if digests is not None:
+                    digests.update((name, hasher.hexdigest())
+                                   for name, hasher in zip(updater.hash_algorithms, hashers))
+                logger.info(f"下载完成: {save_path}")
+                return True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                updater._finish_attempt(host, prefix, meta, start_bytes, attempt_start, False)
+                failed.add(prefix)
+                meta["retries"] = attempt
+                if attempt < attempts:
+                    via = f"（{MirrorPool.label(prefix)}）" if pool and len(pool.prefixes) > 1 else ""
+                    logger.warning(f"下载失败{via}，{attempt}/{attempts} 次重试: {url}")
+                else:
+                    logger.error(f"下载失败 {url}: {e}")
+            finally:
+                if pool:
+                    pool.release(prefix)
+        return False
+
+    async def _race_mirrors(self, url):
+        """异步版本的 GithubReleaseUpdater._race_mirrors，有前缀胜出后取消落后的请求"""
+        import asyncio
+        import aiohttp
+        
+        updater = self.updater
+        pool = updater.mirror_pool
+        candidates = pool.candidates(updater.config.get("mirror_race_candidates", 3))
+        if len(candidates) < 2:
+            return None
+        
+        async def probe(prefix):
+            probe_url = updater.resolve_download_url(url, prefix)
+            received = 0
+            async with self._host_slot(probe_url):
+                start = time.monotonic()
+                try:
+                    headers = {"Range": f"bytes=0-{updater.mirror_race_bytes - 1}"}
+                    response = await self.session.get(probe_url, headers=headers,
+                                                      timeout=aiohttp.ClientTimeout(total=30))
+                    try:
+                        response.raise_for_status()
+                        async for chunk in response.content.iter_chunked(16384):
+                            received += len(chunk)
+                            if received >= updater.mirror_race_bytes:
+                                break
+                    finally:
+                        response.release()
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    pool.record(prefix, received, time.monotonic() - start, False)
+                    return None
+            pool.record(prefix, received, time.monotonic() - start, True)
+            return prefix
+        
+        tasks = [asyncio.ensure_future(probe(prefix)) for prefix in candidates]
+        winner = None
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                winner = await next_done
+                if winner is not None:
+                    logger.info(f"竞速选择下载前缀 {MirrorPool.label(winner)}: {url}")
+                    break
+        finally:
+            # 取消落后的请求并等待它们结束，不留下未完成的任务
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return winner
+
+    async def _download_get(self, url, headers=None):
+        """异步版本的 GithubReleaseUpdater._download_get"""
+        import asyncio
+        import aiohttp
+        
+        updater = self.updater
+        if updater.uses_mirror(url):
+            return await self.session.get(url, headers=headers)
+        pool = updater.token_pool
+        while True:
+            token, delay = pool.acquire()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            request_headers = dict(headers or {})
+            if token:
+                request_headers["Authorization"] = f"token {token}"
+            try:
+                response = await self.session.get(url, headers=request_headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                updater.metrics.api_call()
+                raise
+            api_response = response.history[0] if response.history else response
+            rate_limited = pool.update(token, "core", api_response.headers, api_response.status)
+            updater.metrics.api_call(api_response.status, rate_limited)
+            if not rate_limited:
+                return response
+            response.release()
+            logger.warning(f"触发 API 速率限制 (HTTP {api_response.status})，换用其他 Token 重试: {url}")
+
+    async def _stream_to_part(self, download_url, url, part_path, offset, hashers, meta=None, resume=None):
+        """从 offset 处请求并写入 .part 文件，返回实际的起始位置
+
+        resume 为续传校验信息（见 GithubReleaseUpdater.load_resume_state），从头写入时就地更新。
+        """
+        import asyncio
+        
+        host = urlparse(download_url).netloc
+        meta = {} if meta is None else meta
+        resume = {} if resume is None else resume
+        response = await self._download_get(download_url, self.updater.resume_headers(offset, resume, host))
+        try:
+            if offset and response.status == 416:
+                # 服务器不接受该范围（文件可能已变化），从头下载
+                response.release()
+                offset = 0
+                response = await self._download_get(download_url)
+            response.raise_for_status()
+            meta["etag"] = response.headers.get("ETag")
+            if offset and response.status != 206:
+                logger.info(f"服务器不支持断点续传或文件已变化，重新下载: {url}")
+                offset = 0
+            elif offset:
+                logger.info(f"从 {self.updater.format_size(offset)} 处继续下载: {url}")
+            if not offset:
+                resume.clear()
+                resume.update(await asyncio.to_thread(self.updater.save_resume_state, url, part_path,
+                                                      meta.get("updated_at"), host, meta["etag"]))
+
+            # 续传时先用已下载的部分初始化哈希计算
+            await asyncio.to_thread(self.updater._hash_prefix, part_path, offset, hashers)
+            f = await asyncio.to_thread(open, part_path, 'r+b' if offset else 'wb')
+            try:
+                await asyncio.to_thread(_truncate_at, f, offset)
+                # 固定大小的缓冲区在整个下载过程中重复使用，避免反复分配造成内存碎片
+                buffer = memoryview(bytearray(ASYNC_WRITE_BUFFER))
+                used = 0
+                async for chunk in response.content.iter_chunked(65536):
+                    self.updater.metrics.transfer(host, len(chunk), meta)
+                    await self._throttle(len(chunk))
+                    if used + len(chunk) > len(buffer):
+                        await asyncio.to_thread(_write_and_hash, f, buffer[:used], hashers)
+                        used = 0
+                    buffer[used:used + len(chunk)] = chunk
+                    used += len(chunk)
+                if used:
+                    await asyncio.to_thread(_write_and_hash, f, buffer[:used], hashers)
+            finally:
+                await asyncio.to_thread(f.close)
+        finally:
+            response.release()
+        return offset
+
+    async def _download_segmented(self, download_url, part_path, size, segments, meta=None):
+        """异步版本的 GithubReleaseUpdater._download_segmented，进度文件格式相同"""
+        import asyncio
+        import aiohttp
+        
+        updater = self.updater
+        host = urlparse(download_url).netloc
+        state_path = part_path.with_name(part_path.name + ".segments")
+        state = updater.load_segment_state(part_path, size)
+        if state is None:
+            # 探测服务器是否支持 Range 请求
+            async with self._host_slot(download_url):
+                async with self.session.get(download_url, headers={"Range": "bytes=0-0"}) as response:
+                    response.raise_for_status()
+                    if response.status != 206:
+                        return False
+            state = await asyncio.to_thread(updater.create_segment_state, part_path, size, segments)
+        
+        def save_state():
+            with open(state_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f)
+        
+        async def fetch(segment):
+            start, end, done = segment
+            if start + done > end:
+                return
+            try:
+                async with self._slots, self._host_slot(download_url):
+                    headers = {"Range": f"bytes={start + done}-{end}"}
+                    async with self.session.get(download_url, headers=headers) as response:
+                        response.raise_for_status()
+                        if response.status != 206:
+                            raise aiohttp.ClientPayloadError("服务器未返回分段内容")
+                        f = await asyncio.to_thread(open, part_path, 'r+b')
+                        try:
+                            async for chunk in response.content.iter_chunked(ASYNC_WRITE_BUFFER):
+                                chunk = chunk[:end + 1 - start - segment[2]]
+                                await asyncio.to_thread(_write_at, f, start + segment[2], chunk)
+                                segment[2] += len(chunk)
+                                updater.metrics.transfer(host, len(chunk), meta)
+                                await self._throttle(len(chunk))
+                        finally:
+                            await asyncio.to_thread(f.close)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"分段 {start}-{end} 下载失败: {download_url}: {e}")
+        
+        await asyncio.to_thread(save_state)
+        try:
+            await asyncio.gather(*(fetch(segment) for segment in state["ranges"]))
+        finally:
+            await asyncio.to_thread(save_state)
+        
+        missing = sum(end - start + 1 - done for start, end, done in state["ranges"])
+        if missing:
+            raise aiohttp.ClientPayloadError(f"分段下载不完整，还差 {missing} 字节")
+        state_path.unlink()
+        return True
+
+class MirrorServer:
+    """通过 HTTP 向局域网提供下载目录（serve 命令）
+
+    所有连接由一个 asyncio 事件循环处理，不为每个连接创建线程；文件内容通过
+    loop.sendfile 发送，平台支持时使用 os.sendfile 零拷贝。只提供状态库中记录的
+    版本和文件，请求路径不直接映射到磁盘，不会访问下载目录以外的文件。
+
+    路由:
+        /index.json                        所有仓库、版本和文件的 JSON 索引
+        /<owner>/<repo>/index.json         单个仓库的索引
+        /<owner>/<repo>/<版本>/            版本的文件列表 (JSON)
+        /<owner>/<repo>/<版本>/<文件名>     文件，支持 Range、If-Range 和 If-None-Match
+        /<owner>/<repo>/latest/...         重定向到最新版本的对应地址
+    文件的 ETag 为状态库中记录的 sha256。增量存储的文件在首次请求时还原到缓存目录后发送。
+    状态库变化后（例如另一个进程运行了 update）自动重新加载索引。
+    """
+
+    REFRESH_INTERVAL = 5  # 检查状态库是否变化的最小间隔（秒）
+    IDLE_TIMEOUT = 60  # 保持连接的空闲超时（秒）
+    MAX_HEADER_SIZE = 64 * 1024
+
+    def __init__(self, updater, host="0.0.0.0", port=8080):
+        self.updater = updater
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.bytes_sent = 0
+        self._repos = {}  # (owner, repo) -> {"latest": 标签, "releases": {标签: 版本信息}}
+        self._index_json = None
+        self._signature = None
+        self._checked = 0.0
+
+    def run(self):
+        """启动服务，直到按 Ctrl+C"""
+        import asyncio
+        
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            pass
+        logger.info(f"服务已停止，共处理 {self.requests} 个请求，发送 {self.updater.format_size(self.bytes_sent)}")
+
+    async def _serve(self):
+        import asyncio
+        
+        await self._refresh(force=True)
+        server = await asyncio.start_server(self._handle, self.host, self.port, limit=self.MAX_HEADER_SIZE,
+                                            backlog=1024)
+        addresses = ", ".join(f"http://{sock.getsockname()[0]}:{sock.getsockname()[1]}/" for sock in server.sockets)
+        logger.info(f"正在提供 {self.updater.base_dir}（{len(self._repos)} 个仓库）: {addresses}，索引: /index.json")
+        async with server:
+            await server.serve_forever()
+
+    def _state_signature(self):
+        """状态库（含 WAL 文件）和配置文件的修改时间，变化时重新加载索引"""
+        signature = []
+        for path in (self.updater.state.path, Path(str(self.updater.state.path) + "-wal"),
+                     Path(self.updater.config_path)):
+            try:
+                stat = path.stat()
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def _load_index(self):
+        """从状态库读取所有仓库的版本和文件（在线程池中执行）"""
+        updater = self.updater
+        state = updater.state
+        repos = {}
+        for repo_info in updater.config["repositories"]:
+            owner, repo = repo_info["owner"], repo_info["repo"]
+            releases = {}
+            for row in state.releases(owner, repo):
+                files = {asset["name"]: {"size": asset["size"], "sha256": asset["sha256"]}
+                         for asset in state.assets(owner, repo, row["tag"])}
+                releases[row["tag"]] = {"tag": row["tag"], "published_at": row["published_at"],
+                                        "path": row["path"], "total_size": row["total_size"], "files": files}
+            latest = state.latest_release(owner, repo)
+            repos[(owner, repo)] = {"latest": latest["tag"] if latest else None, "releases": releases}
+        return repos
+
+    async def _refresh(self, force=False):
+        """状态库变化时重新加载索引，最多每 REFRESH_INTERVAL 秒检查一次"""
+        import asyncio
+        
+        now = time.monotonic()
+        if not force and now - self._checked < self.REFRESH_INTERVAL:
+            return
+        self._checked = now
+        signature = self._state_signature()
+        if not force and signature == self._signature:
+            return
+        self._repos = await asyncio.to_thread(self._load_index)
+        self._signature = signature
+        self._index_json = None
+
+    def _repo_json(self, owner, repo, info):
+        """单个仓库的索引"""
+        return {
+            "owner": owner,
+            "repo": repo,
+            "latest": info["latest"],
+            "releases": [self._release_json(owner, repo, release) for release in info["releases"].values()]
+        }
+
+    def _release_json(self, owner, repo, release):
+        """单个版本的文件列表"""
+        base = "/" + "/".join(quote(part) for part in (owner, repo, release["tag"]))
+        return {
+            "tag": release["tag"],
+            "published_at": release["published_at"],
+            "total_size": release["total_size"],
+            "files": [{"name": name, "size": item["size"], "sha256": item["sha256"],
+                       "href": f"{base}/{quote(name)}"} for name, item in sorted(release["files"].items())]
+        }
+
+    async def _handle(self, reader, writer):
+        """处理一个连接上的所有请求（HTTP/1.1 保持连接）"""
+        import asyncio
+        
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.IDLE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    break
+                if not await self._respond(head, writer):
+                    break
+        except (ConnectionError, OSError):
+            pass
+        except Exception:
+            logger.exception("处理请求时出错")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _respond(self, head, writer):
+        """解析请求并发送响应，返回是否保持连接"""
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            await self._send(writer, 400, close=True)
+            return False
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        self.requests += 1
+        
+        if method not in ("GET", "HEAD"):
+            # 不读取请求体，直接关闭连接
+            await self._send(writer, 405, {"Allow": "GET, HEAD"}, close=True)
+            return False
+        await self._refresh()
+        
+        path = urlparse(target).path
+        parts = [unquote(part) for part in path.strip("/").split("/")] if path.strip("/") else []
+        head_only = method == "HEAD"
+        if parts in ([], ["index.json"]):
+            if self._index_json is None:
+                self._index_json = json.dumps(
+                    {"repositories": [self._repo_json(owner, repo, info) for (owner, repo), info in self._repos.items()]},
+                    ensure_ascii=False).encode("utf-8")
+            return await self._send_json(writer, self._index_json, head_only, keep_alive)
+        
+        info = self._repos.get(tuple(parts[:2])) if len(parts) >= 2 else None
+        if info is None:
+            return await self._send(writer, 404, head_only=head_only, close=not keep_alive)
+        owner, repo = parts[:2]
+        if len(parts) == 2 or parts[2:] == ["index.json"]:
+            body = json.dumps(self._repo_json(owner, repo, info), ensure_ascii=False).encode("utf-8")
+            return await self._send_json(writer, body, head_only, keep_alive)
+        
+        tag, name = parts[2], "/".join(parts[3:])
+        if tag == "latest":
+            if info["latest"] is None:
+                return await self._send(writer, 404, head_only=head_only, close=not keep_alive)
+            location = "/" + "/".join(quote(part) for part in (owner, repo, info["latest"]) + tuple(parts[3:]))
+            if path.endswith("/") and not location.endswith("/"):
+                location += "/"
+            return await self._send(writer, 302, {"Location": location, "Cache-Control": "no-cache"},
+                                    head_only=head_only, close=not keep_alive)
+        
+        release = info["releases"].get(tag)
+        if release is None:
+            return await self._send(writer, 404, head_only=head_only, close=not keep_alive)
+        if not name:
+            body = json.dumps(self._release_json(owner, repo, release), ensure_ascii=False).encode("utf-8")
+            return await self._send_json(writer, body, head_only, keep_alive)
+        if name in release["files"]:
+            item = release["files"][name]
+        elif name in ("files_info.txt", FILE_MANIFEST):
+            item = {"sha256": None}
+        else:
+            return await self._send(writer, 404, head_only=head_only, close=not keep_alive)
+        return await self._send_file(writer, Path(release["path"]) / name, item["sha256"], headers,
+                                     head_only, keep_alive)
+
+    async def _send_file(self, writer, path, sha256, request_headers, head_only, keep_alive):
+        """发送文件（或 Range 指定的一段），文件内容通过 sendfile 发送
+
+        打开文件和读取文件状态都在线程中进行，磁盘较慢时不阻塞其他连接。
+        """
+        import asyncio
+        import mimetypes
+        from email.utils import formatdate
+        
+        try:
+            f = await asyncio.to_thread(open, path, "rb")
+        except FileNotFoundError:
+            # 增量存储的文件先还原到缓存目录
+            try:
+                f = await asyncio.to_thread(open, await asyncio.to_thread(self.updater.delta_store.full_path, path),
+                                            "rb")
+            except (OSError, ValueError) as e:
+                if DeltaStore.stored_path(path).exists():
+                    logger.error(f"无法还原增量存储的文件 {path}: {e}")
+                return await self._send(writer, 404, head_only=head_only, close=not keep_alive)
+        except OSError:
+            return await self._send(writer, 404, head_only=head_only, close=not keep_alive)
+        try:
+            stat = await asyncio.to_thread(os.fstat, f.fileno())
+            size = stat.st_size
+            etag = f'"{sha256}"' if sha256 else f'W/"{size:x}-{stat.st_mtime_ns:x}"'
+            headers = {
+                "ETag": etag,
+                "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+                "Accept-Ranges": "bytes",
+                "Content-Type": mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+            }
+            if_none_match = request_headers.get("if-none-match")
+            if if_none_match and (if_none_match.strip() == "*" or
+                                  etag in (tag.strip() for tag in if_none_match.split(","))):
+                return await self._send(writer, 304, headers, head_only=True, close=not keep_alive)
+
+            status = 200
+            start, length = 0, size
+            range_header = request_headers.get("range")
+            if_range = request_headers.get("if-range")
+            if range_header and (if_range is None or if_range == etag):
+                byte_range = _parse_byte_range(range_header, size)
+                if byte_range is False:
+                    headers["Content-Range"] = f"bytes */{size}"
+                    return await self._send(writer, 416, headers, head_only=head_only, close=not keep_alive)
+                if byte_range is not None:
+                    start, end = byte_range
+                    length = end - start + 1
+                    status = 206
+                    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+            headers["Content-Length"] = str(length)
+            self._write_head(writer, status, headers, close=not keep_alive)
+            if not head_only and length:
+                await asyncio.get_running_loop().sendfile(writer.transport, f, start, length)
+                self.bytes_sent += length
+            await writer.drain()
+        finally:
+            await asyncio.to_thread(f.close)
+        logger.debug(f"{status} {path} ({start}+{length})")
+        return keep_alive
+
+    async def _send_json(self, writer, body, head_only, keep_alive):
+        """发送 JSON 响应，返回是否保持连接"""
+        return await self._send(writer, 200, {"Content-Type": "application/json; charset=utf-8",
+                                              "Cache-Control": "no-cache"},
+                                body, head_only=head_only, close=not keep_alive)
+
+    async def _send(self, writer, status, headers=None, body=b"", head_only=False, close=False):
+        """发送响应头和较小的响应体，返回是否保持连接"""
+        from http import HTTPStatus
+        
+        headers = dict(headers or {})
+        if not body and status >= 400:
+            body = f"{status} {HTTPStatus(status).phrase}\n".encode("ascii")
+            headers.setdefault("Content-Type", "text/plain; charset=utf-8")
+        if status != 304:
+            headers.setdefault("Content-Length", str(len(body)))
+        self._write_head(writer, status, headers, close)
+        if body and not head_only:
+            writer.write(body)
+            self.bytes_sent += len(body)
+        await writer.drain()
+        return not close
+
+    def _write_head(self, writer, status, headers, close):
+        """写入状态行和响应头"""
+        from http import HTTPStatus
+        from email.utils import formatdate
+        
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+                 f"Date: {formatdate(usegmt=True)}",
+                 "Server: grm"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        lines.append("Connection: close" if close else "Connection: keep-alive")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+def releases_from_cache(body):
+    """把响应缓存中保存的内容转换为 Release 列表（兼容旧版本缓存的完整接口响应）"""
+    data = body["releases"] if "releases" in body else body["data"]
+    if isinstance(data, dict):
+        data = [data]
+    return [Release.from_json(item) for item in data]
+
+def _parse_byte_range(header, size):
+    """解析单个字节范围 (bytes=a-b、bytes=a-、bytes=-n)，返回 (起始, 结束)，结束位置包含在内
+
+    多个范围或格式不支持（包括 int() 能接受但不是十进制数字的 +5、1_0 等）时返回 None
+    （发送完整文件），范围无法满足时返回 False。
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    match = re.fullmatch(r"\s*([0-9]*)\s*-\s*([0-9]*)\s*", spec)
+    if match is None or not (match[1] or match[2]):
+        return None
+    first, last = match.groups()
+    if not first:
+        suffix = int(last)
+        if suffix <= 0 or not size:
+            return False
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+def _write_text_atomic(path, text):
+    """先写入临时文件再替换，读取方不会看到写了一半的文件"""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def _truncate_at(f, offset):
+    """把文件截断到 offset 并将写入位置移到末尾"""
+    f.seek(offset)
+    f.truncate()
+
+def _write_and_hash(f, data, hashers):
+    """写入数据并更新各个哈希对象（在线程池中执行）"""
+    f.write(data)
+    for hasher in hashers:
+        hasher.update(data)
+
+def _write_at(f, offset, data):
+    """在文件指定位置写入数据（在线程池中执行）"""
+    f.seek(offset)
+    f.write(data)
+
+def _match_length(base, offset, target, i, minimum):
+    """已知 base[offset:] 与 target[i:] 至少有 minimum 字节相同，返回相同部分的长度"""
+    n, m = len(target), len(base)
+    length = minimum
+    step = 1 << 16
+    while step:
+        while (i + length + step <= n and offset + length + step <= m
+               and target[i + length:i + length + step] == base[offset + length:offset + length + step]):
+            length += step
+        step >>= 1
+    return length
+
+def _anchor_byte(sample, spacing):
+    """返回在 sample 中的平均间隔最接近 spacing 的字节（作为分块差异算法的锚点）"""
+    counts = [sample.count(value) for value in range(256)]
+    expected = len(sample) / spacing
+    return bytes([min((value for value in range(256) if counts[value]),
+                      key=lambda value: abs(counts[value] - expected))])
+
+def _match_length_back(base, offset, target, i, limit):
+    """返回 base[:offset] 与 target[:i] 末尾相同部分的长度，最多 limit 字节"""
+    limit = min(limit, offset)
+    length = 0
+    while length < limit and base[offset - length - 1] == target[i - length - 1]:
+        length += 1
+    return length
+
+def _asset_key(name, tag):
+    """去掉文件名中的版本号，用于在相邻版本之间找到对应的文件"""
+    key = name.replace(tag, "\0")
+    version = tag.lstrip("vV")
+    if version and version != tag:
+        key = key.replace(version, "\0")
+    return key
+
+COMMANDS = ("add", "import", "remove", "update", "proxy", "default-versions", "set-versions",
+            "list", "reindex", "verify", "compact", "restore", "watch", "serve")
+
 def print_usage():
     """打印使用说明"""
     print("使用方法:")
-    print("  python main.py add <GitHub仓库URL> [<版本数>]  - 添加GitHub仓库")
+    print("  python main.py add <GitHub仓库URL> [<GitHub仓库URL> ...] [<版本数>]  - 添加一个或多个GitHub仓库")
+    print("  python main.py import <文件> [<版本数>]        - 从文件批量导入仓库（每行一个URL，可跟版本数）")
     print("  python main.py remove <GitHub仓库URL>        - 移除GitHub仓库")
     print("  python main.py update                        - 更新所有仓库")
     print("  python main.py update -f <序号>               - 强制更新指定序号的仓库")
-    print("  python main.py proxy <代理前缀>               - 设置代理前缀")
+    print("  python main.py update --graphql              - 使用 GraphQL 批量获取所有仓库的版本（需要 Token）")
+    print("  python main.py update --engine async         - 使用基于 asyncio 的更新引擎")
+    print("  python main.py proxy <代理前缀> [<代理前缀> ...] - 设置代理前缀，多个前缀时自动选择最快的（direct 表示直连）")
     print("  python main.py default-versions <版本数>      - 设置默认保留版本数")
     print("  python main.py set-versions <GitHub仓库URL> <版本数> - 设置指定仓库的保留版本数")
     print("  python main.py list                          - 列出所有仓库")
+    print("  python main.py reindex                       - 从下载目录重建状态库")
+    print("  python main.py verify [<序号>|all] [--repair] [-j <线程数>] - 校验已下载的文件，--repair 重新下载损坏的文件")
+    print("  python main.py compact [<序号>|all]           - 把较旧的保留版本转为增量存储，节省磁盘空间")
+    print("  python main.py restore [<序号>|all]           - 把增量存储的文件还原为完整文件")
+    print("  python main.py watch                         - 常驻运行，按各仓库的发布节奏定时检查更新")
+    print("  python main.py serve [<端口>] [--host <地址>]  - 通过 HTTP 向局域网提供下载目录（默认 0.0.0.0:8080）")
     print("  python main.py help                          - 显示帮助信息")
     print("\n示例:")
     print("  python main.py add https://github.com/sqlmapproject/sqlmap 5  - 添加仓库并保留5个版本")
     print("  python main.py proxy https://g.bravexist.cn/")
+    print("  python main.py proxy https://g.bravexist.cn/ direct - 在代理和直连之间自动选择")
     print("  python main.py default-versions 3            - 设置全局默认保留3个版本")
     print("  python main.py set-versions https://github.com/sqlmapproject/sqlmap 2 - 设置该仓库保留2个版本")
     print("  python main.py update -f 1                   - 强制更新第一个仓库")
+    print("  python main.py verify 1 --repair             - 校验第一个仓库并修复损坏的文件")
+    print("  python main.py import 管理.txt 2              - 导入文件中的所有仓库，各保留2个版本")
 
 def main():
     if len(sys.argv) < 2:
@@ -507,20 +4847,48 @@ def main():
         print_usage()
         return
 
-    updater = GithubReleaseUpdater()
     command = sys.argv[1]
-
+    if command == "help":
+        print_banner()
+        print_usage()
+        return
+    if command not in COMMANDS:
+        print("错误：未知命令")
+        print_usage()
+        return
+    
+    updater = GithubReleaseUpdater()
     if command == "add":
         if len(sys.argv) < 3:
             print("错误：请提供 GitHub 仓库 URL")
             return
-        owner, repo = updater.parse_github_url(sys.argv[2])
-        if not owner or not repo:
-            print("错误：无效的 GitHub 仓库 URL")
-            return
+        args = sys.argv[2:]
+        
+        max_versions = None
+        if len(args) >= 2 and not updater.parse_github_url(args[-1])[0]:
+            try:
+                max_versions = int(args.pop())
+                if max_versions < 1:
+                    print("错误：版本数量必须大于等于1")
+                    return
+            except ValueError:
+                print("错误：版本数量必须是整数")
+                return
         
+        repositories = []
+        for url in args:
+            owner, repo = updater.parse_github_url(url)
+            if not owner or not repo:
+                print(f"错误：无效的 GitHub 仓库 URL: {url}")
+                return
+            repositories.append((owner, repo, max_versions))
+        updater.add_repositories(repositories)
+    elif command == "import":
+        if len(sys.argv) not in (3, 4):
+            print("错误：请提供包含 GitHub 仓库 URL 的文件")
+            return
         max_versions = None
-        if len(sys.argv) >= 4:
+        if len(sys.argv) == 4:
             try:
                 max_versions = int(sys.argv[3])
                 if max_versions < 1:
@@ -529,8 +4897,10 @@ def main():
             except ValueError:
                 print("错误：版本数量必须是整数")
                 return
-                
-        updater.add_repository(owner, repo, max_versions)
+        try:
+            updater.import_repositories(sys.argv[2], max_versions)
+        except OSError as e:
+            print(f"错误：无法读取文件: {e}")
     elif command == "remove":
         if len(sys.argv) != 3:
             print("错误：请提供 GitHub 仓库 URL")
@@ -542,21 +4912,36 @@ def main():
         updater.remove_repository(owner, repo)
     elif command == "update":
         force_repo_index = None
-        if len(sys.argv) > 2 and sys.argv[2] == "-f":
-            if len(sys.argv) != 4:
+        discovery = None
+        engine = None
+        args = sys.argv[2:]
+        if "--graphql" in args:
+            args.remove("--graphql")
+            discovery = "graphql"
+        if "--engine" in args:
+            idx = args.index("--engine")
+            if idx + 1 >= len(args) or args[idx + 1] not in ("thread", "async"):
+                print("错误：--engine 只能是 thread 或 async")
+                return
+            engine = args[idx + 1]
+            del args[idx:idx + 2]
+        if args and args[0] == "-f":
+            if len(args) != 2:
                 print("错误：请提供要强制更新的仓库序号")
                 return
             try:
-                force_repo_index = int(sys.argv[3])
+                force_repo_index = int(args[1])
             except ValueError:
                 print("错误：仓库序号必须是数字")
                 return
-        updater.update_all(force_repo_index)
+        if updater.update_all(force_repo_index, discovery, engine) is False:
+            sys.exit(1)
     elif command == "proxy":
-        if len(sys.argv) != 3:
+        if len(sys.argv) < 3:
             print("错误：请提供代理前缀")
             return
-        updater.set_proxy_prefix(sys.argv[2])
+        # direct 表示直连（不使用代理）
+        updater.set_proxy_prefix(*("" if prefix == "direct" else prefix for prefix in sys.argv[2:]))
     elif command == "default-versions":
         if len(sys.argv) != 3:
             print("错误：请提供默认版本数量")
@@ -575,12 +4960,76 @@ def main():
             print("设置仓库版本数量失败")
     elif command == "list":
         updater.list_repositories()
-    elif command == "help":
-        print_banner()
-        print_usage()
-    else:
-        print("错误：未知命令")
-        print_usage()
+    elif command == "reindex":
+        updater.reindex()
+    elif command == "verify":
+        repo_index = None
+        jobs = None
+        repair = False
+        args = sys.argv[2:]
+        if "--repair" in args:
+            args.remove("--repair")
+            repair = True
+        if "-j" in args:
+            idx = args.index("-j")
+            try:
+                jobs = int(args[idx + 1])
+                if jobs < 1:
+                    raise ValueError
+            except (IndexError, ValueError):
+                print("错误：-j 需要一个正整数")
+                return
+            del args[idx:idx + 2]
+        if len(args) > 1:
+            print("错误：参数过多")
+            return
+        if args and args[0] != "all":
+            try:
+                repo_index = int(args[0])
+            except ValueError:
+                print("错误：仓库序号必须是数字")
+                return
+        broken = updater.verify(repo_index, repair, jobs)
+        if broken:
+            sys.exit(1)
+    elif command in ("compact", "restore"):
+        repo_index = None
+        if len(sys.argv) > 3:
+            print("错误：参数过多")
+            return
+        if len(sys.argv) == 3 and sys.argv[2] != "all":
+            try:
+                repo_index = int(sys.argv[2])
+            except ValueError:
+                print("错误：仓库序号必须是数字")
+                return
+        if not (updater.compact if command == "compact" else updater.restore)(repo_index):
+            sys.exit(1)
+    elif command == "watch":
+        updater.watch()
+    elif command == "serve":
+        host = None
+        port = None
+        args = sys.argv[2:]
+        if "--host" in args:
+            idx = args.index("--host")
+            if idx + 1 >= len(args):
+                print("错误：--host 需要一个地址")
+                return
+            host = args[idx + 1]
+            del args[idx:idx + 2]
+        if len(args) > 1:
+            print("错误：参数过多")
+            return
+        if args:
+            try:
+                port = int(args[0])
+                if not 0 <= port <= 65535:
+                    raise ValueError
+            except ValueError:
+                print("错误：端口必须是 0-65535 之间的整数")
+                return
+        updater.serve(host, port)
 
 if __name__ == "__main__":
     main()
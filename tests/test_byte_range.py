@@ -0,0 +1,74 @@
+import pytest
+
+from grm.main import _parse_byte_range
+
+SIZE = 1000
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-499", (0, 499)),
+    ("bytes=500-999", (500, 999)),
+    ("bytes=999-999", (999, 999)),
+    ("BYTES = 10-19", (10, 19)),
+    ("bytes= 10 - 19 ", (10, 19)),
+])
+def test_closed_range(header, expected):
+    assert _parse_byte_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-", (0, 999)),
+    ("bytes=500-", (500, 999)),
+    ("bytes=999-", (999, 999)),
+])
+def test_open_ended_range(header, expected):
+    assert _parse_byte_range(header, SIZE) == expected
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=-1", (999, 999)),
+    ("bytes=-200", (800, 999)),
+    ("bytes=-1000", (0, 999)),
+    ("bytes=-5000", (0, 999)),  # 超过文件大小时发送整个文件
+])
+def test_suffix_range(header, expected):
+    assert _parse_byte_range(header, SIZE) == expected
+
+
+def test_end_past_eof_is_clamped():
+    assert _parse_byte_range("bytes=900-5000", SIZE) == (900, 999)
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=1000-", SIZE),
+    ("bytes=1000-1005", SIZE),
+    ("bytes=5000-", SIZE),
+    ("bytes=-0", SIZE),
+    ("bytes=20-10", SIZE),
+    ("bytes=0-", 0),
+    ("bytes=-5", 0),
+])
+def test_unsatisfiable(header, size):
+    assert _parse_byte_range(header, size) is False
+
+
+@pytest.mark.parametrize("header", [
+    "bytes=0-1,5-6",
+    "bytes=0-499, 500-999",
+    "items=0-5",
+    "bytes",
+    "bytes=",
+    "bytes=-",
+    "bytes=5",
+    "bytes=a-b",
+    "bytes=0x10-",
+    "bytes=--5",
+    "bytes=-+5",
+    "bytes=+5-",
+    "bytes=1_0-",
+    "bytes=٣-",
+    "bytes=1.5-",
+])
+def test_multiple_or_invalid_is_ignored(header):
+    """多个范围或格式错误时忽略 Range，发送完整文件"""
+    assert _parse_byte_range(header, SIZE) is None
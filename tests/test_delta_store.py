@@ -0,0 +1,231 @@
+import hashlib
+import json
+import random
+
+import pytest
+
+import generate_file_info
+from grm.main import DELTA_SUFFIX, DeltaStore
+
+SIZE = 1536 * 1024
+
+
+def _edit(data, rnd, kind):
+    """按 kind 修改 data 的副本：原位修改、插入、删除、整体错位或混合"""
+    data = bytearray(data)
+    if kind == "shift":
+        return b"\0" + bytes(data[:-1])
+    for _ in range(12):
+        pos = rnd.randrange(len(data) - 8192)
+        length = rnd.randrange(1, 4096)
+        op = rnd.choice(("replace", "insert", "delete")) if kind == "mixed" else kind
+        if op == "replace":
+            data[pos:pos + length] = rnd.randbytes(length)
+        elif op == "insert":
+            data[pos:pos] = rnd.randbytes(length)
+        else:
+            del data[pos:pos + length]
+    return bytes(data)
+
+
+def _write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return DeltaStore(tmp_path / ".delta-cache")
+
+
+@pytest.fixture
+def block_only(monkeypatch):
+    """无论是否安装 bsdiff4 都使用内置的分块差异算法"""
+    monkeypatch.setattr(DeltaStore, "method", staticmethod(lambda: "block"))
+
+
+@pytest.mark.parametrize("kind", ["replace", "insert", "delete", "shift", "mixed"])
+def test_block_round_trip(tmp_path, store, block_only, kind):
+    rnd = random.Random(kind)
+    base = rnd.randbytes(SIZE)
+    target = _edit(base, rnd, kind)
+    _write(tmp_path / "v2" / "app.bin", base)
+    path = tmp_path / "v1" / "app.bin"
+    sha256 = _write(path, target)
+
+    header = store.encode(path, "v1", "app.bin", sha256, tmp_path / "v2" / "app.bin", "v2", "app.bin")
+
+    assert header["method"] == "block"
+    assert header["stored_size"] < len(target) // 10
+    assert not path.exists()
+    assert store.full_path(path).read_bytes() == target
+    assert store.digests(path, ["md5"]) == {"md5": hashlib.md5(target).hexdigest()}
+    assert store.restore(path)["sha256"] == sha256
+    assert path.read_bytes() == target
+    assert not DeltaStore.stored_path(path).exists()
+
+
+def test_block_round_trip_with_coarse_index(tmp_path, store, block_only, monkeypatch):
+    """索引项数受限时索引间隔加大，匹配仍能向前补齐到准确的位置"""
+    monkeypatch.setattr(DeltaStore, "INDEX_LIMIT", 64)
+    monkeypatch.setattr(DeltaStore, "WINDOW", 4096)
+    rnd = random.Random(7)
+    base = rnd.randbytes(SIZE)
+    target = _edit(base, rnd, "mixed")
+    _write(tmp_path / "v2" / "app.bin", base)
+    path = tmp_path / "v1" / "app.bin"
+    sha256 = _write(path, target)
+
+    header = store.encode(path, "v1", "app.bin", sha256, tmp_path / "v2" / "app.bin", "v2", "app.bin")
+
+    assert header["method"] == "block"
+    assert store.restore(path)["size"] == len(target)
+    assert path.read_bytes() == target
+
+
+@pytest.mark.parametrize("kind", ["delete", "insert", "move"])
+def test_block_resyncs_beyond_window(tmp_path, store, block_only, monkeypatch, kind):
+    """删除、插入或移动的内容超过 WINDOW 时由锚点索引重新同步，不会把后面的内容都当作新数据"""
+    monkeypatch.setattr(DeltaStore, "WINDOW", 4096)
+    rnd = random.Random(kind)
+    base = rnd.randbytes(SIZE)
+    cut = SIZE // 3 + 17
+    target = {"delete": base[:cut] + base[cut + 65536:],
+              "insert": base[:cut] + rnd.randbytes(65536) + base[cut:],
+              "move": base[cut:] + base[:cut]}[kind]
+    _write(tmp_path / "v2" / "app.bin", base)
+    path = tmp_path / "v1" / "app.bin"
+    sha256 = _write(path, target)
+
+    header = store.encode(path, "v1", "app.bin", sha256, tmp_path / "v2" / "app.bin", "v2", "app.bin")
+
+    assert header["method"] == "block"
+    assert header["stored_size"] < len(target) // 10
+    assert store.full_path(path).read_bytes() == target
+
+
+def test_block_chain_restores_through_delta_base(tmp_path, store, block_only):
+    """基准文件本身也是增量存储时，先还原基准再还原目标"""
+    rnd = random.Random(3)
+    v3 = rnd.randbytes(SIZE)
+    v2 = _edit(v3, rnd, "mixed")
+    v1 = _edit(v2, rnd, "mixed")
+    _write(tmp_path / "v3" / "app.bin", v3)
+    sha2 = _write(tmp_path / "v2" / "app.bin", v2)
+    sha1 = _write(tmp_path / "v1" / "app.bin", v1)
+
+    assert store.encode(tmp_path / "v2" / "app.bin", "v2", "app.bin", sha2,
+                        tmp_path / "v3" / "app.bin", "v3", "app.bin")
+    assert store.encode(tmp_path / "v1" / "app.bin", "v1", "app.bin", sha1,
+                        tmp_path / "v2" / "app.bin", "v2", "app.bin")
+
+    assert store.depends_on(tmp_path / "v1" / "app.bin", tmp_path / "v3" / "app.bin")
+    assert store.full_path(tmp_path / "v1" / "app.bin").read_bytes() == v1
+    assert store.full_path(tmp_path / "v2" / "app.bin").read_bytes() == v2
+
+
+def test_unrelated_base_falls_back_to_xz(tmp_path, store, block_only):
+    base = random.Random(1).randbytes(SIZE)
+    target = b"".join(b"line %d of a compressible log\n" % i for i in range(60000))
+    _write(tmp_path / "v2" / "app.log", base)
+    path = tmp_path / "v1" / "app.log"
+    sha256 = _write(path, target)
+
+    header = store.encode(path, "v1", "app.log", sha256, tmp_path / "v2" / "app.log", "v2", "app.log")
+
+    assert header["method"] == "xz"
+    assert header["base_tag"] is None and header["base_name"] is None
+    assert store.restore(path)["method"] == "xz"
+    assert path.read_bytes() == target
+
+
+def test_xz_round_trip_without_base(tmp_path, store):
+    target = json.dumps([{"id": i, "name": f"item-{i}"} for i in range(20000)]).encode()
+    path = tmp_path / "v1" / "data.json"
+    sha256 = _write(path, target)
+
+    header = store.encode(path, "v1", "data.json", sha256)
+
+    assert header["method"] == "xz"
+    assert store.full_path(path).read_bytes() == target
+
+
+@pytest.mark.parametrize("data", [random.Random(2).randbytes(SIZE), b"x" * (DeltaStore.MIN_SIZE - 1)],
+                         ids=["incompressible", "small"])
+def test_not_worth_converting_leaves_file(tmp_path, store, data):
+    path = tmp_path / "v1" / "app.bin"
+    sha256 = _write(path, data)
+
+    assert store.encode(path, "v1", "app.bin", sha256) is None
+    assert path.read_bytes() == data
+    assert sorted(p.name for p in path.parent.iterdir()) == ["app.bin"]
+
+
+def test_bsdiff_round_trip(tmp_path, store):
+    pytest.importorskip("bsdiff4")
+    rnd = random.Random(5)
+    base = rnd.randbytes(SIZE)
+    target = _edit(base, rnd, "mixed")
+    _write(tmp_path / "v2" / "app.bin", base)
+    path = tmp_path / "v1" / "app.bin"
+    sha256 = _write(path, target)
+
+    header = store.encode(path, "v1", "app.bin", sha256, tmp_path / "v2" / "app.bin", "v2", "app.bin")
+
+    assert header["method"] == "bsdiff4"
+    assert store.full_path(path).read_bytes() == target
+
+
+def test_header(tmp_path, store, block_only):
+    rnd = random.Random(4)
+    base = rnd.randbytes(SIZE)
+    target = _edit(base, rnd, "replace")
+    _write(tmp_path / "v2.0" / "tool-2.0.bin", base)
+    path = tmp_path / "v1.0" / "tool-1.0.bin"
+    sha256 = _write(path, target)
+
+    header = store.encode(path, "v1.0", "tool-1.0.bin", sha256, tmp_path / "v2.0" / "tool-2.0.bin",
+                          "v2.0", "tool-2.0.bin")
+    delta_path = DeltaStore.stored_path(path)
+
+    assert delta_path.name == "tool-1.0.bin" + DELTA_SUFFIX
+    assert delta_path.read_bytes().startswith(DeltaStore.MAGIC)
+    assert header["stored_size"] == delta_path.stat().st_size
+    stored = DeltaStore.read_header(delta_path)
+    assert stored == {"method": "block", "size": len(target), "sha256": sha256, "tag": "v1.0",
+                      "name": "tool-1.0.bin", "base_tag": "v2.0", "base_name": "tool-2.0.bin"}
+    assert DeltaStore.base_path(delta_path, stored) == tmp_path / "v2.0" / "tool-2.0.bin"
+    # generate_file_info.py 不导入 grm，自行读取同一格式的头部
+    assert generate_file_info.read_delta_header(delta_path) == stored
+
+
+def test_read_header_rejects_other_files(tmp_path):
+    path = tmp_path / "plain.bin"
+    path.write_bytes(b"not a delta file\n{}\n")
+
+    with pytest.raises(ValueError):
+        DeltaStore.read_header(path)
+    assert generate_file_info.read_delta_header(path) is None
+
+
+def test_corrupt_delta_is_rejected(tmp_path, store, block_only):
+    rnd = random.Random(6)
+    base = rnd.randbytes(SIZE)
+    target = _edit(base, rnd, "insert")
+    _write(tmp_path / "v2" / "app.bin", base)
+    path = tmp_path / "v1" / "app.bin"
+    sha256 = _write(path, target)
+    store.encode(path, "v1", "app.bin", sha256, tmp_path / "v2" / "app.bin", "v2", "app.bin")
+    delta_path = DeltaStore.stored_path(path)
+    data = bytearray(delta_path.read_bytes())
+    data[-40:-20] = bytes(20)
+    delta_path.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError):
+        store.restore(path)
+    with pytest.raises(ValueError):
+        store.full_path(path)
+    assert not path.exists()
+    assert not path.with_name(path.name + ".restore").exists()
+    assert delta_path.exists()
@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from grm.main import Release, ReleaseListParser
+
+
+def _release(tag, assets=2):
+    """接口返回的版本字典，正文等无关字段中有引号、括号、逗号和多字节字符"""
+    return {
+        "tag_name": tag,
+        "name": f"版本 {tag} 🚀",
+        "published_at": "2024-05-01T12:00:00Z",
+        "body": 'Fixes "quoted" ], [ and {braces}, commas, a \\ backslash\nand 中文说明 ✅',
+        "author": {"login": "octocat", "site_admin": False, "tags": ["a", "b"]},
+        "reactions": {"+1": 3, "heart": 1},
+        "zipball_url": f"https://api.github.com/repos/o/r/zipball/{tag}",
+        "tarball_url": f"https://api.github.com/repos/o/r/tarball/{tag}",
+        "assets": [{
+            "name": f"工具-{tag}-{idx}.zip",
+            "size": 1000 + idx,
+            "browser_download_url": f"https://github.com/o/r/releases/download/{tag}/tool-{idx}.zip",
+            "updated_at": "2024-05-01T12:30:00Z",
+            "digest": "sha256:" + "ab" * 32,
+            "uploader": {"login": "ci-bot"}
+        } for idx in range(assets)]
+    }
+
+
+RELEASES = [_release("v3.0"), _release("v2.0", assets=0), _release("v1.0-测试")]
+
+
+def _expected(items):
+    return [Release.from_json(item).to_json() for item in items]
+
+
+def _parse(data, chunks):
+    parser = ReleaseListParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    return [release.to_json() for release in parser.close()]
+
+
+def _split(data, size):
+    return [data[pos:pos + size] for pos in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_array_in_small_chunks(indent):
+    data = json.dumps(RELEASES, ensure_ascii=False, indent=indent).encode("utf-8")
+    for size in (1, 2, 3, 5, 64, len(data)):
+        assert _parse(data, _split(data, size)) == _expected(RELEASES)
+
+
+def test_array_split_at_every_position():
+    """在任意位置（字符串中间、多字节字符中间、对象之间）分块都得到相同结果"""
+    data = json.dumps(RELEASES[:2], ensure_ascii=False).encode("utf-8")
+    for pos in range(len(data) + 1):
+        assert _parse(data, [data[:pos], data[pos:]]) == _expected(RELEASES[:2])
+
+
+def test_single_object_for_latest():
+    data = json.dumps(RELEASES[0], ensure_ascii=False, indent=1).encode("utf-8")
+    for pos in range(len(data) + 1):
+        assert _parse(data, [data[:pos], data[pos:]]) == _expected(RELEASES[:1])
+
+
+@pytest.mark.parametrize("text", ["[]", " [ ] \n", "[\n]"])
+def test_empty_array(text):
+    assert _parse(text.encode(), [text.encode()]) == []
+
+
+def test_releases_are_available_before_close():
+    data = json.dumps(RELEASES, ensure_ascii=False).encode("utf-8")
+    parser = ReleaseListParser()
+    parser.feed(data[:data.index(b'{"tag_name": "v2.0"')])
+    assert [release.tag for release in parser.releases] == ["v3.0"]
+
+
+@pytest.mark.parametrize("shape", ["array", "object"])
+def test_truncated_input(shape):
+    items = RELEASES if shape == "array" else RELEASES[0]
+    data = json.dumps(items, ensure_ascii=False).encode("utf-8")
+    for pos in range(len(data)):
+        parser = ReleaseListParser()
+        parser.feed(data[:pos])
+        with pytest.raises(ValueError):
+            parser.close()
+
+
+@pytest.mark.parametrize("text", [
+    '<html>rate limited</html>',
+    '"not a release"',
+    '[1, 2]',
+    '[{"tag_name": "v1"}] trailing',
+    '{"tag_name": "v1"} {"tag_name": "v2"}',
+    '[{"tag_name": "v1",}]',
+    '{"message": "Not Found", "documentation_url": "https://docs.github.com"}',
+    '[{"tag_name": "v1", "assets": [{"size": 1}]}]',
+    '[{"tag_name": "v1", "assets": 5}]',
+])
+def test_invalid_input(text):
+    parser = ReleaseListParser()
+    with pytest.raises(ValueError):
+        parser.feed(text.encode())
+        parser.close()